@@ -1,16 +1,33 @@
-from flask import Flask, render_template_string, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, g
 import requests
 import random
+import secrets
 import time
-from collections import deque
+from collections import OrderedDict, deque
 import os
+import atexit
+import logging
+import logging.handlers
+import bisect
+import heapq
+import queue
 import sqlite3
+import threading
 from pathlib import Path
 import gzip
-import shutil
+import hashlib
+import io
+import json
+import mmap
 import re
+import struct
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import quote
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)  # 静态资源由 static_asset 预压缩后提供
 
 # 词汇级别定义
 LEVELS = {
@@ -21,15 +38,252 @@ LEVELS = {
     'N1': '高级词汇'
 }
 
+def content_word_id(kanji, kana):
+    """没有 EDICT 序号的词（Jisho、基本词汇）按内容生成稳定 id"""
+    return 'h' + hashlib.sha1(f'{kanji}\t{kana}'.encode('utf-8')).hexdigest()[:12]
+
+def edict_word_id(ent_seq):
+    """EDICT 词条的稳定 id"""
+    return f'e{ent_seq}'
+
+def parse_edict_word_id(word_id):
+    """从稳定 id 中取回 EDICT 词条序号，不是 EDICT 词条时返回 None"""
+    if isinstance(word_id, str) and word_id[:1] == 'e' and word_id[1:].isdigit():
+        return int(word_id[1:])
+    return None
+
+class WordBuffer:
+    """按稳定 id 索引的词汇缓冲区，随机取词、查找和淘汰都是 O(1)"""
+
+    RETIRED_LIMIT = 1024  # 保留多少个刚被淘汰的词用于判题
+
+    def __init__(self, maxlen):
+        self.maxlen = maxlen
+        self._lock = threading.Lock()
+        self._words = []         # 稠密数组，用于随机取词
+        self._positions = {}     # id -> 在 _words 中的位置
+        self._order = deque()    # 加入顺序，超出容量时淘汰最旧的词
+        # 刚被淘汰的词仍可用于判题：会话过期后卡片随之丢失，非 EDICT 词（Jisho 镜像、基本词汇）
+        # 无法回查词典，只能在这里找到
+        self._retired = OrderedDict()
+
+    def __len__(self):
+        return len(self._words)
+
+    def __bool__(self):
+        return bool(self._words)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._words))
+
+    def extend(self, words):
+        """加入一批词，已有的 id 会被跳过"""
+        with self._lock:
+            self._extend(words)
+
+    def _extend(self, words):
+        for word in words:
+            word_id = word.get('id') or content_word_id(word['kanji'], word['kana'])
+            if word_id in self._positions:
+                continue
+            self._positions[word_id] = len(self._words)
+            self._words.append(dict(word, id=word_id))
+            self._order.append(word_id)
+            if len(self._words) > self.maxlen:
+                self._evict_oldest()
+        if len(self._order) > 2 * self.maxlen:
+            self._order = deque(word_id for word_id in self._order if word_id in self._positions)
+
+    def _evict_oldest(self):
+        while self._order:
+            word_id = self._order.popleft()
+            if word_id in self._positions:
+                self._remove(word_id)
+                return
+
+    def _remove(self, word_id):
+        # 与末尾元素交换后弹出，保持数组稠密
+        position = self._positions.pop(word_id)
+        word = self._words[position]
+        last = self._words.pop()
+        if last is not word:
+            self._words[position] = last
+            self._positions[last['id']] = position
+        self._retired[word_id] = word
+        if len(self._retired) > self.RETIRED_LIMIT:
+            self._retired.popitem(last=False)
+
+    def get(self, word_id):
+        """按 id 查找词，包括刚被淘汰的词"""
+        with self._lock:
+            position = self._positions.get(word_id)
+            if position is not None:
+                return self._words[position]
+            return self._retired.get(word_id)
+
+    def choice(self, fallback=None):
+        """随机取一个词；缓冲区为空时先放入 fallback，仍为空则返回 None"""
+        with self._lock:
+            if not self._words and fallback:
+                self._extend(fallback)
+            if not self._words:
+                return None
+            return random.choice(self._words)
+
+class WordCache:
+    """按级别分段加锁的词汇缓存，同一级别同一时刻只有一个上游请求在进行"""
+
+    def __init__(self, levels, maxlen):
+        self._buffers = {level: WordBuffer(maxlen=maxlen) for level in levels}
+        self._locks = {level: threading.Lock() for level in levels}
+        self._inflight = {level: None for level in levels}
+        self._last_fetch = {}  # 记录每个级别最后一次获取时间
+
+    def __getitem__(self, level):
+        return self._buffers[level]
+
+    def last_fetch(self, level):
+        return self._last_fetch.get(level)
+
+    def refilling(self, level):
+        return self._inflight[level] is not None
+
+    def refill(self, level, fetch, wait=True):
+        """用 fetch(level) 补充该级别，已有补充在进行时合并为同一次请求
+
+        返回本次是否真正执行了 fetch；wait 为 True 时跟随者会等待进行中的请求结束。
+        """
+        with self._locks[level]:
+            flight = self._inflight[level]
+            leader = flight is None
+            if leader:
+                flight = self._inflight[level] = threading.Event()
+
+        if not leader:
+            if wait:
+                flight.wait()
+            return False
+
+        try:
+            new_words = fetch(level)
+            if new_words:
+                self._buffers[level].extend(new_words)
+                self._last_fetch[level] = time.time()
+        finally:
+            with self._locks[level]:
+                self._inflight[level] = None
+            flight.set()
+        return True
+
 # 词汇缓存
-word_cache = {
-    'N5': deque(maxlen=20),
-    'N4': deque(maxlen=20),
-    'N3': deque(maxlen=20),
-    'N2': deque(maxlen=20),
-    'N1': deque(maxlen=20),
-    'last_fetch': {},  # 记录每个级别最后一次获取时间
-}
+word_cache = WordCache(LEVELS, maxlen=20)
+
+# word_cache 的水位线：低于低水位时在后台补充到高水位
+CACHE_LOW_WATERMARK = 5
+CACHE_HIGH_WATERMARK = 20
+CACHE_MAX_AGE = 300  # 词汇超过5分钟后在后台刷新
+
+# 每个用户的复习队列：同时在学的新词不超过 DECK_SIZE 个，其余按 SM-2 间隔复习
+DECK_SIZE = 20
+SRS_INITIAL_EASE = 2.5
+SRS_MIN_EASE = 1.3
+SRS_QUALITY_CORRECT = 4  # 答对、差一点、答错对应的 SM-2 回答质量
+SRS_QUALITY_ALMOST = 2
+SRS_QUALITY_WRONG = 1
+SRS_RELEARN_DELAY = 30  # 答错的词30秒后再出现
+SRS_DAY = 86400
+CHECK_ANSWERS_LIMIT = 100  # /check_answers 每批最多的答案数
+CHOICE_COUNT = 4  # 选择题的选项数，含正确答案
+DISTRACTOR_CANDIDATES = 6  # 每个词预先挑选的干扰项数，出题时从中随机取
+DISTRACTOR_SCAN = 64  # 每个汉字的倒排表中最多考察的词数
+LEVEL_POOL_TTL = 3600  # 共享词池的最长使用时间
+
+# 用户会话
+SESSION_COOKIE = 'nihongo_session'
+SESSION_LIMIT = int(os.environ.get('SESSION_LIMIT', 10000))  # 同时保留的会话数上限
+SESSION_IDLE_TIMEOUT = 1800  # 空闲超过30分钟的会话被淘汰
+
+# 答题记录：请求线程只追加到内存缓冲区，后台线程按批写入 SQLite
+PROGRESS_DB = os.environ.get('PROGRESS_DB', 'progress.db')
+PROGRESS_FLUSH_SIZE = 500  # 缓冲区达到这么多条时立即写入
+PROGRESS_FLUSH_INTERVAL = 1.0  # 最长每隔这么多秒写入一次
+PROGRESS_BUFFER_LIMIT = 100000  # 写入跟不上时缓冲区的上限，超出的记录丢弃
+
+# TTS 音频缓存
+TTS_LANG = 'ja'
+TTS_CACHE_DIR = os.environ.get('TTS_CACHE_DIR', 'tts_cache')
+TTS_MEMORY_CACHE_BYTES = 16 * 1024 * 1024
+TTS_DISK_CACHE_BYTES = int(os.environ.get('TTS_DISK_CACHE_BYTES', 512 * 1024 * 1024))
+TTS_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+TTS_URL = os.environ.get('TTS_URL', 'https://translate.google.com/translate_tts?ie=UTF-8&tl={lang}&client=tw-ob&q={text}')
+TTS_OFFLINE = os.environ.get('TTS_OFFLINE', '') == '1'  # 只使用预生成的音频，不访问外部 TTS
+TTS_STREAMING = os.environ.get('TTS_STREAMING', '1') == '1'  # 未命中缓存时边下载边转发
+TTS_STREAM_CHUNK = 8 * 1024
+
+# 上游 HTTP 连接池
+HTTP_POOL_SIZE = 32
+HTTP_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# 日志：请求线程只把记录放进队列，由后台线程统一写出
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_TRACE_SAMPLE = float(os.environ.get('LOG_TRACE_SAMPLE', 0.01))  # 逐条目调试信息的采样比例
+LOG_FORMAT = '%(asctime)s %(levelname)s %(threadName)s %(message)s'
+
+logger = logging.getLogger('nihongo')
+log_queue = queue.SimpleQueue()
+log_listener = None
+TRACE = False  # 为 False 时逐条目调试信息的调用点整体跳过
+
+def setup_logging(level=LOG_LEVEL):
+    """把 nihongo 日志接到非阻塞队列上，并按级别决定是否开启逐条目调试"""
+    global log_listener, TRACE
+    if log_listener is None:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        log_listener = logging.handlers.QueueListener(log_queue, handler)
+        log_listener.start()
+        atexit.register(log_listener.stop)  # 退出前写完队列中剩余的记录
+        logger.addHandler(logging.handlers.QueueHandler(log_queue))
+        logger.propagate = False
+    logger.setLevel(level)
+    TRACE = logger.isEnabledFor(logging.DEBUG) and LOG_TRACE_SAMPLE > 0
+
+def restart_logging_after_fork():
+    """fork 出的子进程（例如 gunicorn --preload 的 worker）里没有父进程的写日志线程，换一个新队列重新启动"""
+    global log_queue, log_listener
+    if log_listener is None:
+        return
+    atexit.unregister(log_listener.stop)
+    log_queue = queue.SimpleQueue()
+    log_listener = logging.handlers.QueueListener(log_queue, *log_listener.handlers)
+    log_listener.start()
+    atexit.register(log_listener.stop)
+    for handler in logger.handlers:
+        if isinstance(handler, logging.handlers.QueueHandler):
+            handler.queue = log_queue
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=restart_logging_after_fork)
+
+def trace(msg, *args):
+    """按 LOG_TRACE_SAMPLE 采样记录逐条目的调试信息，调用方先判断 TRACE"""
+    if random.random() < LOG_TRACE_SAMPLE:
+        logger.debug(msg, *args)
+
+setup_logging()
+
+# 无法获取新词汇时使用的基本词汇
+BASIC_WORDS = [
+    {'kanji': '本', 'kana': 'ほん', 'chinese': '书'},
+    {'kanji': '猫', 'kana': 'ねこ', 'chinese': '猫'},
+    {'kanji': '犬', 'kana': 'いぬ', 'chinese': '狗'},
+    {'kanji': '水', 'kana': 'みず', 'chinese': '水'},
+    {'kanji': '月', 'kana': 'つき', 'chinese': '月亮'},
+    {'kanji': '日', 'kana': 'ひ', 'chinese': '太阳'},
+    {'kanji': '火', 'kana': 'ひ', 'chinese': '火'},
+    {'kanji': '木', 'kana': 'き', 'chinese': '树'},
+]
 
 # 英文到中文的映射词典
 en_to_zh = {
@@ -152,761 +406,1966 @@ en_to_zh = {
     'winter': '冬天'
 }
 
+# EDICT 词典来源与导入参数
+EDICT_URL = os.environ.get('EDICT_URL', "http://ftp.edrdg.org/pub/Nihongo/edict2.gz")  # 也可以是本地 .gz 路径
+EDICT_DB = 'edict.db'
+EDICT_IMPORT_CHUNK = 10000  # 每批 executemany 写入的行数
+EDICT_POOL_SIZE = int(os.environ.get('EDICT_POOL_SIZE', 8))  # 只读连接池上限
+EDICT_RELOAD_INTERVAL = 5.0  # 每隔这么多秒检查一次 edict.db 是否被重新导入
+
+# 内存映射词汇库，设置 VOCAB_STORE 后对 VOCAB_STORE_LEVELS 中的级别启用
+VOCAB_STORE_PATH = os.environ.get('VOCAB_STORE', '')
+VOCAB_STORE_LEVELS = [level for level in os.environ.get('VOCAB_STORE_LEVELS', 'N5,N4,N3,N2,N1').split(',') if level]
+
+# 预编译的解析正则表达式
+EDICT_ENTRY_PATTERN = re.compile(r'^([^ ]+) \[([^\]]+)\] /(.+)/$')
+JLPT_PATTERN = re.compile(r'(N[1-5])')
+KANA_ONLY_PATTERN = re.compile(r'^[ぁ-んァ-ン]+$')
+ENT_SEQ_PATTERN = re.compile(r'/EntL(\d+)')
+
+def parse_edict_line(line):
+    """解析一行 EDICT 词条，返回 (id, kanji, kana, meanings, tags)，无法解析时返回 None"""
+    match = EDICT_ENTRY_PATTERN.match(line)
+    if not match:
+        return None
+
+    kanji, kana, meanings = match.groups()
+
+    # 使用 EDICT 的词条序号作为主键，词典更新后同一词条的 id 不变
+    ent_seq = ENT_SEQ_PATTERN.search(meanings)
+    word_id = int(ent_seq.group(1)) if ent_seq else None
+
+    # 提取JLPT等级
+    jlpt_match = JLPT_PATTERN.search(meanings)
+    jlpt_level = jlpt_match.group(1) if jlpt_match else None
+
+    # 如果第一部分包含假名，则没有汉字
+    if KANA_ONLY_PATTERN.match(kanji):
+        kana = kanji
+        kanji = ''
+
+    return word_id, kanji, kana, meanings, jlpt_level
+
+@contextmanager
+def open_edict_stream(source=None):
+    """打开 EDICT 文本流，直接从 gzip 流解码，不落地临时文件"""
+    source = source or EDICT_URL
+    if Path(source).exists():
+        with gzip.open(source, 'rt', encoding='euc-jp') as f:
+            yield f
+        return
+
+    with requests.get(source, stream=True, timeout=30) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        with gzip.GzipFile(fileobj=response.raw) as gz:
+            yield io.TextIOWrapper(gz, encoding='euc-jp')
+
+def iter_edict_chunks(lines, chunk_size=EDICT_IMPORT_CHUNK, errors=None):
+    """按批解析 EDICT 词条，每批是一个可直接 executemany 的列表"""
+    chunk = []
+    for line in lines:
+        try:
+            row = parse_edict_line(line)
+        except Exception as e:
+            if errors is not None:
+                errors.append((line, e))
+            continue
+        if row:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def import_edict(source=None, db_path=EDICT_DB, chunk_size=EDICT_IMPORT_CHUNK):
+    """流式导入 EDICT 词典到 SQLite，返回行数、耗时和吞吐量报告"""
+    db_path = Path(db_path)
+    tmp_path = db_path.with_name(db_path.name + '.tmp')
+    if tmp_path.exists():
+        tmp_path.unlink()
+
+    started = time.perf_counter()
+    rows = 0
+    errors = []
+    report = {}
+    conn = sqlite3.connect(tmp_path)
+    try:
+        # 仅在导入期间关闭日志和同步写入
+        conn.execute('PRAGMA journal_mode=OFF')
+        conn.execute('PRAGMA synchronous=OFF')
+        conn.execute('''CREATE TABLE IF NOT EXISTS edict
+                        (id INTEGER PRIMARY KEY,
+                         kanji TEXT,
+                         kana TEXT,
+                         meanings TEXT,
+                         tags TEXT)''')
+
+        logger.info("流式导入 EDICT 词典...")
+        with open_edict_stream(source) as f:
+            next(f)  # 跳过首行
+            for chunk in iter_edict_chunks(f, chunk_size, errors):
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO edict (id, kanji, kana, meanings, tags) VALUES (?, ?, ?, ?, ?)',
+                                     chunk)
+                rows += len(chunk)
+                if rows % (chunk_size * 10) < len(chunk):
+                    elapsed = time.perf_counter() - started
+                    logger.info("已导入 %d 行 (%.0f 行/秒)", rows, rows / elapsed)
+
+        if db_path.exists():
+            copy_vocab_snapshot(conn, db_path)
+        report['snapshot_levels'] = build_vocab_snapshot(conn)
+
+        # 导入结束后切换为 WAL，读连接与后续写入互不阻塞
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=FULL')
+    finally:
+        conn.close()
+
+    # 整库替换，避免读到导入一半的数据库；运行中的服务检查到文件变化后换用新的连接池
+    os.replace(tmp_path, db_path)
+
+    elapsed = time.perf_counter() - started
+    report.update({
+        'rows': rows,
+        'errors': len(errors),
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(rows / elapsed, 1) if elapsed > 0 else 0.0,
+    })
+    for line, e in errors[:10]:
+        logger.warning("解析错误: %s at line: %s", e, line)
+    logger.info("EDICT 词典处理完成: rows=%d errors=%d seconds=%s rows_per_sec=%s",
+                rows, len(errors), report['seconds'], report['rows_per_sec'])
+    return report
+
+def edict_first_gloss(meanings):
+    """提取第一个英文含义"""
+    return meanings.split('/')[0].strip()
+
+# en_to_zh 的摘要，映射表变化后快照需要重建
+EN_TO_ZH_DIGEST = hashlib.sha1(json.dumps(en_to_zh, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def create_snapshot_tables(conn):
+    """创建词汇快照相关的表和索引"""
+    with conn:
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_edict_tags ON edict (tags)')
+        conn.execute('''CREATE TABLE IF NOT EXISTS vocab_snapshot
+                        (level TEXT,
+                         seq INTEGER,
+                         word_id INTEGER,
+                         kanji TEXT,
+                         kana TEXT,
+                         chinese TEXT,
+                         gloss TEXT,
+                         PRIMARY KEY (level, seq)) WITHOUT ROWID''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS snapshot_meta
+                        (level TEXT PRIMARY KEY,
+                         digest TEXT,
+                         rows INTEGER,
+                         built_at REAL)''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS vocab_distractors
+                        (level TEXT,
+                         seq INTEGER,
+                         distractors TEXT,
+                         PRIMARY KEY (level, seq)) WITHOUT ROWID''')
+
+def is_kanji(ch):
+    return '\u4e00' <= ch <= '\u9fff'
+
+def build_distractor_index(words, candidates=DISTRACTOR_CANDIDATES, seed=0):
+    """为每个词预先挑选干扰项，返回每个词的候选下标元组
+
+    words 是 (汉字, 假名, 中文) 列表。先建汉字 -> 词的倒排表和按读音长度的分桶，
+    优先选共享汉字、读音长度接近的词，不够时从读音长度相同或相差一个的桶中随机补充；
+    汉字、假名或中文与该词或已选的词相同的不选，避免出现两个正确选项。
+    """
+    by_kanji = {}
+    by_length = {}
+    for index, (kanji, kana, _) in enumerate(words):
+        for ch in set(filter(is_kanji, kanji)):
+            by_kanji.setdefault(ch, []).append(index)
+        by_length.setdefault(len(kana), []).append(index)
+
+    rng = random.Random(seed)
+    result = []
+    for index, (kanji, kana, chinese) in enumerate(words):
+        chosen = []
+        used = {kanji, kana, chinese}
+
+        def take(other):
+            other_kanji, other_kana, other_chinese = words[other]
+            if other_kanji in used or other_kana in used or other_chinese in used:
+                return
+            chosen.append(other)
+            used.update(words[other])
+
+        shared = set()
+        for ch in set(filter(is_kanji, kanji)):
+            bucket = by_kanji[ch]
+            shared.update(bucket if len(bucket) <= DISTRACTOR_SCAN else rng.sample(bucket, DISTRACTOR_SCAN))
+        shared.discard(index)
+        # 读音长度接近的优先，长度相同的随机排列
+        shared = sorted(shared)
+        rng.shuffle(shared)
+        shared.sort(key=lambda other: abs(len(words[other][1]) - len(kana)))
+        for other in shared:
+            if len(chosen) >= candidates:
+                break
+            take(other)
+        for length in (len(kana), len(kana) - 1, len(kana) + 1):
+            bucket = by_length.get(length, ())
+            for other in rng.sample(bucket, min(len(bucket), candidates * 2)):
+                if len(chosen) >= candidates:
+                    break
+                if other != index:
+                    take(other)
+        result.append(tuple(chosen))
+    return result
+
+def build_vocab_snapshot(conn, levels=None, force=False):
+    """生成按级别的词汇快照，内容未变化的级别直接跳过，返回重建的级别列表"""
+    create_snapshot_tables(conn)
+
+    rebuilt = []
+    for level in levels or LEVELS:
+        source = conn.execute('''SELECT id, kanji, kana, meanings FROM edict
+                                 WHERE tags = ? AND kanji != "" ORDER BY id''', (level,)).fetchall()
+        digest = hashlib.sha1(EN_TO_ZH_DIGEST.encode('ascii'))
+        for row in source:
+            digest.update(repr(row).encode('utf-8'))
+        digest = digest.hexdigest()
+
+        meta = conn.execute('SELECT digest FROM snapshot_meta WHERE level = ?', (level,)).fetchone()
+        has_distractors = conn.execute('SELECT 1 FROM vocab_distractors WHERE level = ? LIMIT 1', (level,)).fetchone()
+        if not force and meta and meta[0] == digest and (has_distractors or not source):
+            continue
+
+        snapshot = []
+        for seq, (word_id, kanji, kana, meanings) in enumerate(source):
+            gloss = edict_first_gloss(meanings)
+            chinese = en_to_zh.get(gloss.lower(), gloss)
+            snapshot.append((level, seq, word_id, kanji, kana, chinese, gloss))
+        distractors = build_distractor_index([(kanji, kana, chinese) for _, _, _, kanji, kana, chinese, _ in snapshot])
+
+        with conn:
+            conn.execute('DELETE FROM vocab_snapshot WHERE level = ?', (level,))
+            conn.executemany('''INSERT INTO vocab_snapshot (level, seq, word_id, kanji, kana, chinese, gloss)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)''', snapshot)
+            conn.execute('DELETE FROM vocab_distractors WHERE level = ?', (level,))
+            conn.executemany('INSERT INTO vocab_distractors (level, seq, distractors) VALUES (?, ?, ?)',
+                             [(level, seq, ','.join(map(str, candidates))) for seq, candidates in enumerate(distractors)])
+            conn.execute('INSERT OR REPLACE INTO snapshot_meta (level, digest, rows, built_at) VALUES (?, ?, ?, ?)',
+                         (level, digest, len(snapshot), time.time()))
+        rebuilt.append(level)
+
+    if rebuilt:
+        logger.info("词汇快照已更新: %s", ', '.join(rebuilt))
+    return rebuilt
+
+def copy_vocab_snapshot(conn, old_db_path):
+    """把旧数据库中的快照带到新导入的数据库，以便只重建有变化的级别"""
+    conn.execute('ATTACH DATABASE ? AS old', (str(old_db_path),))
+    try:
+        tables = {name for (name,) in conn.execute("SELECT name FROM old.sqlite_master WHERE type = 'table'")}
+        if {'vocab_snapshot', 'snapshot_meta'} <= tables:
+            create_snapshot_tables(conn)
+            with conn:
+                conn.execute('INSERT INTO vocab_snapshot SELECT * FROM old.vocab_snapshot')
+                conn.execute('INSERT INTO snapshot_meta SELECT * FROM old.snapshot_meta')
+                if 'vocab_distractors' in tables:
+                    conn.execute('INSERT INTO vocab_distractors SELECT * FROM old.vocab_distractors')
+    finally:
+        conn.execute('DETACH DATABASE old')
+
+# 每个级别在快照中的词数，进程内缓存
+level_word_counts = {}
+
+def get_level_word_count(conn, level):
+    """获取指定级别可抽样的词数"""
+    if level not in level_word_counts:
+        row = conn.execute('SELECT rows FROM snapshot_meta WHERE level = ?', (level,)).fetchone()
+        level_word_counts[level] = row[0] if row else 0
+    return level_word_counts[level]
+
+# 抽样查询的 SQL 文本保持不变，以便复用连接上的预编译语句
+SAMPLE_EDICT_SQL = '''SELECT word_id, kanji, kana, chinese FROM vocab_snapshot
+                       WHERE level = ? AND seq IN (SELECT value FROM json_each(?))'''
+
+def sample_edict_rows(conn, level, limit=20):
+    """按随机行号从词汇快照中抽取不重复的词条，代价与词典大小无关"""
+    count = get_level_word_count(conn, level)
+    if not count:
+        return []
+
+    seqs = random.sample(range(count), min(limit, count))
+    rows = conn.execute(SAMPLE_EDICT_SQL, (level, json.dumps(seqs))).fetchall()
+    random.shuffle(rows)
+    return rows
+
 def download_edict():
     """下载并解析 EDICT 词典文件"""
-    import gzip
-    import shutil
-    import re
-    from pathlib import Path
-
-    edict_file = Path('edict2.gz')
-    edict_txt = Path('edict2.txt')
-    edict_db = Path('edict.db')
-    
     # 如果已经有解析好的数据库，直接返回
-    if edict_db.exists():
+    if Path(EDICT_DB).exists():
         return True
 
     try:
-        # 下载词典文件
-        if not edict_file.exists():
-            print("下载 EDICT 词典文件...")
-            url = "http://ftp.edrdg.org/pub/Nihongo/edict2.gz"
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            with open(edict_file, 'wb') as f:
-                shutil.copyfileobj(response.raw, f)
-
-        # 解压缩
-        if not edict_txt.exists():
-            print("解压缩词典文件...")
-            with gzip.open(edict_file, 'rb') as f_in:
-                with open(edict_txt, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-
-        # 解析并存储到SQLite数据库
-        print("解析词典并存储到数据库...")
-        import sqlite3
-        conn = sqlite3.connect(edict_db)
-        c = conn.cursor()
-        
-        # 创建表
-        c.execute('''CREATE TABLE IF NOT EXISTS edict
-                    (id INTEGER PRIMARY KEY,
-                     kanji TEXT,
-                     kana TEXT,
-                     meanings TEXT,
-                     tags TEXT)''')
-
-        # 编译正则表达式
-        entry_pattern = re.compile(r'^([^ ]+) \[([^\]]+)\] /(.+)/$')
-        jlpt_pattern = re.compile(r'(N[1-5])')
-
-        # 读取并解析文件
-        with open(edict_txt, 'r', encoding='euc-jp') as f:
-            next(f)  # 跳过首行
-            for line in f:
-                try:
-                    match = entry_pattern.match(line)
-                    if match:
-                        kanji_kana = match.group(1)
-                        kana = match.group(2)
-                        meanings = match.group(3)
-                        
-                        # 提取JLPT等级
-                        jlpt_match = jlpt_pattern.search(meanings)
-                        jlpt_level = jlpt_match.group(1) if jlpt_match else None
-                        
-                        # 如果第一部分包含假名，则没有汉字
-                        if re.match(r'^[ぁ-んァ-ン]+$', kanji_kana):
-                            kanji = ''
-                            kana = kanji_kana
-                        else:
-                            kanji = kanji_kana
-
-                        c.execute('INSERT INTO edict (kanji, kana, meanings, tags) VALUES (?, ?, ?, ?)',
-                                (kanji, kana, meanings, jlpt_level))
-                except Exception as e:
-                    print(f"解析错误: {e} at line: {line}")
-                    continue
+        import_edict()
+        return True
+    except Exception as e:
+        logger.exception("下载或处理 EDICT 词典时出错: %s", e)
+        return False
 
-        conn.commit()
+def ensure_vocab_snapshot(db_path=EDICT_DB):
+    """旧版数据库缺少词汇快照时补建，并切换为 WAL 模式"""
+    conn = sqlite3.connect(db_path)
+    try:
+        tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if not {'snapshot_meta', 'vocab_distractors'} <= tables:
+            build_vocab_snapshot(conn)
+        conn.execute('PRAGMA journal_mode=WAL')
+    finally:
         conn.close()
 
-        # 清理临时文件
-        edict_file.unlink()
-        edict_txt.unlink()
-        
-        print("EDICT 词典处理完成")
-        return True
+def edict_file_identity(db_path=EDICT_DB):
+    """数据库文件的 (inode, 修改时间)，文件不存在时返回 None"""
+    try:
+        st = os.stat(db_path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns
+
+class EdictReaderPool:
+    """edict.db 的只读连接池，由所有请求线程共享"""
+
+    def __init__(self, db_path=EDICT_DB, max_size=EDICT_POOL_SIZE, timeout=5.0):
+        self.db_path = Path(db_path)
+        self.identity = edict_file_identity(db_path)
+        self._checked = time.monotonic()
+        self.max_size = max_size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._stats = {'hits': 0, 'misses': 0, 'waits': 0, 'wait_time': 0.0}
+
+    def _connect(self):
+        # 每个连接自带预编译语句缓存，抽样查询的 SQL 文本固定，可以一直复用
+        return sqlite3.connect(f'{self.db_path.resolve().as_uri()}?mode=ro', uri=True,
+                               check_same_thread=False, cached_statements=64)
+
+    def _acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            with self._lock:
+                self._stats['hits'] += 1
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.max_size
+            if can_create:
+                self._created += 1
+                self._stats['misses'] += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # 连接数已达上限，等待其他线程归还
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError('等待 edict.db 连接超时')
+        finally:
+            with self._lock:
+                self._stats['waits'] += 1
+                self._stats['wait_time'] += time.perf_counter() - started
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """借出一个只读连接，用完自动归还"""
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def replaced(self, interval=EDICT_RELOAD_INTERVAL):
+        """数据库文件是否已被替换或改写（例如重新导入），每 interval 秒最多检查一次"""
+        now = time.monotonic()
+        if now - self._checked < interval:
+            return False
+        self._checked = now
+        identity = edict_file_identity(self.db_path)
+        return identity is not None and identity != self.identity
+
+    def stats(self):
+        """返回命中、新建、等待次数及累计等待时间"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = self._created
+        stats['idle'] = self._idle.qsize()
+        stats['max_size'] = self.max_size
+        return stats
+
+    def close(self):
+        """关闭所有空闲连接"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
 
-    except Exception as e:
-        print(f"下载或处理 EDICT 词典时出错: {e}")
-        return False
+edict_pool = None
+edict_pool_lock = threading.Lock()
+
+def get_edict_pool():
+    """获取共享的 edict.db 连接池，首次调用时准备好数据库"""
+    global edict_pool
+    reload_edict_pool_if_replaced()
+    if edict_pool is None:
+        with edict_pool_lock:
+            if edict_pool is None:
+                if not download_edict():
+                    return None
+                ensure_vocab_snapshot(EDICT_DB)
+                edict_pool = EdictReaderPool(EDICT_DB)
+    return edict_pool
+
+def reload_edict_pool_if_replaced():
+    """edict.db 被重新导入后换用新文件上的连接池，旧连接仍指向已被替换的文件"""
+    global edict_pool
+    pool = edict_pool
+    if pool is None or not pool.replaced():
+        return
+    with edict_pool_lock:
+        if edict_pool is not pool:
+            return
+        try:
+            ensure_vocab_snapshot(EDICT_DB)
+            edict_pool = EdictReaderPool(EDICT_DB)
+        except Exception as e:
+            logger.error("重新打开 edict.db 失败: %s", e)
+            return
+        pool.close()
+        level_word_counts.clear()
+        level_pools.clear()
+    logger.info("edict.db 已更新，重新打开词典")
 
 def get_edict_words(level, limit=20):
     """从EDICT数据库获取指定级别的词汇"""
     try:
-        if not Path('edict.db').exists():
-            if not download_edict():
-                return []
+        pool = get_edict_pool()
+        if pool is None:
+            return []
 
-        conn = sqlite3.connect('edict.db')
-        c = conn.cursor()
-        
         # 随机获取指定级别的词汇
-        c.execute('''SELECT kanji, kana, meanings FROM edict 
-                    WHERE tags = ? AND kanji != ""
-                    ORDER BY RANDOM() LIMIT ?''', (level, limit))
-        
+        with pool.connection() as conn:
+            rows = sample_edict_rows(conn, level, limit)
+
         words = []
-        for row in c.fetchall():
-            kanji, kana, meanings = row
-            
-            # 提取第一个英文含义
-            meaning = meanings.split('/')[0].strip()
-            
-            # 尝试将英文转换为中文
-            chinese = en_to_zh.get(meaning.lower(), meaning)
-            
+        for word_id, kanji, kana, chinese in rows:
             words.append({
+                'id': edict_word_id(word_id),
                 'kanji': kanji,
                 'kana': kana,
                 'chinese': chinese
             })
         
-        conn.close()
         return words
 
     except Exception as e:
-        print(f"从EDICT获取词汇时出错: {e}")
+        logger.warning("从EDICT获取词汇时出错: %s", e)
         return []
 
-def get_jisho_words(level):
-    """从Jisho API获取词汇"""
-    print(f"\n开始获取 {level} 级别的词汇...")
-    
-    # 根据级别设置不同的搜索参数
-    if level == 'N5':
-        # N5级别：使用基础词汇和常用词
-        tags = ['jlpt-n5', 'common']
-        search_params = '#jlpt-n5 #common'
-    elif level == 'N4':
-        tags = ['jlpt-n4', 'common']
-        search_params = '#jlpt-n4 #common'
-    elif level == 'N3':
-        tags = ['jlpt-n3']
-        search_params = '#jlpt-n3'
-    elif level == 'N2':
-        tags = ['jlpt-n2']
-        search_params = '#jlpt-n2'
-    else:  # N1
-        tags = ['jlpt-n1']
-        search_params = '#jlpt-n1'
-    
-    print(f"使用搜索参数: {search_params}")
-    
-    words = []
-    page = random.randint(1, 5)  # 随机获取不同页面的词汇
-    print(f"随机选择页面: {page}")
-    
+class VocabStore:
+    """内存映射的只读词汇库，多个 worker 进程通过页缓存共享同一份数据
+
+    文件布局: 文件头、每个级别的目录项、每个词一条定长记录
+    (word_id, 汉字/假名/中文 三个字符串在数据区中的起始偏移, 结束偏移)，
+    然后是每个词一条的干扰项记录（干扰项在该级别中的下标，不足的用 NO_DISTRACTOR 填充），
+    最后是所有字符串拼接而成的 UTF-8 数据区。
+    """
+
+    MAGIC = b'NHV2'
+    HEADER = struct.Struct('<4sIIQ')        # magic, 级别数, 每个词的干扰项数, 数据区起始位置
+    LEVEL_ENTRY = struct.Struct('<2s2xIQQ')  # 级别名, 词数, 记录表起始位置, 干扰项表起始位置
+    RECORD = struct.Struct('<IIIII')
+    NO_DISTRACTOR = 0xFFFFFFFF
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, level_count, width, self._blob_offset = self.HEADER.unpack_from(self._mm, 0)
+        if magic != self.MAGIC:
+            raise ValueError(f'不是有效的词汇库文件: {path}')
+        self._distractor_record = struct.Struct(f'<{width}I')
+
+        self._levels = {}
+        for i in range(level_count):
+            name, count, table_offset, distractor_offset = self.LEVEL_ENTRY.unpack_from(
+                self._mm, self.HEADER.size + i * self.LEVEL_ENTRY.size)
+            self._levels[name.decode('ascii')] = (count, table_offset, distractor_offset)
+
+    @classmethod
+    def write(cls, path, rows_by_level, distractors_by_level=None, width=DISTRACTOR_CANDIDATES):
+        """把 {level: [(word_id, kanji, kana, chinese), ...]} 写成词汇库文件，每个级别需按 word_id 升序
+
+        distractors_by_level 是 {level: [每个词的干扰项下标列表, ...]}，与 rows 一一对应。
+        """
+        distractors_by_level = distractors_by_level or {}
+        distractor_record = struct.Struct(f'<{width}I')
+        table_offset = cls.HEADER.size + cls.LEVEL_ENTRY.size * len(rows_by_level)
+        distractor_offset = table_offset + cls.RECORD.size * sum(map(len, rows_by_level.values()))
+        entries = []
+        records = bytearray()
+        distractor_records = bytearray()
+        blob = bytearray()
+        for level, rows in rows_by_level.items():
+            entries.append(cls.LEVEL_ENTRY.pack(level.encode('ascii'), len(rows), table_offset, distractor_offset))
+            for word_id, kanji, kana, chinese in rows:
+                offsets = [len(blob)]
+                for text in (kanji, kana, chinese):
+                    blob += text.encode('utf-8')
+                    offsets.append(len(blob))
+                records += cls.RECORD.pack(word_id, *offsets)
+            level_distractors = distractors_by_level.get(level) or [()] * len(rows)
+            for candidates in level_distractors:
+                candidates = list(candidates)[:width]
+                distractor_records += distractor_record.pack(*candidates, *[cls.NO_DISTRACTOR] * (width - len(candidates)))
+            table_offset += cls.RECORD.size * len(rows)
+            distractor_offset += distractor_record.size * len(rows)
+
+        tmp_path = Path(str(path) + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, len(rows_by_level), width, distractor_offset))
+            f.write(b''.join(entries))
+            f.write(records)
+            f.write(distractor_records)
+            f.write(blob)
+        # 替换文件不影响已经映射旧文件的进程
+        os.replace(tmp_path, path)
+
+    def levels(self):
+        return list(self._levels)
+
+    def count(self, level):
+        return self._levels.get(level, (0, 0, 0))[0]
+
+    def get(self, level, index):
+        """按下标读取一个词，只在需要时解码字符串"""
+        count, table_offset, _ = self._levels[level]
+        if not 0 <= index < count:
+            raise IndexError(index)
+        word_id, a, b, c, d = self.RECORD.unpack_from(self._mm, table_offset + index * self.RECORD.size)
+        base = self._blob_offset
+        mm = self._mm
+        return {
+            'id': edict_word_id(word_id),
+            'kanji': mm[base + a:base + b].decode('utf-8'),
+            'kana': mm[base + b:base + c].decode('utf-8'),
+            'chinese': mm[base + c:base + d].decode('utf-8'),
+        }
+
+    def find(self, level, word_id):
+        """按 EDICT 词条序号二分查找，记录在每个级别内按 word_id 升序排列"""
+        count, table_offset, _ = self._levels.get(level, (0, 0, 0))
+        unpack = self.RECORD.unpack_from
+        size = self.RECORD.size
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if unpack(self._mm, table_offset + mid * size)[0] < word_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < count and unpack(self._mm, table_offset + lo * size)[0] == word_id:
+            return self.get(level, lo)
+        return None
+
+    def distractors(self, level):
+        """某个级别每个词的干扰项，返回 {词 id: 干扰项在该级别中的下标元组}"""
+        count, table_offset, distractor_offset = self._levels.get(level, (0, 0, 0))
+        records = self.RECORD.iter_unpack(self._mm[table_offset:table_offset + count * self.RECORD.size])
+        candidates = self._distractor_record.iter_unpack(
+            self._mm[distractor_offset:distractor_offset + count * self._distractor_record.size])
+        return {edict_word_id(record[0]): tuple(index for index in indices if index != self.NO_DISTRACTOR)
+                for record, indices in zip(records, candidates)}
+
+    def close(self):
+        self._mm.close()
+
+def build_vocab_store(db_path=EDICT_DB, path=VOCAB_STORE_PATH, levels=None):
+    """从词汇快照生成内存映射词汇库文件"""
+    conn = sqlite3.connect(db_path)
     try:
-        # 构建API请求
-        url = 'https://jisho.org/api/v1/search/words'
-        params = {'keyword': search_params, 'page': page}
-        print(f"发送API请求: {url}?keyword={search_params}&page={page}")
-        
-        # 发送请求并获取响应
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        if 'data' not in data:
-            print("API响应中没有找到数据字段")
-            return []
-            
-        print(f"\n找到 {len(data['data'])} 个词条，开始处理...")
-        
-        # 处理每个词条
-        for idx, item in enumerate(data['data'], 1):
-            if len(words) >= 20:
-                print("已达到20个词的上限，停止处理")
+        rows_by_level = {}
+        distractors_by_level = {}
+        for level in levels or LEVELS:
+            rows = conn.execute('''SELECT s.seq, s.word_id, s.kanji, s.kana, s.chinese, d.distractors
+                                   FROM vocab_snapshot s LEFT JOIN vocab_distractors d
+                                   ON d.level = s.level AND d.seq = s.seq
+                                   WHERE s.level = ? ORDER BY s.seq''', (level,)).fetchall()
+            # 干扰项按快照的 seq 保存，换算成词汇库中的下标，词汇库自带干扰项，不依赖 edict.db
+            positions = {seq: index for index, (seq, *_) in enumerate(rows)}
+            rows_by_level[level] = [(word_id, kanji, kana, chinese) for _, word_id, kanji, kana, chinese, _ in rows]
+            distractors_by_level[level] = [[positions[int(other)] for other in (distractors or '').split(',')
+                                            if other and int(other) in positions]
+                                           for *_, distractors in rows]
+    finally:
+        conn.close()
+
+    VocabStore.write(path, rows_by_level, distractors_by_level)
+    logger.info("词汇库已生成: %s (%s)", path, ', '.join(f'{k} {len(v)}' for k, v in rows_by_level.items()))
+
+vocab_store = None
+vocab_store_lock = threading.Lock()
+vocab_store_building = False
+
+def build_vocab_store_in_background():
+    """后台线程：等词典准备好后生成词汇库文件并映射，之前临时建立的词池随之过期"""
+    global vocab_store, vocab_store_building
+    store = None
+    try:
+        if get_edict_pool() is not None:
+            build_vocab_store(EDICT_DB, VOCAB_STORE_PATH, VOCAB_STORE_LEVELS)
+            store = VocabStore(VOCAB_STORE_PATH)
+    except Exception as e:
+        logger.error("生成词汇库失败: %s", e)
+    finally:
+        with vocab_store_lock:
+            if store is not None and vocab_store is None:
+                vocab_store = store
+            vocab_store_building = False
+
+def get_vocab_store(level):
+    """如果该级别启用了内存映射词汇库，返回词汇库，否则返回 None
+
+    词汇库文件不存在或是旧格式（没有干扰项）时交给后台线程重新生成，在此之前返回 None，
+    请求线程不等待下载或导入。
+    """
+    global vocab_store, vocab_store_building
+    if not VOCAB_STORE_PATH or level not in VOCAB_STORE_LEVELS:
+        return None
+    if vocab_store is None:
+        with vocab_store_lock:
+            if vocab_store is None:
+                if Path(VOCAB_STORE_PATH).exists():
+                    try:
+                        vocab_store = VocabStore(VOCAB_STORE_PATH)
+                    except Exception as e:
+                        logger.warning("词汇库 %s 无法使用，后台重新生成: %s", VOCAB_STORE_PATH, e)
+                if vocab_store is None:
+                    if not vocab_store_building:
+                        vocab_store_building = True
+                        threading.Thread(target=build_vocab_store_in_background,
+                                         name='vocab-store-build', daemon=True).start()
+                    return None
+    if not vocab_store.count(level):
+        return None
+    return vocab_store
+
+class LatencyHistogram:
+    """固定分桶的延迟直方图（单位秒），线程安全"""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # 最后一个桶是 +Inf
+        self._count = 0
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._count += 1
+            self._sum += seconds
+
+    def _quantile(self, counts, total, q):
+        # 用所在桶的上界近似分位数
+        rank = q * total
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self._counts)
+            total = self._count
+            total_sum = self._sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return {
+            'count': total,
+            'sum': total_sum,
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], cumulative)),
+            'p50': self._quantile(counts, total, 0.5) if total else None,
+            'p99': self._quantile(counts, total, 0.99) if total else None,
+        }
+
+latency_histograms = {}
+latency_histograms_lock = threading.Lock()
+
+def observe_latency(name, seconds):
+    """记录一次耗时到名为 name 的直方图"""
+    histogram = latency_histograms.get(name)
+    if histogram is None:
+        with latency_histograms_lock:
+            histogram = latency_histograms.setdefault(name, LatencyHistogram())
+    histogram.observe(seconds)
+
+class Counters:
+    """按标签元组计数，线程安全"""
+
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+route_histograms = {}
+request_counts = Counters()  # (路由, 状态码)
+vocab_source_counts = Counters()  # (级别, 来源)：后台补充时词汇来自 edict / jisho / fallback
+level_pool_loads = Counters()  # (级别, 来源)：共享词池来自 store / edict / cache
+
+def observe_request(route, status, seconds):
+    """记录一次请求的路由、状态码和处理耗时"""
+    histogram = route_histograms.get(route)
+    if histogram is None:
+        with latency_histograms_lock:
+            histogram = route_histograms.setdefault(route, LatencyHistogram())
+    histogram.observe(seconds)
+    request_counts.inc((route, status))
+
+def create_http_session():
+    """TTS 和 Jisho 共用的 HTTP 会话，保持长连接以省去每次的 TCP/TLS 握手"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['User-Agent'] = HTTP_USER_AGENT
+    return session
+
+http_session = create_http_session()
+
+JISHO_API_URL = os.environ.get('JISHO_API_URL', 'https://jisho.org/api/v1/search/words')
+JISHO_MIRROR_DB = os.environ.get('JISHO_MIRROR', 'jisho.db')
+JISHO_PAGE_MAX_AGE = 7 * 24 * 3600  # 增量同步时只重新抓取超过这个时间的页面
+JISHO_MAX_PAGES = 500
+
+# 根据级别设置不同的搜索参数
+JISHO_SEARCH = {
+    'N5': '#jlpt-n5 #common',  # N5级别：使用基础词汇和常用词
+    'N4': '#jlpt-n4 #common',
+    'N3': '#jlpt-n3',
+    'N2': '#jlpt-n2',
+    'N1': '#jlpt-n1',
+}
+
+def normalize_jisho_item(item):
+    """把一个 Jisho 词条整理成词汇，缺少汉字/假名或中文释义时返回 None"""
+    # 检查必要的字段
+    if not item.get('japanese'):
+        return None
+
+    japanese = item['japanese'][0]
+    kanji = japanese.get('word', '')
+    kana = japanese.get('reading', '')
+    if not kanji and not kana:
+        return None
+    if not kanji:
+        kanji = kana  # 没有汉字，使用假名代替
+
+    # 获取词义
+    if not item.get('senses'):
+        return None
+
+    chinese = None
+    # 尝试从所有释义中找到合适的中文翻译
+    for sense in item['senses']:
+        # 首选：直接的中文释义
+        if sense.get('chinese_definitions'):
+            chinese = sense['chinese_definitions'][0]
+            break
+
+        # 次选：通过映射转换英文释义
+        for eng_def in sense.get('english_definitions', []):
+            # 清理英文释义
+            eng_def = eng_def.lower()
+            eng_def = eng_def.split('(')[0].strip()
+            eng_def = eng_def.split(',')[0].strip()
+            eng_def = eng_def.split(';')[0].strip()
+            if eng_def in en_to_zh:
+                chinese = en_to_zh[eng_def]
                 break
-                
-            print(f"\n处理第 {idx} 个词条:")
-            
-            # 检查必要的字段
-            if not item.get('japanese'):
-                print("- 跳过：没有日语读音信息")
-                continue
-                
-            japanese = item['japanese'][0]
-            kanji = japanese.get('word', '')
-            kana = japanese.get('reading', '')
-            
-            print(f"- 汉字: {kanji}")
-            print(f"- 假名: {kana}")
-            
-            if not kanji and not kana:
-                print("- 跳过：既没有汉字也没有假名")
-                continue
-                
-            if not kanji:
-                print("- 没有汉字，使用假名代替")
-                kanji = kana
-            
-            # 获取词义
-            if not item.get('senses'):
-                print("- 跳过：没有词义信息")
-                continue
-            
-            print("- 开始处理词义:")
-            chinese = None
-            
-            # 尝试从所有释义中找到合适的中文翻译
-            for sense_idx, sense in enumerate(item['senses'], 1):
-                print(f"  处理第 {sense_idx} 个释义:")
-                
-                # 首选：直接的中文释义
-                if sense.get('chinese_definitions'):
-                    chinese = sense['chinese_definitions'][0]
-                    print(f"  - 找到中文释义: {chinese}")
+        if chinese:  # 如果找到了映射，就跳出外层循环
+            break
+
+    # 如果找不到中文释义，尝试使用词性标签
+    if not chinese and 'tags' in item:
+        tags = [tag.lower() for tag in item.get('tags', [])]
+        if 'adjective' in tags or 'verb' in tags:
+            for eng_def in item['senses'][0].get('english_definitions', []):
+                eng = eng_def.lower().split()[0]
+                if eng in en_to_zh:
+                    chinese = en_to_zh[eng]
                     break
-                
-                # 次选：通过映射转换英文释义
-                elif sense.get('english_definitions'):
-                    print("  - 处理英文释义:")
-                    for eng_def in sense['english_definitions']:
-                        # 清理英文释义
-                        eng_def = eng_def.lower()
-                        eng_def = eng_def.split('(')[0].strip()
-                        eng_def = eng_def.split(',')[0].strip()
-                        eng_def = eng_def.split(';')[0].strip()
-                        
-                        print(f"    尝试映射: {eng_def}")
-                        if eng_def in en_to_zh:
-                            chinese = en_to_zh[eng_def]
-                            print(f"    - 成功映射为: {chinese}")
-                            break
-                    
-                    if chinese:  # 如果找到了映射，就跳出外层循环
-                        break
-            
-            # 如果找不到中文释义，尝试使用词性标签
-            if not chinese and 'tags' in item:
-                print("- 尝试通过词性标签推测含义:")
-                tags = [tag.lower() for tag in item.get('tags', [])]
-                print(f"  词性标签: {tags}")
-                
-                if 'adjective' in tags or 'verb' in tags:
-                    for eng_def in item['senses'][0].get('english_definitions', []):
-                        eng = eng_def.lower().split()[0]
-                        print(f"  尝试映射第一个词: {eng}")
-                        if eng in en_to_zh:
-                            chinese = en_to_zh[eng]
-                            print(f"  - 成功映射为: {chinese}")
-                            break
-            
-            # 添加词条
-            if chinese and kanji and kana:
-                words.append({
-                    'kanji': kanji,
-                    'kana': kana,
-                    'chinese': chinese
-                })
-                print(f"\n✓ 成功添加词条: {kanji} ({kana}) - {chinese}")
-            else:
-                print("\n✗ 跳过词条：缺少必要信息")
-                if not chinese:
-                    print("  - 缺少中文释义")
-                if not kanji:
-                    print("  - 缺少汉字")
-                if not kana:
-                    print("  - 缺少假名")
-        
-        print(f"\n处理完成，共获取 {len(words)} 个词条")
-        
-    except requests.RequestException as e:
-        print(f"网络错误: {e}")
-    except ValueError as e:
-        print(f"JSON解析错误: {e}")
-    except Exception as e:
-        print(f"未预期的错误: {e}")
-    
-    # 如果没有获取到足够的词，返回基本词汇
-    if len(words) < 4:
-        print("\n获取的词汇不足，使用基本词汇")
-        basic_words = [
-            {'kanji': '本', 'kana': 'ほん', 'chinese': '书'},
-            {'kanji': '猫', 'kana': 'ねこ', 'chinese': '猫'},
-            {'kanji': '犬', 'kana': 'いぬ', 'chinese': '狗'},
-            {'kanji': '水', 'kana': 'みず', 'chinese': '水'},
-            {'kanji': '月', 'kana': 'つき', 'chinese': '月亮'},
-            {'kanji': '日', 'kana': 'ひ', 'chinese': '太阳'},
-            {'kanji': '火', 'kana': 'ひ', 'chinese': '火'},
-            {'kanji': '木', 'kana': 'き', 'chinese': '树'},
-        ]
-        return basic_words[:20]
-    
-    print("\n返回获取的词汇")
-    return words
 
-def get_vocabulary(level='N5'):
-    """获取指定级别的词汇，优先使用EDICT数据库"""
-    current_time = time.time()
-    
-    # 如果缓存为空或者已经过了5分钟，重新获取词汇
-    if (len(word_cache[level]) < 5 or 
-        level not in word_cache['last_fetch'] or 
-        current_time - word_cache['last_fetch'].get(level, 0) > 300):
-        
-        # 首先尝试从EDICT获取词汇
-        new_words = get_edict_words(level)
-        
-        # 如果EDICT获取失败，回退到Jisho API
-        if not new_words:
-            print("从EDICT获取词汇失败，尝试使用Jisho API...")
-            new_words = get_jisho_words(level)
-        
-        if new_words:
-            word_cache[level].extend(new_words)
-            word_cache['last_fetch'][level] = current_time
-        else:
-            print("无法获取新词汇，使用默认词汇...")
-            # 使用一些基本词汇作为后备
-            new_words = [
-                {'kanji': '本', 'kana': 'ほん', 'chinese': '书'},
-                {'kanji': '猫', 'kana': 'ねこ', 'chinese': '猫'},
-                {'kanji': '犬', 'kana': 'いぬ', 'chinese': '狗'},
-                {'kanji': '水', 'kana': 'みず', 'chinese': '水'},
-                {'kanji': '月', 'kana': 'つき', 'chinese': '月亮'},
-                {'kanji': '日', 'kana': 'ひ', 'chinese': '太阳'},
-                {'kanji': '火', 'kana': 'ひ', 'chinese': '火'},
-                {'kanji': '木', 'kana': 'き', 'chinese': '树'},
-            ]
-            word_cache[level].extend(new_words)
-    
-    return list(word_cache[level])
-
-# HTML 模板
-HTML_TEMPLATE = '''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>日语学习</title>
-    <meta charset="UTF-8">
-    <style>
-        body {
-            font-family: Arial, sans-serif;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            height: 100vh;
-            margin: 0;
-            background-color: #f0f0f0;
-        }
-        .container {
-            text-align: center;
-            background: white;
-            padding: 2em;
-            border-radius: 10px;
-            box-shadow: 0 0 10px rgba(0,0,0,0.1);
-            max-width: 600px;
-            width: 90%;
-        }
-        .word {
-            font-size: 2em;
-            margin-bottom: 1em;
-        }
-        input {
-            padding: 0.5em;
-            margin: 0.5em;
-            width: 200px;
-            font-size: 1em;
-        }
-        .result {
-            margin-top: 1em;
-            color: #666;
-            min-height: 3em;
-        }
-        .correct {
-            color: green;
-        }
-        .incorrect {
-            color: red;
-        }
-        .level-select {
-            margin-bottom: 2em;
-            padding: 1em;
-            border-bottom: 1px solid #eee;
-        }
-        .level-btn {
-            padding: 0.5em 1em;
-            margin: 0.2em;
-            border: none;
-            border-radius: 5px;
-            background-color: #f0f0f0;
-            cursor: pointer;
-            transition: background-color 0.3s;
-        }
-        .level-btn.active {
-            background-color: #4CAF50;
-            color: white;
-        }
-        .stats {
-            margin-top: 1em;
-            font-size: 0.9em;
-            color: #666;
-        }
-        .loading {
-            margin-top: 1em;
-            color: #666;
-            font-style: italic;
-        }
-        #remainingWords {
-            color: #2196F3;
-            font-weight: bold;
-        }
-        .level-btn {
-            position: relative;
-        }
-        .level-btn.loading::after {
-            content: '...';
-            position: absolute;
-            right: 0;
-            animation: dots 1s infinite;
-        }
-        @keyframes dots {
-            0% { content: '.'; }
-            33% { content: '..'; }
-            66% { content: '...'; }
-        }
-        .sound-toggle {
-            position: fixed;
-            top: 20px;
-            right: 20px;
-            padding: 10px;
-            background: white;
-            border-radius: 5px;
-            box-shadow: 0 2px 5px rgba(0,0,0,0.1);
-            display: flex;
-            align-items: center;
-            gap: 8px;
-            cursor: pointer;
-        }
-        .sound-toggle input[type="checkbox"] {
-            width: auto;
-            margin: 0;
-        }
-        .word-container {
-            position: relative;
-            display: inline-block;
-        }
-        .sound-icon {
-            position: absolute;
-            top: -10px;
-            right: -25px;
-            width: 20px;
-            height: 20px;
-            cursor: pointer;
-            opacity: 0.6;
-            transition: opacity 0.3s;
-        }
-        .sound-icon:hover {
-            opacity: 1;
-        }
-        .sound-icon svg {
-            width: 100%;
-            height: 100%;
-            fill: #666;
-            transition: fill 0.3s;
-        }
-        .sound-icon.playing svg {
-            fill: #4CAF50;
-        }
-        .sound-loading {
-            position: absolute;
-            top: 0;
-            left: 0;
-            width: 100%;
-            height: 100%;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            background: rgba(255, 255, 255, 0.8);
-        }
-        .spinner {
-            width: 12px;
-            height: 12px;
-            border: 2px solid #4CAF50;
-            border-top-color: transparent;
-            border-radius: 50%;
-            animation: spin 1s linear infinite;
-        }
-        @keyframes spin {
-            to {transform: rotate(360deg);}
-        }
-        .error-message {
-            color: #f44336;
-            font-size: 0.9em;
-            margin-top: 0.5em;
-            min-height: 1.2em;
-        }
-        .sound-icon:hover svg {
-            fill: #4CAF50;
-        }
-        .sound-icon.disabled {
-            opacity: 0.5;
-            cursor: not-allowed;
-        }
-    </style>
-</head>
-<body>
-    <div class="sound-toggle">
-        <input type="checkbox" id="autoSound" checked>
-        <label for="autoSound">自动发音</label>
-    </div>
-    <div class="container">
-        <div class="level-select" id="levelSelect">
-            <div style="margin-bottom: 0.5em">选择词汇级别：</div>
-            <button class="level-btn active" data-level="N5">N5 基础</button>
-            <button class="level-btn" data-level="N4">N4 初级</button>
-            <button class="level-btn" data-level="N3">N3 中级</button>
-            <button class="level-btn" data-level="N2">N2 中高级</button>
-            <button class="level-btn" data-level="N1">N1 高级</button>
-        </div>
-        <div class="word-container">
-            <div class="word" id="chinese"></div>
-            <div class="sound-icon" onclick="playCurrentWord()" title="点击播放" id="soundIcon">
-                <svg viewBox="0 0 24 24">
-                    <path d="M3 9v6h4l5 5V4L7 9H3zm13.5 3c0-1.77-1.02-3.29-2.5-4.03v8.05c1.48-.73 2.5-2.25 2.5-4.02zM14 3.23v2.06c2.89.86 5 3.54 5 6.71s-2.11 5.85-5 6.71v2.06c4.01-.91 7-4.49 7-8.77s-2.99-7.86-7-8.77z"/>
-                </svg>
-                <div class="sound-loading" style="display: none;">
-                    <div class="spinner"></div>
-                </div>
-            </div>
-        </div>
-        <div id="soundError" class="error-message" style="display: none;"></div>
-        <div>
-            <input type="text" id="answerInput" placeholder="输入答案" />
-        </div>
-        <div class="result" id="result"></div>
-        <div class="stats">
-            <span>正确: <span id="correctCount">0</span></span>
-            &nbsp;|&nbsp;
-            <span>错误: <span id="incorrectCount">0</span></span>
-            &nbsp;|&nbsp;
-            <span>正确率: <span id="accuracy">0</span>%</span>
-            &nbsp;|&nbsp;
-            <span>剩余词汇: <span id="remainingWords">0</span></span>
-        </div>
-        <div id="loading" class="loading" style="display: none;">
-            正在获取新词汇...
-        </div>
-    </div>
-    <script>
-        let currentWord = null;
-        let currentMode = null;
-        let currentLevel = 'N5';
-        let stats = {
-            correct: 0,
-            incorrect: 0
-        };
-        let currentAudio = null;
-
-        // 创建音频元素
-        const audioElement = new Audio();
-        
-        // 播放当前词汇的发音
-        async function playCurrentWord() {
-            if (!currentWord || !currentWord.kanji) return;
-            
-            try {
-                // 使用Google TTS API生成语音URL
-                const text = currentWord.kanji;
-                const url = `https://translate.google.com/translate_tts?ie=UTF-8&tl=ja&client=tw-ob&q=${encodeURIComponent(text)}`;
-                
-                // 如果有正在播放的音频，停止它
-                if (currentAudio) {
-                    currentAudio.pause();
-                    currentAudio.currentTime = 0;
-                }
-                
-                // 创建新的音频实例
-                currentAudio = new Audio(url);
-                await currentAudio.play();
-            } catch (error) {
-                console.error('播放失败:', error);
+    if not (chinese and kanji and kana):
+        if TRACE:
+            trace("跳过 Jisho 词条 %s (%s): 缺少中文释义", kanji, kana)
+        return None
+    return {'id': content_word_id(kanji, kana), 'kanji': kanji, 'kana': kana, 'chinese': chinese}
+
+def fetch_jisho_page(level, page, retries=3, limiter=None):
+    """抓取某个级别的一页搜索结果，失败时指数退避重试，返回原始词条列表"""
+    for attempt in range(retries):
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            started = time.perf_counter()
+            response = http_session.get(JISHO_API_URL, params={'keyword': JISHO_SEARCH[level], 'page': page}, timeout=10)
+            observe_latency('jisho', time.perf_counter() - started)
+            response.raise_for_status()
+            data = response.json()
+            if 'data' not in data:
+                raise ValueError('API响应中没有找到数据字段')
+            return data['data']
+        except (requests.RequestException, ValueError) as e:
+            if attempt == retries - 1:
+                raise
+            logger.warning("抓取 %s 第 %d 页失败，稍后重试: %s", level, page, e)
+            time.sleep(2 ** attempt)
+
+def open_jisho_mirror(db_path=JISHO_MIRROR_DB):
+    """打开本地 Jisho 镜像，不存在时建表"""
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('''CREATE TABLE IF NOT EXISTS jisho_pages
+                    (level TEXT,
+                     page INTEGER,
+                     digest TEXT,
+                     words INTEGER,
+                     fetched_at REAL,
+                     PRIMARY KEY (level, page)) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS jisho_words
+                    (level TEXT,
+                     word_id TEXT,
+                     page INTEGER,
+                     kanji TEXT,
+                     kana TEXT,
+                     chinese TEXT,
+                     PRIMARY KEY (level, word_id))''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jisho_words_page ON jisho_words (level, page)')
+    return conn
+
+def store_jisho_page(conn, level, page, words, known_digest):
+    """写入一页词汇，内容与上次相同时只更新抓取时间，返回是否有变化"""
+    digest = hashlib.sha1(json.dumps(words, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+    now = time.time()
+    with conn:
+        if digest == known_digest:
+            conn.execute('UPDATE jisho_pages SET fetched_at = ? WHERE level = ? AND page = ?', (now, level, page))
+            return False
+        conn.execute('DELETE FROM jisho_words WHERE level = ? AND page = ?', (level, page))
+        conn.executemany('INSERT OR REPLACE INTO jisho_words VALUES (?, ?, ?, ?, ?, ?)',
+                         [(level, word['id'], page, word['kanji'], word['kana'], word['chinese']) for word in words])
+        conn.execute('INSERT OR REPLACE INTO jisho_pages VALUES (?, ?, ?, ?, ?)',
+                     (level, page, digest, len(words), now))
+    return True
+
+def harvest_jisho(levels, db_path=JISHO_MIRROR_DB, concurrency=4, rate=2.0, retries=3,
+                  max_age=JISHO_PAGE_MAX_AGE, max_pages=JISHO_MAX_PAGES):
+    """并发翻页抓取各级别的 Jisho 搜索结果并写入本地镜像
+
+    未过期的页面直接跳过，内容没变的页面不改写；翻到空页为止，并删除镜像中多出来的页面。
+    """
+    started = time.perf_counter()
+    limiter = RateLimiter(rate, burst=concurrency)
+    report = {'fetched': 0, 'changed': 0, 'unchanged': 0, 'skipped': 0, 'failed': 0, 'words': 0}
+    conn = open_jisho_mirror(db_path)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for level in levels:
+                known = {page: (digest, fetched_at) for page, digest, fetched_at in
+                         conn.execute('SELECT page, digest, fetched_at FROM jisho_pages WHERE level = ?', (level,))}
+                now = time.time()
+                last_page = None
+                page = 1
+                # 每次并发抓取一批页面，遇到空页说明已经翻到最后
+                while last_page is None and page <= max_pages:
+                    batch = range(page, min(page + concurrency, max_pages + 1))
+                    futures = {}
+                    for p in batch:
+                        if p in known and now - known[p][1] < max_age:
+                            report['skipped'] += 1
+                        else:
+                            futures[p] = executor.submit(fetch_jisho_page, level, p, retries, limiter)
+
+                    for p, future in futures.items():
+                        try:
+                            items = future.result()
+                        except Exception as e:
+                            logger.error("抓取 %s 第 %d 页失败: %s", level, p, e)
+                            report['failed'] += 1
+                            continue
+                        report['fetched'] += 1
+                        if not items:
+                            last_page = p - 1 if last_page is None else min(last_page, p - 1)
+                            continue
+                        if last_page is not None and p > last_page:
+                            continue
+                        words = [word for word in map(normalize_jisho_item, items) if word]
+                        report['words'] += len(words)
+                        if store_jisho_page(conn, level, p, words, known.get(p, (None,))[0]):
+                            report['changed'] += 1
+                        else:
+                            report['unchanged'] += 1
+                    page = batch.stop
+
+                if last_page is not None:
+                    with conn:
+                        conn.execute('DELETE FROM jisho_words WHERE level = ? AND page > ?', (level, last_page))
+                        conn.execute('DELETE FROM jisho_pages WHERE level = ? AND page > ?', (level, last_page))
+                total = conn.execute('SELECT COUNT(*) FROM jisho_words WHERE level = ?', (level,)).fetchone()[0]
+                logger.info("%s: 共 %s 页，镜像中有 %d 个词，进度 %s",
+                            level, last_page if last_page is not None else '?', total, report)
+    finally:
+        conn.close()
+
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    report['pages_per_sec'] = round(report['fetched'] / report['seconds'], 1) if report['seconds'] else None
+    logger.info("Jisho 同步完成: %s", report)
+    return report
+
+def get_jisho_words(level, limit=20, db_path=JISHO_MIRROR_DB):
+    """从本地 Jisho 镜像随机抽取词汇，不访问 Jisho API"""
+    path = Path(db_path)
+    if not path.exists():
+        return []
+    try:
+        conn = sqlite3.connect(f'{path.resolve().as_uri()}?mode=ro', uri=True)
+        try:
+            # 每个级别最多几千个词，直接随机排序即可
+            rows = conn.execute('SELECT word_id, kanji, kana, chinese FROM jisho_words WHERE level = ? '
+                                'ORDER BY RANDOM() LIMIT ?', (level, limit)).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("读取 Jisho 镜像时出错: %s", e)
+        return []
+    return [{'id': word_id, 'kanji': kanji, 'kana': kana, 'chinese': chinese}
+            for word_id, kanji, kana, chinese in rows]
+
+def fetch_level_words(level, limit=20):
+    """获取一批词汇，优先使用EDICT数据库，其次是本地 Jisho 镜像，都没有时使用基本词汇"""
+    source = 'edict'
+    new_words = get_edict_words(level, limit)
+    if not new_words:
+        logger.info("从EDICT获取 %s 词汇失败，尝试使用 Jisho 镜像...", level)
+        source = 'jisho'
+        new_words = get_jisho_words(level, limit)
+        # 如果没有获取到足够的词，返回基本词汇
+        if len(new_words) < 4:
+            logger.warning("Jisho 镜像中的 %s 词汇不足，使用基本词汇", level)
+            source = 'fallback'
+            new_words = list(BASIC_WORDS)
+    vocab_source_counts.inc((level, source))
+    return new_words
+
+class RefillWorker:
+    """在后台补充 word_cache，请求线程只从缓冲区取词，不等待上游"""
+
+    def __init__(self, low=CACHE_LOW_WATERMARK, high=CACHE_HIGH_WATERMARK, max_age=CACHE_MAX_AGE):
+        self.low = low
+        self.high = high
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._stats = {level: {'refills': 0, 'errors': 0, 'last_latency': None, 'total_latency': 0.0}
+                       for level in LEVELS}
+
+    def request(self, level):
+        """在后台线程中补充该级别，已有补充在进行时直接返回"""
+        if word_cache.refilling(level):
+            return
+        threading.Thread(target=self.refill, args=(level,), name=f'word-cache-refill-{level}', daemon=True).start()
+
+    def needs_refill(self, level):
+        """缓冲区低于低水位或词汇过旧时需要补充"""
+        last_fetch = word_cache.last_fetch(level)
+        return (len(word_cache[level]) < self.low or
+                last_fetch is None or
+                time.time() - last_fetch > self.max_age)
+
+    def _fetch(self, level):
+        started = time.perf_counter()
+        try:
+            new_words = fetch_level_words(level, self.high)
+        except Exception as e:
+            logger.exception("补充 %s 词汇时出错: %s", level, e)
+            new_words = []
+
+        latency = time.perf_counter() - started
+        with self._lock:
+            stats = self._stats[level]
+            stats['last_latency'] = latency
+            stats['total_latency'] += latency
+            if new_words:
+                stats['refills'] += 1
+            else:
+                stats['errors'] += 1
+        return new_words
+
+    def refill(self, level, wait=False):
+        """补充到高水位，同一级别的并发调用只会请求一次上游"""
+        return word_cache.refill(level, self._fetch, wait=wait)
+
+    def stats(self):
+        """每个级别的缓冲区深度、补充次数和补充耗时"""
+        now = time.time()
+        result = {}
+        with self._lock:
+            snapshot = {level: dict(stats) for level, stats in self._stats.items()}
+        for level, stats in snapshot.items():
+            last_fetch = word_cache.last_fetch(level)
+            result[level] = {
+                'depth': len(word_cache[level]),
+                'pending': word_cache.refilling(level),
+                'age': round(now - last_fetch, 1) if last_fetch else None,
+                'refills': stats['refills'],
+                'errors': stats['errors'],
+                'last_latency': stats['last_latency'],
+                'avg_latency': stats['total_latency'] / stats['refills'] if stats['refills'] else None,
             }
-        }
+        return result
 
-        // 检查是否启用自动发音
-        function isAutoSoundEnabled() {
-            return document.getElementById('autoSound').checked;
-        }
-        let remainingWords = 0;
-        let isLoadingWords = false;
-
-        function updateStats() {
-            document.getElementById('correctCount').textContent = stats.correct;
-            document.getElementById('incorrectCount').textContent = stats.incorrect;
-            const total = stats.correct + stats.incorrect;
-            const accuracy = total > 0 ? Math.round((stats.correct / total) * 100) : 0;
-            document.getElementById('accuracy').textContent = accuracy;
-            document.getElementById('remainingWords').textContent = remainingWords;
-        }
+refill_worker = RefillWorker()
 
-        async function fetchNewWords(retryCount = 0) {
-            const maxRetries = 3;
-            const loadingDiv = document.getElementById('loading');
-            
-            if (isLoadingWords) return;
-            isLoadingWords = true;
-            
-            try {
-                // 显示加载状态
-                loadingDiv.textContent = '正在获取新词汇...';
-                loadingDiv.style.display = 'block';
-                
-                const response = await fetch(`/get_word?level=${currentLevel}&refresh=true`);
-                if (!response.ok) {
-                    throw new Error('获取词汇失败');
-                }
+def get_vocabulary(level='N5'):
+    """获取指定级别的词汇缓冲区，不足时交给后台线程补充"""
+    if refill_worker.needs_refill(level):
+        refill_worker.request(level)
+
+    return word_cache[level]
+
+def find_word(level, word_id):
+    """按稳定 id 查找词汇，与缓冲区当前的顺序无关"""
+    store = get_vocab_store(level)
+    if store is not None:
+        ent_seq = parse_edict_word_id(word_id)
+        return store.find(level, ent_seq) if ent_seq is not None else None
+
+    word = word_cache[level].get(word_id)
+    if word is None:
+        # 已经离开缓冲区的 EDICT 词条按主键回查词典
+        word = lookup_edict_word(word_id)
+    return word
+
+def lookup_edict_word(word_id):
+    """按稳定 id 从已打开的 edict.db 中查词，不会触发词典下载"""
+    ent_seq = parse_edict_word_id(word_id)
+    pool = edict_pool
+    if ent_seq is None or pool is None:
+        return None
+    with pool.connection() as conn:
+        row = conn.execute('SELECT kanji, kana FROM edict WHERE id = ?', (ent_seq,)).fetchone()
+    if row is None:
+        return None
+    return {'id': word_id, 'kanji': row[0], 'kana': row[1]}
+
+class StoreWords:
+    """把内存映射词汇库的一个级别包装成只读序列"""
+
+    __slots__ = ('store', 'level')
+
+    def __init__(self, store, level):
+        self.store = store
+        self.level = level
+
+    def __len__(self):
+        return self.store.count(self.level)
+
+    def __getitem__(self, index):
+        return self.store.get(self.level, index)
+
+class LevelPool:
+    """某个级别共享的只读词池，用户的复习队列从中挑选新词"""
+
+    def __init__(self, level, words, version=None, ttl=LEVEL_POOL_TTL, distractors=None, source=None):
+        self.level = level
+        self.words = words
+        self.source = source  # store、edict 或 cache
+        self.version = version
+        self.expires = time.time() + ttl
+        self.distractors = distractors  # 词 id -> 干扰项在词池中的下标，来自快照时才有
+
+    def __len__(self):
+        return len(self.words)
+
+    def __getitem__(self, index):
+        return self.words[index]
+
+    def stale(self):
+        # 来自 word_cache 的词池在缓冲区补充后即过期；词汇库生成好之后，之前临时建立的词池换成词汇库
+        return (time.time() > self.expires or
+                (self.version is not None and self.version != word_cache.last_fetch(self.level)) or
+                (self.source != 'store' and vocab_store is not None and get_vocab_store(self.level) is not None))
+
+level_pools = {}
+level_pools_lock = threading.Lock()
+
+def load_distractors(level):
+    """读取某个级别预先计算的干扰项，返回 {词 id: 干扰项在快照词池中的下标元组}；词典未打开时返回 None"""
+    pool = edict_pool
+    if pool is None:
+        return None
+    with pool.connection() as conn:
+        rows = conn.execute('''SELECT s.word_id, d.distractors FROM vocab_distractors d
+                               JOIN vocab_snapshot s ON s.level = d.level AND s.seq = d.seq
+                               WHERE d.level = ?''', (level,)).fetchall()
+    return {edict_word_id(word_id): tuple(map(int, filter(None, distractors.split(','))))
+            for word_id, distractors in rows} or None
+
+def load_level_pool(level):
+    """构建词池：优先内存映射词汇库，其次 EDICT 快照，最后退回 word_cache"""
+    store = get_vocab_store(level)
+    if store is not None:
+        level_pool_loads.inc((level, 'store'))
+        # 干扰项写在词汇库里，不需要打开 edict.db
+        return LevelPool(level, StoreWords(store, level), distractors=store.distractors(level) or None,
+                         source='store')
+
+    # 只使用已经打开的词典，请求线程不触发下载
+    pool = edict_pool
+    if pool is not None:
+        with pool.connection() as conn:
+            rows = conn.execute('''SELECT word_id, kanji, kana, chinese FROM vocab_snapshot
+                                   WHERE level = ? ORDER BY seq''', (level,)).fetchall()
+        if rows:
+            level_pool_loads.inc((level, 'edict'))
+            return LevelPool(level, tuple({'id': edict_word_id(word_id), 'kanji': kanji, 'kana': kana, 'chinese': chinese}
+                                          for word_id, kanji, kana, chinese in rows),
+                             distractors=load_distractors(level), source='edict')
+
+    buffer = get_vocabulary(level)
+    buffer.choice(fallback=BASIC_WORDS)
+    level_pool_loads.inc((level, 'cache'))
+    return LevelPool(level, tuple(buffer), version=word_cache.last_fetch(level) or 0.0, source='cache')
+
+def get_level_pool(level):
+    """获取某个级别当前的词池，edict.db 被重新导入后重建"""
+    reload_edict_pool_if_replaced()
+    pool = level_pools.get(level)
+    if pool is None or pool.stale():
+        with level_pools_lock:
+            pool = level_pools.get(level)
+            if pool is None or pool.stale():
+                pool = level_pools[level] = load_level_pool(level)
+    return pool
+
+# 答案归一化：全角/半角、片假名/平假名、大小写和空白用一张转换表折叠，罗马字按最长匹配转成假名
+ANSWER_CACHE_SIZE = 65536  # 缓存的标准答案归一化结果数
+
+def build_answer_fold():
+    """生成 str.translate 用的折叠表"""
+    table = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}  # ァ-ヶ -> ぁ-ゖ
+    table.update({0x30FD: 0x309D, 0x30FE: 0x309E})  # ヽヾ -> ゝゞ
+    table.update({code: chr(code).lower() for code in range(ord('A'), ord('Z') + 1)})
+    table.update({code: chr(code - 0xFEE0).lower() for code in range(0xFF01, 0xFF5F)})  # 全角 ASCII
+    for code in range(0xFF61, 0xFFA0):
+        # 半角片假名；浊音符号变成组合字符，之后由 NFC 合成
+        table[code] = unicodedata.normalize('NFKC', chr(code)).translate(table)
+    table.update({ord(ch): None for ch in ' \t　'})
+    return table
+
+ANSWER_FOLD = build_answer_fold()
+COMBINING_KANA_MARKS = re.compile('[゙゚]')
+ROMAJI_LETTER = re.compile('[a-z]')
+
+# 罗马字表：五十音行（含训令式）、拗音前缀和赫本式等其他写法
+ROMAJI_ROWS = {
+    '': 'あいうえお', 'k': 'かきくけこ', 's': 'さしすせそ', 't': 'たちつてと', 'n': 'なにぬねの',
+    'h': 'はひふへほ', 'm': 'まみむめも', 'r': 'らりるれろ', 'g': 'がぎぐげご', 'z': 'ざじずぜぞ',
+    'd': 'だぢづでど', 'b': 'ばびぶべぼ', 'p': 'ぱぴぷぺぽ', 'x': 'ぁぃぅぇぉ', 'l': 'ぁぃぅぇぉ',
+}
+ROMAJI_YOUON = {
+    'ky': 'き', 'sh': 'し', 'sy': 'し', 'ch': 'ち', 'ty': 'ち', 'cy': 'ち', 'ny': 'に', 'hy': 'ひ',
+    'my': 'み', 'ry': 'り', 'gy': 'ぎ', 'j': 'じ', 'jy': 'じ', 'zy': 'じ', 'dy': 'ぢ', 'by': 'び', 'py': 'ぴ',
+}
+ROMAJI_EXTRA = {
+    'shi': 'し', 'chi': 'ち', 'tsu': 'つ', 'fu': 'ふ', 'ji': 'じ', 'ya': 'や', 'yu': 'ゆ', 'yo': 'よ',
+    'wa': 'わ', 'wo': 'を', 'n': 'ん', "n'": 'ん', 'xn': 'ん', 'fa': 'ふぁ', 'fi': 'ふぃ', 'fe': 'ふぇ',
+    'fo': 'ふぉ', 'vu': 'ゔ', 'she': 'しぇ', 'che': 'ちぇ', 'je': 'じぇ',
+    'xya': 'ゃ', 'xyu': 'ゅ', 'xyo': 'ょ', 'lya': 'ゃ', 'lyu': 'ゅ', 'lyo': 'ょ',
+    'xtsu': 'っ', 'xtu': 'っ', 'ltu': 'っ', 'xwa': 'ゎ', '-': 'ー',
+}
 
-                const data = await response.json();
-                if (data.error) {
-                    throw new Error(data.error);
-                }
+def build_romaji_table():
+    """罗马字 -> 平假名，含拗音和促音（kka -> っか）"""
+    table = {}
+    for consonant, kana in ROMAJI_ROWS.items():
+        for vowel, ch in zip('aiueo', kana):
+            table.setdefault(consonant + vowel, ch)
+    for prefix, ch in ROMAJI_YOUON.items():
+        for vowel, small in zip('auo', 'ゃゅょ'):
+            table.setdefault(prefix + vowel, ch + small)
+    table.update(ROMAJI_EXTRA)
+    for key, value in list(table.items()):
+        if key[0] in 'bcdfghjkmpqrstvwz':
+            table.setdefault(key[0] + key, 'っ' + value)
+        if key.startswith('ch'):
+            table.setdefault('t' + key, 'っ' + value)  # 赫本式 matcha
+    return table
+
+def build_trie(table):
+    root = {}
+    for key, value in table.items():
+        node = root
+        for ch in key:
+            node = node.setdefault(ch, {})
+        node[None] = value
+    return root
+
+ROMAJI_KANA = build_romaji_table()
+ROMAJI_TRIE = build_trie(ROMAJI_KANA)
+
+def romaji_to_kana(text):
+    """按最长匹配把罗马字转成平假名，无法识别的字符原样保留"""
+    result = []
+    i, size = 0, len(text)
+    while i < size:
+        node, j, match, end = ROMAJI_TRIE, i, text[i], i + 1
+        while j < size:
+            node = node.get(text[j])
+            if node is None:
+                break
+            j += 1
+            if None in node:
+                match, end = node[None], j
+        result.append(match)
+        i = end
+    return ''.join(result)
+
+def normalize_answer(text):
+    """把答案折叠成统一形式：全角转半角、片假名转平假名、大写转小写、去掉空白，罗马字转成假名"""
+    text = text.translate(ANSWER_FOLD)
+    if COMBINING_KANA_MARKS.search(text):
+        text = unicodedata.normalize('NFC', text)
+    if ROMAJI_LETTER.search(text):
+        text = romaji_to_kana(text)
+    return text
+
+# 标准答案来自词池，重复率高，缓存归一化结果
+normalize_expected = lru_cache(maxsize=ANSWER_CACHE_SIZE)(normalize_answer)
+
+def typo_limit(length):
+    """允许的编辑距离：两个字以内不容错，六个字以内错一个，更长的错两个"""
+    return 0 if length <= 2 else 1 if length <= 6 else 2
+
+def trim_common(a, b):
+    """去掉公共前缀和后缀（不影响编辑距离），返回 (前缀长度, a 剩余长度, b 剩余长度)"""
+    size_a, size_b = len(a), len(b)
+    start = 0
+    while start < size_a and start < size_b and a[start] == b[start]:
+        start += 1
+    while size_a > start and size_b > start and a[size_a - 1] == b[size_b - 1]:
+        size_a -= 1
+        size_b -= 1
+    return start, size_a - start, size_b - start
+
+def bounded_edit_distance(a, b, limit):
+    """只计算对角线附近 limit 宽的带状 Levenshtein 距离，超过 limit 时提前返回 limit + 1"""
+    if a == b:
+        return 0
+    over = limit + 1
+    if abs(len(a) - len(b)) > limit:
+        return over
+    start, size_a, size_b = trim_common(a, b)
+    # 去掉公共部分后，一次编辑只会剩下最多一个字
+    if size_a <= 1 and size_b <= 1:
+        return max(size_a, size_b)
+    if not size_a or not size_b or limit <= 1:
+        return min(max(size_a, size_b), over)
+    a, b = a[start:start + size_a], b[start:start + size_b]
+
+    previous = [j if j <= limit else over for j in range(size_b + 1)]
+    for i in range(1, size_a + 1):
+        current = [over] * (size_b + 1)
+        if i <= limit:
+            current[0] = i
+        row_min = current[0]
+        ch = a[i - 1]
+        for j in range(max(1, i - limit), min(size_b, i + limit) + 1):
+            cost = previous[j - 1] + (ch != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return over
+        previous = current
+    return min(previous[size_b], over)
+
+def edit_positions(a, b):
+    """按最少编辑把 a 对齐到 b，返回 b 中需要标出的位置：被替换的、漏掉的，以及多打的字后面那个"""
+    start, size_a, size_b = trim_common(a, b)
+    last = len(b) - 1
+    if size_a <= 1 and size_b <= 1:
+        return [min(start, last)]
+    a, b = a[start:start + size_a], b[start:start + size_b]
+
+    rows = [list(range(size_b + 1))]
+    for i, ch in enumerate(a, 1):
+        row = [i]
+        for j, target in enumerate(b, 1):
+            row.append(min(rows[-1][j - 1] + (ch != target), rows[-1][j] + 1, row[j - 1] + 1))
+        rows.append(row)
+
+    positions = set()
+    i, j = size_a, size_b
+    while i or j:
+        if i and j and rows[i][j] == rows[i - 1][j - 1] + (a[i - 1] != b[j - 1]):
+            if a[i - 1] != b[j - 1]:
+                positions.add(start + j - 1)
+            i, j = i - 1, j - 1
+        elif j and rows[i][j] == rows[i][j - 1] + 1:
+            positions.add(start + j - 1)
+            j -= 1
+        else:
+            positions.add(min(start + j, last))
+            i -= 1
+    return sorted(positions)
+
+def grade_answer(answer, expected):
+    """判题，返回 (是否正确, 差一点时标准答案中要标出的位置，否则为 None)
+
+    归一化后与标准答案的编辑距离不超过 typo_limit 时算“差一点”；
+    归一化改变了标准答案的长度时位置无法对应，只返回空列表。
+    """
+    if answer == expected:
+        return True, None
+    normalized, target = normalize_answer(answer), normalize_expected(expected)
+    if normalized == target:
+        return True, None
+    limit = typo_limit(len(target))
+    if limit and bounded_edit_distance(normalized, target, limit) <= limit:
+        return False, edit_positions(normalized, target) if len(target) == len(expected) else []
+    return False, None
+
+class Card:
+    """一个用户对一个词的复习状态，按 SM-2 安排下次复习"""
+
+    __slots__ = ('word', 'ease', 'interval', 'reps', 'due', 'seq')
+
+    def __init__(self, word, now):
+        self.word = word
+        self.ease = SRS_INITIAL_EASE
+        self.interval = 0.0  # 天
+        self.reps = 0  # 连续答对次数，0 表示还在学习中
+        self.due = now
+        self.seq = 0  # 堆中有效项的序号
+
+    def review(self, quality, now):
+        """按回答质量（0-5）更新难度系数和间隔"""
+        if quality >= 3:
+            if self.reps == 0:
+                self.interval = 1.0
+            elif self.reps == 1:
+                self.interval = 6.0
+            else:
+                self.interval = round(self.interval * self.ease, 2)
+            self.reps += 1
+            self.due = now + self.interval * SRS_DAY
+        else:
+            # 答错后重新学习，本次练习中稍后再出现
+            self.reps = 0
+            self.interval = 0.0
+            self.due = now + SRS_RELEARN_DELAY
+        self.ease = max(SRS_MIN_EASE, self.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+
+class ReviewQueue:
+    """一个用户在某个级别的复习队列：按到期时间排序的最小堆，取下一张卡片是 O(log n)
+
+    卡片重新安排后旧的堆项不删除，序号对不上的项在到达堆顶时丢弃。
+    """
+
+    __slots__ = ('pool', 'cards', 'heap', 'learning', '_seq')
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.cards = {}  # 词 id -> Card
+        self.heap = []  # (到期时间, 序号, Card)
+        self.learning = 0  # 还在学习中的卡片数
+        self._seq = 0
+
+    def __len__(self):
+        return self.learning
+
+    def _push(self, card):
+        self._seq += 1
+        card.seq = self._seq
+        heapq.heappush(self.heap, (card.due, card.seq, card))
+
+    def _top(self):
+        """堆顶的有效项，顺便丢弃已失效的项"""
+        heap = self.heap
+        while heap:
+            entry = heap[0]
+            if entry[1] == entry[2].seq:
+                return entry
+            heapq.heappop(heap)
+        return None
+
+    def add(self, word, now):
+        """把一个词作为新卡片加入队列，立即到期"""
+        card = self.cards[word['id']] = Card(word, now)
+        self.learning += 1
+        self._push(card)
+        return card
+
+    def _introduce(self, now):
+        """从词池中随机挑一个还没学过的词加入队列，几次都撞上学过的词时放弃"""
+        size = len(self.pool)
+        for _ in range(8 if size else 0):
+            word = self.pool[random.randrange(size)]
+            if word['id'] not in self.cards:
+                return self.add(word, now)
+        return None
+
+    def draw_many(self, n, now=None):
+        """按到期时间取最多 n 个不重复的词
+
+        先取已到期的卡片；没有到期的卡片时，在学词数不足 DECK_SIZE 就加入新词，否则提前复习最早到期的。
+        """
+        now = time.time() if now is None else now
+        taken = []
+        while len(taken) < n:
+            entry = self._top()
+            if entry is None or entry[0] > now:
+                if self.learning < DECK_SIZE and self._introduce(now) is not None:
+                    continue
+                if entry is None:
+                    break
+            taken.append(heapq.heappop(self.heap))
+        # 取出的卡片放回堆中，回答之后才重新安排
+        for entry in taken:
+            heapq.heappush(self.heap, entry)
+        return [entry[2].word for entry in taken]
+
+    def draw(self, now=None):
+        words = self.draw_many(1, now)
+        return words[0] if words else None
+
+    def review(self, card, quality, now=None):
+        """记录一次回答（SM-2 回答质量）并重新安排卡片"""
+        was_learning = card.reps == 0
+        card.review(quality, time.time() if now is None else now)
+        self.learning += (card.reps == 0) - was_learning
+        self._push(card)
+
+class LearnerSession:
+    """一个用户的会话：每个级别一个复习队列"""
+
+    __slots__ = ('last_seen', 'queues')
+
+    def __init__(self):
+        self.last_seen = time.time()
+        self.queues = {}
+
+class SessionDecks:
+    """按会话令牌保存用户的复习队列，分段加锁的 LRU，空闲超时或超出上限时淘汰"""
+
+    STRIPES = 16
+
+    def __init__(self, limit=SESSION_LIMIT, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._stripe_limit = max(1, limit // self.STRIPES)
+        self._stripes = [(threading.Lock(), OrderedDict()) for _ in range(self.STRIPES)]
+        self.evicted = 0
+
+    def _queue(self, sessions, session_id, level):
+        now = time.time()
+        session = sessions.get(session_id)
+        if session is None:
+            session = sessions[session_id] = LearnerSession()
+        else:
+            sessions.move_to_end(session_id)
+        session.last_seen = now
 
-                remainingWords = data.remaining_words;
-                console.log(`成功获取新词汇，剩余数量: ${remainingWords}`);
-                
-                // 更新级别按钮状态
-                document.querySelectorAll('.level-btn').forEach(btn => {
-                    if (btn.dataset.level === currentLevel) {
-                        btn.classList.remove('loading');
-                    }
-                });
-
-            } catch (error) {
-                console.error('获取新词失败:', error);
-                
-                if (retryCount < maxRetries) {
-                    // 重试
-                    console.log(`重试获取新词 (${retryCount + 1}/${maxRetries})...`);
-                    loadingDiv.textContent = `获取失败，正在重试 (${retryCount + 1}/${maxRetries})...`;
-                    setTimeout(() => fetchNewWords(retryCount + 1), 1000);
-                    return;
-                } else {
-                    // 达到最大重试次数
-                    loadingDiv.textContent = '获取新词汇失败，请稍后再试';
-                    throw new Error('获取新词汇失败，已达到最大重试次数');
-                }
-            } finally {
-                isLoadingWords = false;
-                // 如果成功获取了词汇，隐藏加载提示
-                if (remainingWords > 0) {
-                    loadingDiv.style.display = 'none';
-                }
-            }
+        # 淘汰最久未活动的会话
+        while sessions:
+            oldest_id, oldest = next(iter(sessions.items()))
+            if len(sessions) <= self._stripe_limit and now - oldest.last_seen <= self.idle_timeout:
+                break
+            del sessions[oldest_id]
+            self.evicted += 1
+        sessions[session_id] = session
+
+        # 词池更换后保留已有的卡片，新词从新词池中挑选
+        pool = get_level_pool(level)
+        review_queue = session.queues.get(level)
+        if review_queue is None:
+            review_queue = session.queues[level] = ReviewQueue(pool)
+        review_queue.pool = pool
+        return review_queue
+
+    def _stripe(self, session_id):
+        return self._stripes[hash(session_id) % self.STRIPES]
+
+    def draw(self, session_id, level):
+        """为用户取下一个该复习的词，返回 (词, 在学词数)"""
+        lock, sessions = self._stripe(session_id)
+        with lock:
+            review_queue = self._queue(sessions, session_id, level)
+            return review_queue.draw(), len(review_queue)
+
+    def draw_many(self, session_id, level, n):
+        """为用户一次取最多 n 个该复习的词，返回 (词列表, 在学词数)"""
+        lock, sessions = self._stripe(session_id)
+        with lock:
+            review_queue = self._queue(sessions, session_id, level)
+            return review_queue.draw_many(n), len(review_queue)
+
+    def grade_many(self, session_id, level, answers):
+        """批量判题并重新安排复习；返回 (每个答案对应的词或 None, 每个答案的 grade_answer 结果, 在学词数)
+
+        answers 是 (word_id, mode, answer) 列表。不在队列中的词（例如离线词包里的词）
+        按 id 回查后加入队列，查不到的对应 None。
+        """
+        now = time.time()
+        lock, sessions = self._stripe(session_id)
+        with lock:
+            cards = self._queue(sessions, session_id, level).cards
+            words = [cards[word_id].word if word_id in cards else None for word_id, _, _ in answers]
+        # 回查可能读词典，判题也不依赖队列，都放在锁外
+        words = [word if word is not None else find_word(level, word_id)
+                 for (word_id, _, _), word in zip(answers, words)]
+        grades = [grade_answer(answer, word[mode]) if word is not None else (False, None)
+                  for (_, mode, answer), word in zip(answers, words)]
+
+        with lock:
+            review_queue = self._queue(sessions, session_id, level)
+            for (word_id, _, _), word, (is_correct, almost) in zip(answers, words, grades):
+                if word is not None:
+                    card = review_queue.cards.get(word_id) or review_queue.add(word, now)
+                    quality = (SRS_QUALITY_CORRECT if is_correct else
+                               SRS_QUALITY_ALMOST if almost is not None else SRS_QUALITY_WRONG)
+                    review_queue.review(card, quality, now)
+            return words, grades, len(review_queue)
+
+    def stats(self):
+        return {
+            'active': sum(len(sessions) for _, sessions in self._stripes),
+            'evicted': self.evicted,
         }
 
-        // 初始化事件监听器
-        document.addEventListener('DOMContentLoaded', () => {
-            // 级别选择事件处理
-            document.querySelectorAll('.level-btn').forEach(button => {
-                button.addEventListener('click', async function() {
-                    const newLevel = this.dataset.level;
-                    if (newLevel === currentLevel) return;
-                    
-                    // 更新按钮状态
-                    document.querySelector('.level-btn.active').classList.remove('active');
-                    this.classList.add('active');
-                    this.classList.add('loading');
-                    
-                    // 更新当前级别并重置统计
-                    currentLevel = newLevel;
-                    stats.correct = 0;
-                    stats.incorrect = 0;
-                    remainingWords = 0;
-                    
-                    try {
-                        // 获取新词
-                        await fetchNewWords();
-                        await getNewWord();
-                    } catch (error) {
-                        console.error('切换级别失败:', error);
-                    } finally {
-                        // 移除加载状态
-                        this.classList.remove('loading');
-                    }
-                    
-                    updateStats();
-                });
-            });
-
-            // 输入框回车事件
-            document.getElementById('answerInput').addEventListener('keypress', function(e) {
-                if (e.key === 'Enter' && !this.disabled) {
-                    checkAnswer();
-                }
-            });
-
-            // 自动发音开关事件
-            document.getElementById('autoSound').addEventListener('change', function() {
-                if (this.checked && currentWord) {
-                    playCurrentWord().catch(error => {
-                        console.error('自动发音失败:', error);
-                    });
-                }
-            });
-
-            // 初始加载
-            fetchNewWords().then(() => getNewWord()).catch(error => {
-                console.error('初始化失败:', error);
-            });
-        });
-    </script>
-</body>
-</html>
-'''
+session_decks = SessionDecks()
+
+class ProgressStore:
+    """答题记录的后写存储：record 只把事件追加到内存缓冲区，后台线程按数量或时间批量写入 WAL 模式的 SQLite"""
+
+    def __init__(self, db_path=PROGRESS_DB, flush_size=PROGRESS_FLUSH_SIZE,
+                 flush_interval=PROGRESS_FLUSH_INTERVAL, buffer_limit=PROGRESS_BUFFER_LIMIT):
+        self.db_path = db_path
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.buffer_limit = buffer_limit
+        self._lock = threading.Lock()  # 保护缓冲区
+        self._flush_lock = threading.Lock()  # 保护数据库连接，同一时间只有一个线程写入
+        self._buffer = []
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._closed = False
+        self._conn = None
+        self._stats = {'recorded': 0, 'written': 0, 'dropped': 0, 'flushes': 0, 'errors': 0, 'last_flush': None}
+
+    def record(self, session_id, level, answers, now=None):
+        """追加一批答题事件，answers 是 (word_id, mode, 是否答对) 列表"""
+        now = time.time() if now is None else now
+        events = [(session_id, level, word_id, mode, int(correct), now) for word_id, mode, correct in answers]
+        with self._lock:
+            kept = events[:max(0, self.buffer_limit - len(self._buffer))]
+            self._buffer.extend(kept)
+            self._stats['recorded'] += len(kept)
+            self._stats['dropped'] += len(events) - len(kept)
+            pending = len(self._buffer)
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name='progress-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+        if pending >= self.flush_size:
+            self._wakeup.set()
+
+    def _run(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')  # WAL 下只在检查点时 fsync
+            conn.execute('''CREATE TABLE IF NOT EXISTS answers
+                            (id INTEGER PRIMARY KEY,
+                             session TEXT,
+                             level TEXT,
+                             word_id TEXT,
+                             mode TEXT,
+                             correct INTEGER,
+                             answered_at REAL)''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_answers_session ON answers (session, level, answered_at)')
+            conn.execute('''CREATE TABLE IF NOT EXISTS progress
+                            (session TEXT,
+                             level TEXT,
+                             correct INTEGER,
+                             incorrect INTEGER,
+                             updated_at REAL,
+                             PRIMARY KEY (session, level)) WITHOUT ROWID''')
+            self._conn = conn
+        return self._conn
+
+    def flush(self):
+        """把缓冲区中的事件在一个事务中写入，同时更新各会话各级别的累计数，返回写入条数"""
+        with self._flush_lock:
+            with self._lock:
+                events, self._buffer = self._buffer, []
+            if not events:
+                return 0
+
+            totals = {}
+            for session_id, level, _, _, correct, answered_at in events:
+                total = totals.setdefault((session_id, level), [0, 0, answered_at])
+                total[0 if correct else 1] += 1
+                total[2] = max(total[2], answered_at)
+
+            started = time.perf_counter()
+            try:
+                conn = self._connection()
+                with conn:
+                    conn.executemany('''INSERT INTO answers (session, level, word_id, mode, correct, answered_at)
+                                        VALUES (?, ?, ?, ?, ?, ?)''', events)
+                    conn.executemany('''INSERT INTO progress (session, level, correct, incorrect, updated_at)
+                                        VALUES (?, ?, ?, ?, ?)
+                                        ON CONFLICT (session, level) DO UPDATE SET
+                                            correct = correct + excluded.correct,
+                                            incorrect = incorrect + excluded.incorrect,
+                                            updated_at = excluded.updated_at''',
+                                     [(session_id, level, correct, incorrect, updated_at)
+                                      for (session_id, level), (correct, incorrect, updated_at) in totals.items()])
+            except sqlite3.Error as e:
+                logger.error("写入答题记录失败: %s", e)
+                # 放回缓冲区下次再写，超出上限的丢弃
+                with self._lock:
+                    kept = events[:max(0, self.buffer_limit - len(self._buffer))]
+                    self._buffer[:0] = kept
+                    self._stats['dropped'] += len(events) - len(kept)
+                    self._stats['errors'] += 1
+                return 0
+
+            observe_latency('progress_flush', time.perf_counter() - started)
+            with self._lock:
+                self._stats['written'] += len(events)
+                self._stats['flushes'] += 1
+                self._stats['last_flush'] = time.time()
+            return len(events)
+
+    def summary(self, session_id):
+        """某个会话各级别的答对、答错次数，包括还没写入的事件"""
+        result = {}
+        with self._flush_lock:
+            if self._conn is not None or Path(self.db_path).exists():
+                rows = self._connection().execute('''SELECT level, correct, incorrect, updated_at FROM progress
+                                                     WHERE session = ?''', (session_id,)).fetchall()
+                for level, correct, incorrect, updated_at in rows:
+                    result[level] = {'correct': correct, 'incorrect': incorrect, 'updated_at': updated_at}
+            with self._lock:
+                pending = [event for event in self._buffer if event[0] == session_id]
+        for _, level, _, _, correct, answered_at in pending:
+            total = result.setdefault(level, {'correct': 0, 'incorrect': 0, 'updated_at': answered_at})
+            total['correct' if correct else 'incorrect'] += 1
+            total['updated_at'] = max(total['updated_at'], answered_at)
+        return result
+
+    def close(self):
+        """停止后台线程并写完剩余的事件"""
+        self._closed = True
+        self._wakeup.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self.flush()
+        with self._flush_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, buffered=len(self._buffer))
+
+progress_store = ProgressStore()
+
+SESSION_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{16,64}$')
+
+def get_session_id():
+    """读取会话令牌，没有或格式不对时生成新的，返回 (令牌, 是否新建)"""
+    session_id = request.cookies.get(SESSION_COOKIE, '')
+    if SESSION_ID_PATTERN.match(session_id):
+        return session_id, False
+    return secrets.token_urlsafe(16), True
+
+def with_session_cookie(response, session_id, is_new):
+    if is_new:
+        response.set_cookie(SESSION_COOKIE, session_id, max_age=30 * 24 * 3600, httponly=True, samesite='Lax')
+    return response
+
+# 页面静态资源：启动后只读取、压缩一次，资源文件名带内容哈希以便长期缓存
+STATIC_DIR = Path(__file__).resolve().parent / 'static'
+PAGE_ASSETS = ('style.css', 'app.js')  # index.html 引用的资源
+STATIC_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PAGE_CACHE_CONTROL = 'no-cache'  # 页面每次带 ETag 验证，资源换了哈希后立即生效
+ASSET_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'application/javascript; charset=utf-8',
+    '.json': 'application/json',
+}
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，没有安装时只提供 gzip
+    brotli = None
+
+class StaticAsset:
+    """一份静态资源及其预压缩版本"""
+
+    __slots__ = ('content_type', 'cache_control', 'etag', 'variants')
+
+    def __init__(self, name, body, cache_control):
+        self.content_type = ASSET_TYPES[Path(name).suffix]
+        self.cache_control = cache_control
+        self.etag = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {'identity': body, 'gzip': gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body)
+
+    def choose_encoding(self, accept_encoding):
+        """按 br、gzip 的顺序选择客户端接受的编码"""
+        accepted = {part.split(';')[0].strip() for part in accept_encoding.lower().split(',')}
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and encoding in accepted:
+                return encoding
+        return 'identity'
+
+def build_page_assets(directory=STATIC_DIR):
+    """读取页面和资源，资源 URL 换成带内容哈希的文件名，返回 {URL 路径: StaticAsset}"""
+    assets = {}
+    html = (directory / 'index.html').read_text(encoding='utf-8')
+    worker = (directory / 'sw.js').read_text(encoding='utf-8')
+    for name in PAGE_ASSETS:
+        body = (directory / name).read_bytes()
+        stem, suffix = name.rsplit('.', 1)
+        hashed = f'{stem}.{hashlib.sha256(body).hexdigest()[:12]}.{suffix}'
+        assets[f'/static/{hashed}'] = StaticAsset(hashed, body, STATIC_CACHE_CONTROL)
+        html = html.replace(f'/static/{name}', f'/static/{hashed}')
+        worker = worker.replace(f'/static/{name}', f'/static/{hashed}')
+    assets['/'] = StaticAsset('index.html', html.encode('utf-8'), PAGE_CACHE_CONTROL)
+    # Service Worker 必须从根路径提供才能接管整个页面；预缓存列表中的资源同样换成带哈希的文件名
+    assets['/sw.js'] = StaticAsset('sw.js', worker.encode('utf-8'), PAGE_CACHE_CONTROL)
+    return assets
+
+page_assets = None
+page_assets_lock = threading.Lock()
+
+def get_page_assets():
+    """首次使用时生成页面资源"""
+    global page_assets
+    if page_assets is None:
+        with page_assets_lock:
+            if page_assets is None:
+                page_assets = build_page_assets()
+    return page_assets
+
+def serve_asset(asset):
+    """返回客户端可接受的预压缩版本，ETag 匹配时返回 304"""
+    if request.if_none_match.contains_weak(asset.etag):
+        response = Response(status=304)
+    else:
+        encoding = asset.choose_encoding(request.headers.get('Accept-Encoding', ''))
+        response = Response(asset.variants[encoding], content_type=asset.content_type)
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+    # 各编码版本内容相同，使用弱 ETag
+    response.set_etag(asset.etag, weak=True)
+    response.headers['Cache-Control'] = asset.cache_control
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    """按路由记录处理耗时和状态码，流式响应只计到开始返回为止"""
+    started = g.get('request_started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        observe_request(route, response.status_code, time.perf_counter() - started)
+    return response
 
 @app.route('/')
 def index():
-    """渲染主页"""
-    return render_template_string(HTML_TEMPLATE)
+    """返回预先生成的主页"""
+    return serve_asset(get_page_assets()['/'])
+
+@app.route('/static/<name>')
+def static_asset(name):
+    """带内容哈希的页面资源，可长期缓存"""
+    asset = get_page_assets().get(f'/static/{name}')
+    if asset is None:
+        return jsonify({'error': 'Not found'}), 404
+    return serve_asset(asset)
+
+@app.route('/sw.js')
+def service_worker():
+    """离线缓存页面和词包的 Service Worker"""
+    return serve_asset(get_page_assets()['/sw.js'])
+
+level_packs = {}  # 级别 -> (词池, 词包)
+level_packs_lock = threading.Lock()
+
+def build_level_pack(pool):
+    """把词池序列化成紧凑的 JSON 词包，每个词是 [id, 汉字, 假名, 中文, 干扰项下标列表]"""
+    words = [pool[index] for index in range(len(pool))]
+    distractors = pool.distractors or {}
+    body = json.dumps({
+        'level': pool.level,
+        'words': [[word['id'], word['kanji'], word['kana'], word['chinese'], distractors.get(word['id'], ())]
+                  for word in words],
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    # 词包每次都带 ETag 验证，内容不变时只返回 304
+    return StaticAsset('pack.json', body, PAGE_CACHE_CONTROL)
+
+def get_level_pack(level):
+    """获取某个级别的词包，只从词汇库或 EDICT 快照生成，词池更换后重新生成；词典不可用时返回 None"""
+    pool = get_level_pool(level)
+    if pool.version is not None and edict_pool is None and Path(EDICT_DB).exists():
+        # 词池暂时来自 word_cache，先打开已有的词典再重建词池
+        get_edict_pool()
+        with level_pools_lock:
+            level_pools.pop(level, None)
+        pool = get_level_pool(level)
+    if pool.version is not None:
+        return None
+
+    cached = level_packs.get(level)
+    if cached is None or cached[0] is not pool:
+        with level_packs_lock:
+            cached = level_packs.get(level)
+            if cached is None or cached[0] is not pool:
+                cached = level_packs[level] = (pool, build_level_pack(pool))
+    return cached[1]
+
+@app.route('/pack/<level>')
+def level_pack(level):
+    """下载某个级别的离线词包"""
+    if level not in LEVELS:
+        return jsonify({'error': f'Unknown level {level}'}), 404
+    pack = get_level_pack(level)
+    if pack is None:
+        return jsonify({'error': 'Pack not available'}), 404
+    return serve_asset(pack)
+
+def pick_choices(pool, word, mode):
+    """选择题的选项：正确答案加 CHOICE_COUNT - 1 个干扰项，顺序打乱
+
+    干扰项从预先计算的候选中随机取，不需要查词典；没有候选（例如词池来自 word_cache）
+    或候选不够时，从词池中随机补充。
+    """
+    answer = word[mode]
+    options = [answer]
+    size = len(pool)
+
+    def add(index):
+        if index < size:
+            option = pool[index][mode]
+            if option and option not in options:
+                options.append(option)
+
+    candidates = pool.distractors.get(word['id'], ()) if pool.distractors else ()
+    for index in random.sample(candidates, len(candidates)):
+        if len(options) >= CHOICE_COUNT:
+            break
+        add(index)
+    for _ in range(8 if size else 0):
+        if len(options) >= CHOICE_COUNT:
+            break
+        add(random.randrange(size))
+    random.shuffle(options)
+    return options
 
 @app.route('/get_word')
 def get_word():
     """获取词汇"""
     level = request.args.get('level', 'N5')
+    if level not in LEVELS:
+        return jsonify({'error': f'Unknown level {level}'}), 400
     refresh = request.args.get('refresh', 'false').lower() == 'true'
-    
-    # 如果请求刷新或词汇不足，获取新词
-    if refresh or len(word_cache[level]) < 5:
-        new_words = get_jisho_words(level)
-        if new_words:
-            word_cache[level].extend(new_words)
-            word_cache['last_fetch'][level] = time.time()
-    
-    words = list(word_cache[level])
-    if not words:
-        return jsonify({'error': f'No words available for level {level}'}), 404
-    
-    word = random.choice(words)
-    word_id = words.index(word)
+    with_choices = request.args.get('choices', 'false').lower() == 'true'
     mode = random.choice(['kana', 'kanji'])
-    
-    return jsonify({
+    session_id, is_new = get_session_id()
+
+    # 刷新和补充都交给后台线程，这里只从用户自己的复习队列中取词
+    if refresh and get_vocab_store(level) is None:
+        refill_worker.request(level)
+    word, remaining_words = session_decks.draw(session_id, level)
+
+    if word is None:
+        return jsonify({'error': f'No words available for level {level}'}), 404
+
+    payload = {
         'word': {
-            'id': word_id,
+            'id': word['id'],
             'chinese': word['chinese'],
             'kanji': word['kanji'],
             'kana': word['kana']
         },
         'mode': mode,
-        'remaining_words': len(words)
-    })
+        'remaining_words': remaining_words
+    }
+    if with_choices:
+        payload['choices'] = pick_choices(get_level_pool(level), word, mode)
+    return with_session_cookie(jsonify(payload), session_id, is_new)
 
 @app.route('/check_answer', methods=['POST'])
 def check_answer():
@@ -914,458 +2373,650 @@ def check_answer():
     try:
         data = request.get_json()
         level = data.get('level', 'N5')
-        words = list(word_cache[level])
-        
-        if data['word_id'] >= len(words):
-            return jsonify({'error': 'Invalid word ID'}), 400
-            
-        word = words[data['word_id']]
         mode = data['mode']
-        user_answer = data['answer']
-        
-        correct_answer = word[mode]
-        is_correct = user_answer == correct_answer
-        
-        # 如果答对了，从缓存中移除这个词
-        if is_correct and word in word_cache[level]:
-            word_cache[level].remove(word)
-        
-        return jsonify({
-            'correct': is_correct,
-            'correct_answer': correct_answer,
-            'remaining_words': len(word_cache[level])
-        })
-    except Exception as e:
-        print(f"Error checking answer: {e}")
-        return jsonify({'error': 'Failed to check answer'}), 500
-
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=56459)
-                    ...data.word,
-                    kanji: data.word_info.kanji,
-                    kana: data.word_info.kana
-                };
-                currentMode = data.mode;
-                remainingWords = data.remaining_words;
-                
-                // 更新显示
-                document.getElementById('chinese').textContent = currentWord.chinese;
-                document.getElementById('answerInput').value = '';
-                document.getElementById('answerInput').placeholder = currentMode === 'kana' ? '输入假名' : '输入汉字';
-                document.getElementById('result').textContent = '';
-                document.getElementById('answerInput').focus();
-                updateStats();
-
-                // 如果启用了自动发音，播放当前词汇
-                if (isAutoSoundEnabled()) {
-                    // 延迟一小段时间再播放，确保界面已更新
-                    setTimeout(() => {
-                        playCurrentWord();
-                    }, 100);
-                }
-            } catch (error) {
-                console.error('获取新词失败:', error);
-                document.getElementById('result').textContent = '获取词汇失败，请刷新页面重试';
-                document.getElementById('result').className = 'result incorrect';
-            }
-        }
+        word_id = data['word_id']
+        session_id, is_new = get_session_id()
 
-        // 播放当前词汇的发音
-        async function playCurrentWord() {
-            const soundIcon = document.getElementById('soundIcon');
-            const soundError = document.getElementById('soundError');
-            const loadingSpinner = soundIcon.querySelector('.sound-loading');
-            
-            if (!currentWord || (!currentWord.kanji && !currentWord.kana)) {
-                soundError.textContent = '没有可用的发音文本';
-                soundError.style.display = 'block';
-                return;
-            }
-            
-            // 如果正在播放或加载中，不执行任何操作
-            if (soundIcon.classList.contains('playing') || loadingSpinner.style.display === 'flex') {
-                return;
-            }
-            
-            try {
-                // 优先使用汉字进行发音，如果没有汉字则使用假名
-                const text = currentWord.kanji || currentWord.kana;
-                
-                // 显示加载动画
-                loadingSpinner.style.display = 'flex';
-                soundIcon.classList.add('disabled');
-                soundError.style.display = 'none';
-
-                // 如果有正在播放的音频，停止它
-                if (currentAudio) {
-                    currentAudio.pause();
-                    currentAudio.currentTime = 0;
-                }
-
-                // 发送发音请求
-                const response = await fetch('/speak', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({ text: text })
-                });
-
-                if (!response.ok) {
-                    const errorData = await response.json();
-                    throw new Error(errorData.details || '发音请求失败');
-                }
+        if mode not in ('kana', 'kanji'):
+            return jsonify({'error': 'Invalid mode'}), 400
 
-                const audioBlob = await response.blob();
-                const audioUrl = URL.createObjectURL(audioBlob);
-                
-                // 创建新的音频实例
-                currentAudio = new Audio(audioUrl);
-                
-                // 音频加载完成时的处理
-                currentAudio.oncanplaythrough = () => {
-                    loadingSpinner.style.display = 'none';
-                    soundIcon.classList.remove('disabled');
-                    soundIcon.classList.add('playing');
-                };
-
-                // 音频播放结束时的处理
-                currentAudio.onended = () => {
-                    URL.revokeObjectURL(audioUrl);
-                    soundIcon.classList.remove('playing');
-                };
-
-                // 错误处理
-                currentAudio.onerror = (error) => {
-                    console.error('音频加载失败:', error);
-                    soundError.textContent = '音频加载失败';
-                    soundError.style.display = 'block';
-                    loadingSpinner.style.display = 'none';
-                    soundIcon.classList.remove('disabled');
-                };
-
-                // 播放音频
-                await currentAudio.play();
-            } catch (error) {
-                console.error('播放失败:', error);
-                soundError.textContent = error.message || '发音失败';
-                soundError.style.display = 'block';
-                loadingSpinner.style.display = 'none';
-                soundIcon.classList.remove('disabled');
-            }
-        }
-
-        // 在获取新词时自动播放
-        async function getNewWord(retryCount = 0) {
-            const maxRetries = 3;
-            const resultDiv = document.getElementById('result');
-            const answerInput = document.getElementById('answerInput');
-
-            try {
-                // 显示加载状态
-                resultDiv.textContent = '加载中...';
-                resultDiv.className = 'result';
-                answerInput.disabled = true;
-
-                // 检查是否需要获取新词
-                if (remainingWords < 5) {
-                    await fetchNewWords();
-                }
-
-                const response = await fetch(`/get_word?level=${currentLevel}`);
-                if (!response.ok) {
-                    throw new Error('获取词汇失败');
-                }
-
-                const data = await response.json();
-                if (data.error) {
-                    throw new Error(data.error);
-                }
-
-                // 更新当前词汇
-                currentWord = data.word;
-                currentMode = data.mode;
-                remainingWords = data.remaining_words;
-                
-                // 更新显示
-                document.getElementById('chinese').textContent = currentWord.chinese;
-                answerInput.value = '';
-                answerInput.placeholder = currentMode === 'kana' ? '输入假名' : '输入汉字';
-                resultDiv.textContent = '';
-                
-                // 重新启用输入
-                answerInput.disabled = false;
-                answerInput.focus();
-                
-                // 更新统计
-                updateStats();
-
-                // 如果启用了自动发音，播放当前词汇
-                if (isAutoSoundEnabled()) {
-                    setTimeout(() => {
-                        playCurrentWord().catch(error => {
-                            console.error('自动发音失败:', error);
-                        });
-                    }, 300);
-                }
-
-            } catch (error) {
-                console.error('获取新词失败:', error);
-                
-                if (retryCount < maxRetries) {
-                    // 重试
-                    console.log(`重试获取新词 (${retryCount + 1}/${maxRetries})...`);
-                    resultDiv.textContent = `加载失败，正在重试 (${retryCount + 1}/${maxRetries})...`;
-                    setTimeout(() => getNewWord(retryCount + 1), 1000);
-                } else {
-                    // 达到最大重试次数
-                    resultDiv.textContent = '获取词汇失败，请点击任意级别按钮重试';
-                    resultDiv.className = 'result incorrect';
-                    answerInput.disabled = false;
-                    answerInput.placeholder = '暂时无法获取新词';
-                }
-            }
-        }
-
-        async function checkAnswer() {
-            const userInput = document.getElementById('answerInput').value;
-            const resultDiv = document.getElementById('result');
-            
-            if (!userInput) return;
-
-            try {
-                const response = await fetch('/check_answer', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
-                    body: JSON.stringify({
-                        answer: userInput,
-                        word_id: currentWord.id,
-                        mode: currentMode,
-                        level: currentLevel
-                    })
-                });
-
-                if (!response.ok) {
-                    throw new Error('Network response was not ok');
-                }
-                
-                const result = await response.json();
-                
-                if (result.correct) {
-                    resultDiv.textContent = '正确！';
-                    resultDiv.className = 'result correct';
-                    stats.correct++;
-                    remainingWords--;
-                    setTimeout(getNewWord, 300);
-                } else {
-                    resultDiv.innerHTML = `错误！<br>正确答案：${result.correct_answer}`;
-                    resultDiv.className = 'result incorrect';
-                    stats.incorrect++;
-                }
-                updateStats();
-            } catch (error) {
-                console.error('提交答案时出错:', error);
-                resultDiv.textContent = '网络错误，请重试';
-                resultDiv.className = 'result incorrect';
-                
-                // 启用输入框和回车键，允许用户重试
-                const answerInput = document.getElementById('answerInput');
-                answerInput.disabled = false;
-                answerInput.focus();
-            }
-        }
-
-        // 级别选择事件处理
-        document.querySelectorAll('.level-btn').forEach(button => {
-            button.addEventListener('click', async function() {
-                const newLevel = this.dataset.level;
-                if (newLevel === currentLevel) return;
-                
-                // 更新按钮状态
-                document.querySelector('.level-btn.active').classList.remove('active');
-                this.classList.add('active');
-                
-                // 添加加载状态
-                this.classList.add('loading');
-                
-                // 更新当前级别并重置统计
-                currentLevel = newLevel;
-                stats.correct = 0;
-                stats.incorrect = 0;
-                remainingWords = 0;
-                
-                // 获取新词
-                await fetchNewWords();
-                await getNewWord();
-                
-                // 移除加载状态
-                this.classList.remove('loading');
-                
-                updateStats();
-            });
-        });
-
-        document.getElementById('answerInput').addEventListener('keypress', function(e) {
-            if (e.key === 'Enter') checkAnswer();
-        });
-
-        // 初始加载
-        fetchNewWords().then(() => getNewWord());
-    </script>
-</body>
-</html>
-'''
+        # 判题并按结果安排这个词的下次复习
+        words, grades, remaining_words = session_decks.grade_many(
+            session_id, level, [(word_id, mode, data['answer'])])
+        if words[0] is None:
+            return jsonify({'error': 'Invalid word ID'}), 400
+        is_correct, almost = grades[0]
+        progress_store.record(session_id, level, [(word_id, mode, is_correct)])
 
-@app.route('/')
-def index():
-    return render_template_string(HTML_TEMPLATE)
+        return with_session_cookie(jsonify({
+            'correct': is_correct,
+            'almost': almost is not None,
+            'highlight': almost or [],
+            'correct_answer': words[0][mode],
+            'remaining_words': remaining_words
+        }), session_id, is_new)
+    except Exception as e:
+        logger.warning("Error checking answer: %s", e)
+        return jsonify({'error': 'Failed to check answer'}), 500
 
-@app.route('/get_word')
-def get_word():
+@app.route('/get_words')
+def get_words():
+    """一次获取一批词汇，每个词带有出题方式，choices=true 时带选择题选项"""
     level = request.args.get('level', 'N5')
+    if level not in LEVELS:
+        return jsonify({'error': f'Unknown level {level}'}), 400
     refresh = request.args.get('refresh', 'false').lower() == 'true'
-    
-    # 如果请求刷新或词汇不足，获取新词
-    if refresh or len(word_cache[level]) < 5:
-        new_words = get_jisho_words(level)
-        if new_words:
-            word_cache[level].extend(new_words)
-            word_cache['last_fetch'][level] = time.time()
-    
-    words = list(word_cache[level])
+    try:
+        n = min(max(int(request.args.get('n', 10)), 1), DECK_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Invalid n'}), 400
+    with_choices = request.args.get('choices', 'false').lower() == 'true'
+    session_id, is_new = get_session_id()
+
+    if refresh and get_vocab_store(level) is None:
+        refill_worker.request(level)
+    words, remaining_words = session_decks.draw_many(session_id, level, n)
+
     if not words:
         return jsonify({'error': f'No words available for level {level}'}), 404
-    
-    word = random.choice(words)
-    word_id = words.index(word)
-    mode = random.choice(['kana', 'kanji'])
-    
-    return jsonify({
-        'word': {
-            'id': word_id,
-            'chinese': word['chinese'],
-            'kanji': word['kanji'],
-            'kana': word['kana']
-        },
-        'mode': mode,
-        'remaining_words': len(words)
-    })
 
-@app.route('/check_answer', methods=['POST'])
-def check_answer():
-    data = request.get_json()
-    level = data.get('level', 'N5')
-    words = list(word_cache[level])
-    
-    if data['word_id'] >= len(words):
-        return jsonify({'error': 'Invalid word ID'}), 400
-        
-    word = words[data['word_id']]
-    mode = data['mode']
-    user_answer = data['answer']
-    
-    correct_answer = word[mode]
-    is_correct = user_answer == correct_answer
-    
-    # 如果答对了，从缓存中移除这个词
-    if is_correct and word in word_cache[level]:
-        word_cache[level].remove(word)
+    pool = get_level_pool(level)
+    items = []
+    for word in words:
+        mode = random.choice(['kana', 'kanji'])
+        item = {'id': word['id'], 'chinese': word['chinese'], 'kanji': word['kanji'], 'kana': word['kana'], 'mode': mode}
+        if with_choices:
+            item['choices'] = pick_choices(pool, word, mode)
+        items.append(item)
+
+    return with_session_cookie(jsonify({
+        'words': items,
+        'remaining_words': remaining_words
+    }), session_id, is_new)
+
+@app.route('/check_answers', methods=['POST'])
+def check_answers():
+    """批量检查答案，供客户端本地判题后分批同步"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Expected a JSON object'}), 400
+        level = data.get('level', 'N5')
+        if level not in LEVELS:
+            return jsonify({'error': f'Unknown level {level}'}), 400
+        answers = data.get('answers')
+        if not isinstance(answers, list) or len(answers) > CHECK_ANSWERS_LIMIT:
+            return jsonify({'error': f'answers must be a list of at most {CHECK_ANSWERS_LIMIT} items'}), 400
+        if not all(isinstance(item, dict) and isinstance(item.get('word_id'), str) and
+                   isinstance(item.get('answer'), str) for item in answers):
+            return jsonify({'error': 'Each answer must be an object with string word_id and answer'}), 400
+        answers = [(item['word_id'], item.get('mode'), item['answer']) for item in answers]
+        if any(mode not in ('kana', 'kanji') for _, mode, _ in answers):
+            return jsonify({'error': 'Invalid mode'}), 400
+        session_id, is_new = get_session_id()
+
+        words, grades, remaining_words = session_decks.grade_many(session_id, level, answers)
+        progress_store.record(session_id, level, [(word_id, mode, is_correct)
+                                                  for (word_id, mode, _), word, (is_correct, _) in zip(answers, words, grades)
+                                                  if word is not None])
+        results = []
+        for (word_id, mode, _), word, (is_correct, almost) in zip(answers, words, grades):
+            if word is None:
+                results.append({'word_id': word_id, 'error': 'Invalid word ID'})
+                continue
+            results.append({'word_id': word_id, 'correct': is_correct, 'almost': almost is not None,
+                            'highlight': almost or [], 'correct_answer': word[mode]})
+
+        return with_session_cookie(jsonify({
+            'results': results,
+            'remaining_words': remaining_words
+        }), session_id, is_new)
+    except Exception as e:
+        logger.warning("Error checking answers: %s", e)
+        return jsonify({'error': 'Failed to check answers'}), 500
+
+@app.route('/progress')
+def progress():
+    """当前用户各级别的答题统计，带 level 参数时只返回该级别"""
+    session_id, is_new = get_session_id()
+    summary = progress_store.summary(session_id)
+    level = request.args.get('level')
+    if level is None:
+        return with_session_cookie(jsonify({'levels': summary}), session_id, is_new)
+    if level not in LEVELS:
+        return jsonify({'error': f'Unknown level {level}'}), 400
+    totals = summary.get(level, {'correct': 0, 'incorrect': 0, 'updated_at': None})
+    return with_session_cookie(jsonify({'level': level, **totals}), session_id, is_new)
+
+class AudioCache:
+    """按内容寻址的 TTS 音频缓存：内存 LRU 一级，磁盘二级，均有容量上限"""
+
+    def __init__(self, directory=TTS_CACHE_DIR, memory_limit=TTS_MEMORY_CACHE_BYTES, disk_limit=TTS_DISK_CACHE_BYTES):
+        self.directory = Path(directory)
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None  # 首次写入时再统计
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'bytes_saved': 0, 'evicted_files': 0}
+
+    @staticmethod
+    def key(text, lang=TTS_LANG):
+        return hashlib.sha256(f'{lang}\0{text}'.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return self.directory / key[:2] / f'{key}.mp3'
+
+    def _remember(self, key, audio):
+        # 调用方持有锁
+        if len(audio) > self.memory_limit:
+            return
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = audio
+        self._memory_bytes += len(audio)
+        while self._memory_bytes > self.memory_limit:
+            _, old = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old)
+
+    def get(self, key):
+        """依次查内存和磁盘，未命中返回 None"""
+        with self._lock:
+            audio = self._memory.get(key)
+            if audio is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                self._stats['bytes_saved'] += len(audio)
+                return audio
+
+        path = self._path(key)
+        try:
+            audio = path.read_bytes()
+            os.utime(path)  # 用修改时间记录最近使用，供淘汰参考
+        except OSError:
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+
+        with self._lock:
+            self._remember(key, audio)
+            self._stats['disk_hits'] += 1
+            self._stats['bytes_saved'] += len(audio)
+        return audio
+
+    def contains(self, key):
+        with self._lock:
+            if key in self._memory:
+                return True
+        return self._path(key).exists()
+
+    def put(self, key, audio):
+        """写入内存和磁盘，磁盘超出上限时淘汰最久未用的文件"""
+        with self._lock:
+            self._remember(key, audio)
+
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{threading.get_ident()}.tmp')
+        tmp_path.write_bytes(audio)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(f.stat().st_size for f in self.directory.glob('*/*.mp3'))
+            else:
+                self._disk_bytes += len(audio)
+            if self._disk_bytes > self.disk_limit:
+                self._evict_disk()
+
+    def _evict_disk(self):
+        # 调用方持有锁，淘汰到上限的 90% 以免频繁扫描目录
+        files = []
+        for f in self.directory.glob('*/*.mp3'):
+            try:
+                stat = f.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, f))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        target = self.disk_limit * 0.9
+        for _, size, f in files:
+            if total <= target:
+                break
+            try:
+                f.unlink()
+            except OSError:
+                continue
+            total -= size
+            self._stats['evicted_files'] += 1
+        self._disk_bytes = total
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_bytes'] = self._memory_bytes
+            stats['memory_items'] = len(self._memory)
+            stats['disk_bytes'] = self._disk_bytes
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['memory_hits'] + stats['disk_hits']) / lookups if lookups else None
+        return stats
+
+audio_cache = AudioCache()
+
+class AudioNotAvailable(Exception):
+    """离线模式下缓存中没有该文本的音频"""
+
+def open_tts_stream(text, lang=TTS_LANG):
+    """向 TTS 服务（默认 Google TTS）发起流式请求，返回已检查过状态的响应"""
+    # 构建 TTS URL
+    audio_url = TTS_URL.format(lang=lang, text=quote(text))
     
-    return jsonify({
-        'correct': is_correct,
-        'correct_answer': correct_answer,
-        'remaining_words': len(word_cache[level])
-    })
+    # 发送请求获取音频
+    response = http_session.get(audio_url, timeout=5, stream=True)
+    try:
+        response.raise_for_status()
+
+        # 检查响应内容类型
+        if 'audio/mpeg' not in response.headers.get('Content-Type', ''):
+            raise ValueError('Invalid response content type')
+    except Exception:
+        response.close()
+        raise
+    return response
+
+def fetch_tts_audio(text, lang=TTS_LANG):
+    """完整读取一段音频"""
+    with open_tts_stream(text, lang) as response:
+        return response.content
+
+def stream_tts_audio(key, text, lang=TTS_LANG):
+    """边从上游读取边转发给客户端，完整读完后写入缓存"""
+    started = time.perf_counter()
+    upstream = open_tts_stream(text, lang)
+    observe_latency('speak_ttfb:stream', time.perf_counter() - started)
+
+    def generate():
+        chunks = []
+        complete = False
+        try:
+            for chunk in upstream.iter_content(TTS_STREAM_CHUNK):
+                chunks.append(chunk)
+                yield chunk
+            complete = True
+        finally:
+            upstream.close()
+            observe_latency('speak_total:stream', time.perf_counter() - started)
+            # 客户端中途断开时不缓存不完整的音频
+            if complete:
+                audio_cache.put(key, b''.join(chunks))
+
+    return generate()
+
+def get_tts_audio(text, lang=TTS_LANG):
+    """获取音频，优先使用缓存；未命中时按配置流式或整段获取，返回音频字节或分块迭代器"""
+    started = time.perf_counter()
+    key = AudioCache.key(text, lang)
+    audio = audio_cache.get(key)
+    if audio is not None:
+        observe_latency('speak_total:cache', time.perf_counter() - started)
+        return audio
+    if TTS_OFFLINE:
+        raise AudioNotAvailable(text)
+    if TTS_STREAMING:
+        return stream_tts_audio(key, text, lang)
+
+    audio = fetch_tts_audio(text, lang)
+    audio_cache.put(key, audio)
+    elapsed = time.perf_counter() - started
+    observe_latency('speak_ttfb:buffered', elapsed)
+    observe_latency('speak_total:buffered', elapsed)
+    return audio
+
+class RateLimiter:
+    """线程安全的令牌桶限速器"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+def iter_level_readings(level, db_path=EDICT_DB):
+    """列出某个级别所有需要发音的文本（汉字和假名），去重"""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute('SELECT kanji, kana FROM vocab_snapshot WHERE level = ? ORDER BY seq', (level,)).fetchall()
+    finally:
+        conn.close()
 
-@app.route('/speak', methods=['POST'])
+    seen = set()
+    for kanji, kana in rows:
+        for text in (kanji, kana):
+            if text and len(text) <= 100 and text not in seen:
+                seen.add(text)
+                yield text
+
+def prerender_tts(levels, db_path=EDICT_DB, concurrency=4, rate=5.0, retries=3):
+    """预先为若干级别的词汇生成发音并写入音频缓存，已缓存的文本会跳过，可随时中断后续跑"""
+    started = time.perf_counter()
+    limiter = RateLimiter(rate, burst=concurrency)
+    report = {'rendered': 0, 'skipped': 0, 'failed': 0}
+    report_lock = threading.Lock()
+
+    def render(text):
+        key = AudioCache.key(text)
+        if audio_cache.contains(key):
+            return 'skipped'
+        for attempt in range(retries):
+            limiter.acquire()
+            try:
+                audio_cache.put(key, fetch_tts_audio(text))
+                return 'rendered'
+            except Exception as e:
+                if attempt == retries - 1:
+                    logger.error("生成发音失败: %s: %s", text, e)
+                    return 'failed'
+                time.sleep(2 ** attempt)
+
+    texts = [text for level in levels for text in iter_level_readings(level, db_path)]
+    logger.info("共 %d 个文本，并发 %d，限速 %s 次/秒", len(texts), concurrency, rate)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for done, result in enumerate(executor.map(render, texts), 1):
+            with report_lock:
+                report[result] += 1
+            if done % 500 == 0:
+                logger.info("进度 %d/%d: %s", done, len(texts), report)
+
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    logger.info("预生成完成: %s", report)
+    return report
+
+def check_speak_text(text):
+    """验证发音文本，不合法时返回错误信息"""
+    if not text:
+        if TRACE:
+            trace("Error: No text provided")
+        return 'No text provided'
+    
+    # 限制文本长度
+    if len(text) > 100:
+        if TRACE:
+            trace("Error: Text too long: %d", len(text))
+        return 'Text too long (max 100 characters)'
+    return None
+
+@app.route('/speak', methods=['GET', 'POST'])
 def speak():
-    """处理文本到语音的转换请求"""
+    """处理文本到语音的转换请求，GET 形式可被浏览器长期缓存"""
     try:
         # 获取请求数据
-        data = request.get_json()
-        text = data.get('text', '').strip()
-        print(f"Received text for speech synthesis: {text}")
+        if request.method == 'GET':
+            text = request.args.get('text', '').strip()
+        else:
+            data = request.get_json()
+            text = data.get('text', '').strip()
+        if TRACE:
+            trace("Received text for speech synthesis: %s", text)
         
         # 验证输入
-        if not text:
-            print("Error: No text provided")
-            return jsonify({'error': 'No text provided'}), 400
-        
-        # 限制文本长度
-        if len(text) > 100:
-            print("Error: Text too long")
-            return jsonify({'error': 'Text too long (max 100 characters)'}), 400
+        error = check_speak_text(text)
+        if error:
+            return jsonify({'error': error}), 400
+
+        # 相同文本的音频内容不变，浏览器带着 ETag 来时直接返回 304
+        etag = AudioCache.key(text)[:32]
+        if etag in request.if_none_match:
+            response = Response(status=304)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = TTS_CACHE_CONTROL
+            return response
 
         try:
-            # 构建 Google TTS URL
-            encoded_text = text.replace(' ', '%20')
-            audio_url = f'https://translate.google.com/translate_tts?ie=UTF-8&tl=ja&client=tw-ob&q={encoded_text}'
-            
-            # 设置请求头
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            
-            # 发送请求获取音频
-            response = requests.get(audio_url, headers=headers, timeout=5)
-            response.raise_for_status()
+            audio = get_tts_audio(text)
 
-            # 检查响应内容类型
-            if 'audio/mpeg' not in response.headers.get('Content-Type', ''):
-                raise ValueError('Invalid response content type')
-
-            # 返回音频流
-            return Response(
-                response.content,
+            # 返回音频流，未命中缓存时按块转发上游数据
+            response = Response(
+                audio,
                 mimetype='audio/mpeg',
                 headers={
                     'Content-Disposition': 'attachment; filename=speech.mp3',
-                    'Cache-Control': 'no-cache'
+                    'Cache-Control': TTS_CACHE_CONTROL
                 }
             )
+            response.set_etag(etag)
+            return response
+
+        except AudioNotAvailable:
+            return jsonify({
+                'error': 'Audio not available',
+                'details': 'No pre-rendered audio for this text'
+            }), 404
 
         except requests.Timeout:
-            print("Error: Request timeout")
+            logger.warning("Error: Request timeout")
             return jsonify({
                 'error': 'Speech synthesis timeout',
                 'details': 'The request took too long to complete'
             }), 504
 
         except requests.RequestException as e:
-            print(f"Network error: {e}")
+            logger.warning("Network error: %s", e)
             return jsonify({
                 'error': 'Network error',
                 'details': str(e)
             }), 503
 
         except Exception as e:
-            print(f"Unexpected error: {e}")
+            logger.exception("Unexpected error: %s", e)
             return jsonify({
                 'error': 'Internal server error',
                 'details': str(e)
             }), 500
 
     except Exception as e:
-        print(f"Request processing error: {e}")
+        logger.warning("Request processing error: %s", e)
         return jsonify({
             'error': 'Bad request',
             'details': str(e)
         }), 400
 
-if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=56459)
-                'error': 'Failed to generate speech',
-                'details': str(e)
-            }), 500
+@app.route('/stats')
+def stats():
+    """返回服务内部的运行统计"""
+    pool = edict_pool
+    return jsonify({
+        'edict_pool': pool.stats() if pool else None,
+        'word_cache': refill_worker.stats(),
+        'sessions': session_decks.stats(),
+        'progress': progress_store.stats(),
+        'tts_cache': audio_cache.stats(),
+        'latency': {name: histogram.snapshot() for name, histogram in sorted(latency_histograms.items())},
+    })
 
-    except Exception as e:
-        print(f"Error in speech route: {e}")
-        return jsonify({
-            'error': 'Failed to process speech request',
-            'details': str(e)
-        }), 500
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+def render_metrics():
+    """把内部统计整理成 Prometheus 文本格式"""
+    lines = []
+
+    # 指标名参数与标签名（例如 name）分开，避免关键字冲突
+    def family(metric, kind, help_text):
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+
+    def sample(metric, value, **labels):
+        if value is not None:
+            lines.append(f'{metric}{format_labels(labels)} {value}')
+
+    def histogram(metric, snapshot, **labels):
+        for bound, count in snapshot['buckets'].items():
+            sample(f'{metric}_bucket', count, **labels, le=bound)
+        sample(f'{metric}_sum', snapshot['sum'], **labels)
+        sample(f'{metric}_count', snapshot['count'], **labels)
+
+    family('nihongo_request_duration_seconds', 'histogram', '各路由的请求处理耗时')
+    for route, hist in sorted(route_histograms.items()):
+        histogram('nihongo_request_duration_seconds', hist.snapshot(), route=route)
+    family('nihongo_requests_total', 'counter', '各路由按状态码的请求数')
+    for (route, status), count in sorted(request_counts.snapshot().items()):
+        sample('nihongo_requests_total', count, route=route, status=status)
+
+    family('nihongo_upstream_duration_seconds', 'histogram', '上游调用与 TTS 各阶段耗时')
+    for name, hist in sorted(latency_histograms.items()):
+        histogram('nihongo_upstream_duration_seconds', hist.snapshot(), name=name)
+
+    refill_stats = refill_worker.stats()
+    family('nihongo_word_cache_depth', 'gauge', '各级别 word_cache 中的词数')
+    for level, stats in refill_stats.items():
+        sample('nihongo_word_cache_depth', stats['depth'], level=level)
+    family('nihongo_word_cache_refills_total', 'counter', '各级别成功的后台补充次数')
+    for level, stats in refill_stats.items():
+        sample('nihongo_word_cache_refills_total', stats['refills'], level=level)
+    family('nihongo_word_cache_refill_errors_total', 'counter', '各级别没有取到词的后台补充次数')
+    for level, stats in refill_stats.items():
+        sample('nihongo_word_cache_refill_errors_total', stats['errors'], level=level)
+    family('nihongo_vocab_fetch_total', 'counter', '后台补充按词汇来源（edict/jisho/fallback）的次数')
+    for (level, source), count in sorted(vocab_source_counts.snapshot().items()):
+        sample('nihongo_vocab_fetch_total', count, level=level, source=source)
+    family('nihongo_level_pool_loads_total', 'counter', '共享词池按来源（store/edict/cache）的加载次数')
+    for (level, source), count in sorted(level_pool_loads.snapshot().items()):
+        sample('nihongo_level_pool_loads_total', count, level=level, source=source)
+
+    session_stats = session_decks.stats()
+    family('nihongo_sessions', 'gauge', '当前保留的学习会话数')
+    sample('nihongo_sessions', session_stats['active'])
+    family('nihongo_sessions_evicted_total', 'counter', '被淘汰的学习会话数')
+    sample('nihongo_sessions_evicted_total', session_stats['evicted'])
+
+    progress_stats = progress_store.stats()
+    family('nihongo_progress_buffered', 'gauge', '等待写入的答题事件数')
+    sample('nihongo_progress_buffered', progress_stats['buffered'])
+    family('nihongo_progress_events_total', 'counter', '答题事件按结果（recorded/written/dropped）的条数')
+    for result in ('recorded', 'written', 'dropped'):
+        sample('nihongo_progress_events_total', progress_stats[result], result=result)
+    family('nihongo_progress_flushes_total', 'counter', '答题记录的批量写入次数')
+    sample('nihongo_progress_flushes_total', progress_stats['flushes'])
+    family('nihongo_progress_flush_errors_total', 'counter', '答题记录写入失败的次数')
+    sample('nihongo_progress_flush_errors_total', progress_stats['errors'])
+
+    tts_stats = audio_cache.stats()
+    family('nihongo_tts_cache_hits_total', 'counter', 'TTS 音频缓存命中次数')
+    sample('nihongo_tts_cache_hits_total', tts_stats['memory_hits'], tier='memory')
+    sample('nihongo_tts_cache_hits_total', tts_stats['disk_hits'], tier='disk')
+    family('nihongo_tts_cache_misses_total', 'counter', 'TTS 音频缓存未命中次数')
+    sample('nihongo_tts_cache_misses_total', tts_stats['misses'])
+    family('nihongo_tts_cache_bytes', 'gauge', 'TTS 音频缓存占用的字节数')
+    sample('nihongo_tts_cache_bytes', tts_stats['memory_bytes'], tier='memory')
+    sample('nihongo_tts_cache_bytes', tts_stats['disk_bytes'], tier='disk')
+
+    pool = edict_pool
+    if pool is not None:
+        pool_stats = pool.stats()
+        family('nihongo_edict_pool_acquires_total', 'counter', 'EDICT 读连接的获取次数')
+        for result in ('hits', 'misses', 'waits'):
+            sample('nihongo_edict_pool_acquires_total', pool_stats[result], result=result)
+        family('nihongo_edict_pool_connections', 'gauge', 'EDICT 读连接数')
+        sample('nihongo_edict_pool_connections', pool_stats['size'], state='open')
+        sample('nihongo_edict_pool_connections', pool_stats['idle'], state='idle')
+
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 格式的运行指标"""
+    return Response(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=56459)
\ No newline at end of file
+    import argparse
+
+    parser = argparse.ArgumentParser(description='NiHonnGo 日语学习网站')
+    subparsers = parser.add_subparsers(dest='command')
+
+    import_parser = subparsers.add_parser('import-edict', help='流式导入 EDICT 词典')
+    import_parser.add_argument('--source', help='edict2.gz 的本地路径或 URL，默认从官方镜像下载')
+    import_parser.add_argument('--db', default=EDICT_DB, help='目标数据库路径')
+    import_parser.add_argument('--chunk-size', type=int, default=EDICT_IMPORT_CHUNK, help='每批写入的行数')
+    import_parser.add_argument('--report', help='将导入报告以 JSON 行追加到该文件')
+
+    snapshot_parser = subparsers.add_parser('build-snapshot', help='重建词汇快照，默认只处理有变化的级别')
+    snapshot_parser.add_argument('--db', default=EDICT_DB, help='数据库路径')
+    snapshot_parser.add_argument('--level', action='append', choices=list(LEVELS), help='只处理指定级别，可重复')
+    snapshot_parser.add_argument('--force', action='store_true', help='忽略摘要，强制重建')
+
+    store_parser = subparsers.add_parser('build-store', help='从词汇快照生成内存映射词汇库')
+    store_parser.add_argument('--db', default=EDICT_DB, help='数据库路径')
+    store_parser.add_argument('--output', default=VOCAB_STORE_PATH or 'vocab.bin', help='词汇库文件路径')
+    store_parser.add_argument('--level', action='append', choices=list(LEVELS), help='只包含指定级别，可重复')
+
+    prerender_parser = subparsers.add_parser('prerender-tts', help='预生成某些级别全部词汇的发音')
+    prerender_parser.add_argument('--level', action='append', choices=list(LEVELS), required=True, help='级别，可重复')
+    prerender_parser.add_argument('--db', default=EDICT_DB, help='数据库路径')
+    prerender_parser.add_argument('--concurrency', type=int, default=4, help='并发请求数')
+    prerender_parser.add_argument('--rate', type=float, default=5.0, help='每秒最多请求次数，0 表示不限')
+    prerender_parser.add_argument('--tts-url', help='TTS 地址模板，可用 {lang} 和 {text}，例如本地替身服务')
+
+    harvest_parser = subparsers.add_parser('harvest-jisho', help='并发翻页抓取 Jisho 搜索结果到本地镜像')
+    harvest_parser.add_argument('--level', action='append', choices=list(LEVELS), help='级别，可重复，默认全部')
+    harvest_parser.add_argument('--db', default=JISHO_MIRROR_DB, help='镜像数据库路径')
+    harvest_parser.add_argument('--concurrency', type=int, default=4, help='并发请求数')
+    harvest_parser.add_argument('--rate', type=float, default=2.0, help='每秒最多请求次数，0 表示不限')
+    harvest_parser.add_argument('--max-pages', type=int, default=JISHO_MAX_PAGES, help='每个级别最多抓取的页数')
+    harvest_parser.add_argument('--full', action='store_true', help='忽略页面抓取时间，全部重新抓取')
+    harvest_parser.add_argument('--jisho-url', help='Jisho 搜索 API 地址，例如本地替身服务')
+    harvest_parser.add_argument('--report', help='将同步报告以 JSON 行追加到该文件')
+
+    args = parser.parse_args()
+
+    if args.command == 'harvest-jisho':
+        if args.jisho_url:
+            JISHO_API_URL = args.jisho_url
+        report = harvest_jisho(args.level or list(LEVELS), args.db, args.concurrency, args.rate,
+                               max_age=0 if args.full else JISHO_PAGE_MAX_AGE, max_pages=args.max_pages)
+        if args.report:
+            report['finished_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            with open(args.report, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(report, ensure_ascii=False) + '\n')
+    elif args.command == 'prerender-tts':
+        if args.tts_url:
+            TTS_URL = args.tts_url
+        prerender_tts(args.level, args.db, args.concurrency, args.rate)
+    elif args.command == 'build-store':
+        build_vocab_store(args.db, args.output, args.level)
+    elif args.command == 'build-snapshot':
+        conn = sqlite3.connect(args.db)
+        try:
+            rebuilt = build_vocab_snapshot(conn, args.level, args.force)
+        finally:
+            conn.close()
+        if not rebuilt:
+            logger.info("词汇快照已是最新")
+    elif args.command == 'import-edict':
+        report = import_edict(args.source, args.db, args.chunk_size)
+        if args.report:
+            report['finished_at'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+            with open(args.report, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(report, ensure_ascii=False) + '\n')
+    else:
+        app.run(host='0.0.0.0', port=56459)
@@ -0,0 +1,270 @@
+"""NiHonnGo 的 ASGI 入口
+
+用法:
+    uvicorn asgi:application --host 0.0.0.0 --port 56459
+
+/speak 在事件循环里处理：上游 TTS 请求放到独立的线程池执行，同一段文本的并发请求
+共享同一次上游请求，等待上游的请求只占一个协程而不占工作线程。
+其余路由通过 WSGI 桥交给 Flask 应用处理；词汇补充在后台线程中按级别合并执行，
+只读本地词典和 Jisho 镜像，不会阻塞请求。
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+
+import requests
+
+from app import (
+    HTTP_POOL_SIZE,
+    TTS_CACHE_CONTROL,
+    TTS_LANG,
+    TTS_OFFLINE,
+    AudioCache,
+    AudioNotAvailable,
+    app as flask_app,
+    audio_cache,
+    check_speak_text,
+    fetch_tts_audio,
+    logger,
+    observe_latency,
+    observe_request,
+    progress_store,
+)
+
+# 执行上游请求的线程数，与 HTTP 连接池大小一致
+UPSTREAM_WORKERS = int(os.environ.get('UPSTREAM_WORKERS', HTTP_POOL_SIZE))
+
+upstream_executor = ThreadPoolExecutor(max_workers=UPSTREAM_WORKERS, thread_name_prefix='upstream')
+
+class SingleFlight:
+    """同一个键同时只发起一次调用，并发的调用方等待同一个结果"""
+
+    def __init__(self):
+        self._inflight = {}
+        self._stats = {'calls': 0, 'shared': 0}
+
+    async def do(self, key, fn, *args):
+        task = self._inflight.get(key)
+        if task is None:
+            self._stats['calls'] += 1
+            task = asyncio.ensure_future(fn(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self._stats['shared'] += 1
+        # 某个调用方断开时不取消共享的调用，其他调用方仍在等待
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # 所有调用方都已离开时避免“异常未被读取”的警告
+
+    def stats(self):
+        return dict(self._stats, inflight=len(self._inflight))
+
+tts_flight = SingleFlight()
+
+async def run_upstream(fn, *args):
+    """在上游线程池中执行阻塞调用"""
+    return await asyncio.get_running_loop().run_in_executor(upstream_executor, fn, *args)
+
+def load_tts_audio(key, text, lang=TTS_LANG):
+    """查缓存，未命中时整段获取并写入缓存"""
+    audio = audio_cache.get(key)
+    if audio is not None:
+        return audio
+    if TTS_OFFLINE:
+        raise AudioNotAvailable(text)
+    audio = fetch_tts_audio(text, lang)
+    audio_cache.put(key, audio)
+    return audio
+
+async def get_tts_audio_async(text, lang=TTS_LANG):
+    """获取音频，同一段文本同时只有一次缓存查找或上游请求"""
+    started = time.perf_counter()
+    key = AudioCache.key(text, lang)
+    audio = await tts_flight.do(key, run_upstream, load_tts_audio, key, text, lang)
+    observe_latency('speak_total:async', time.perf_counter() - started)
+    return audio
+
+async def read_body(receive):
+    body = []
+    while True:
+        message = await receive()
+        body.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(body)
+
+def get_header(scope, name):
+    for key, value in scope['headers']:
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+def etag_matches(header, etag):
+    """判断 If-None-Match 中是否包含该 ETag"""
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == '*' or tag.strip('"') == etag:
+            return True
+    return False
+
+async def send_response(send, status, body=b'', headers=()):
+    headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    headers.append((b'content-length', str(len(body)).encode('latin-1')))
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def send_json(send, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    await send_response(send, status, body, [('content-type', 'application/json')])
+
+async def speak(scope, receive, send):
+    """/speak 的异步实现，行为与 Flask 版本一致，未命中缓存时整段返回"""
+    try:
+        if scope['method'] == 'GET':
+            query = parse_qs(scope['query_string'].decode('latin-1'))
+            text = query.get('text', [''])[0].strip()
+        else:
+            data = json.loads(await read_body(receive))
+            text = data.get('text', '').strip()
+    except Exception as e:
+        await send_json(send, 400, {'error': 'Bad request', 'details': str(e)})
+        return
+
+    error = check_speak_text(text)
+    if error:
+        await send_json(send, 400, {'error': error})
+        return
+
+    etag = AudioCache.key(text)[:32]
+    cache_headers = [('etag', f'"{etag}"'), ('cache-control', TTS_CACHE_CONTROL)]
+    if etag_matches(get_header(scope, b'if-none-match'), etag):
+        await send_response(send, 304, headers=cache_headers)
+        return
+
+    try:
+        audio = await get_tts_audio_async(text)
+    except AudioNotAvailable:
+        await send_json(send, 404, {
+            'error': 'Audio not available',
+            'details': 'No pre-rendered audio for this text'
+        })
+        return
+    except requests.Timeout:
+        logger.warning("Error: Request timeout")
+        await send_json(send, 504, {
+            'error': 'Speech synthesis timeout',
+            'details': 'The request took too long to complete'
+        })
+        return
+    except requests.RequestException as e:
+        logger.warning("Network error: %s", e)
+        await send_json(send, 503, {'error': 'Network error', 'details': str(e)})
+        return
+    except Exception as e:
+        logger.exception("Unexpected error: %s", e)
+        await send_json(send, 500, {'error': 'Internal server error', 'details': str(e)})
+        return
+
+    await send_response(send, 200, audio, [
+        ('content-type', 'audio/mpeg'),
+        ('content-disposition', 'attachment; filename=speech.mp3'),
+        *cache_headers
+    ])
+
+def build_environ(scope, body):
+    """把 ASGI 请求转换成 WSGI environ"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'CONTENT_LENGTH': str(len(body)),  # 请求体已完整读入
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': str(client[0]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        value = value.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value
+        elif name != 'content-length':
+            key = 'HTTP_' + name.upper().replace('-', '_')
+            environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+def call_wsgi(environ):
+    """在工作线程中执行 Flask 应用，返回 (状态码, 响应头, 响应体)"""
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = headers
+
+    result = flask_app(environ, start_response)
+    try:
+        body = b''.join(result)
+    finally:
+        if hasattr(result, 'close'):
+            result.close()
+    return response['status'], response['headers'], body
+
+async def wsgi_bridge(scope, receive, send):
+    environ = build_environ(scope, await read_body(receive))
+    status, headers, body = await asyncio.to_thread(call_wsgi, environ)
+    headers = [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]
+    await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+def metered_send(send, route):
+    """包装 send，在响应开始时按路由记录状态码和处理耗时"""
+    started = time.perf_counter()
+
+    async def wrapped(message):
+        if message['type'] == 'http.response.start':
+            observe_request(route, message['status'], time.perf_counter() - started)
+        await send(message)
+
+    return wrapped
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            upstream_executor.shutdown(wait=False, cancel_futures=True)
+            await asyncio.to_thread(progress_store.close)  # 写完缓冲区中的答题记录
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def application(scope, receive, send):
+    """ASGI 应用"""
+    if scope['type'] == 'lifespan':
+        await lifespan(scope, receive, send)
+    elif scope['type'] != 'http':
+        return
+    elif scope['path'] == '/speak' and scope['method'] in ('GET', 'POST'):
+        await speak(scope, receive, metered_send(send, '/speak'))
+    else:
+        await wsgi_bridge(scope, receive, send)
@@ -0,0 +1,838 @@
+"""NiHonnGo 性能基准测试
+
+用法:
+    python bench.py sampling [--db edict.db] [--rounds 200]
+    python bench.py stress [--threads 32] [--requests 200]
+    python bench.py fake-upstream [--port 8900] [--latency 0.2]
+    python bench.py speak [--rounds 50]
+    python bench.py load [--concurrency 20] [--duration 20] [--compare BASE HEAD]
+    python bench.py cold-start [--rows 50000] [--vocab-store]
+    python bench.py srs [--users 1 10 100] [--cards 10000]
+    python bench.py answers [--answers 1000000]
+    python bench.py typos [--rounds 200000]
+"""
+import argparse
+import gzip
+import hashlib
+import heapq
+import json
+import os
+import random
+import re
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import unicodedata
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+import app
+
+# 合成词典中各级别的词数，大致接近真实 EDICT 的分布
+SYNTHETIC_LEVEL_SIZES = {'N5': 700, 'N4': 650, 'N3': 1800, 'N2': 1800, 'N1': 3400}
+
+def build_synthetic_edict(db_path, total_rows=200000):
+    """生成一个与 EDICT 规模相近的合成数据库，并建立抽样索引"""
+    levels = [level for level, size in SYNTHETIC_LEVEL_SIZES.items() for _ in range(size)]
+    levels += [None] * (total_rows - len(levels))
+    random.Random(42).shuffle(levels)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode=OFF')
+    conn.execute('PRAGMA synchronous=OFF')
+    conn.execute('''CREATE TABLE edict
+                    (id INTEGER PRIMARY KEY,
+                     kanji TEXT,
+                     kana TEXT,
+                     meanings TEXT,
+                     tags TEXT)''')
+    with conn:
+        conn.executemany('INSERT INTO edict (kanji, kana, meanings, tags) VALUES (?, ?, ?, ?)',
+                         ((f'語{i}', f'ご{i}', f'(n) word {i}/EntL{1000000 + i}X', level)
+                          for i, level in enumerate(levels)))
+    app.build_vocab_snapshot(conn)
+    conn.close()
+
+def write_synthetic_edict_gz(path, total_rows=200000):
+    """生成与 build_synthetic_edict 相同分布的 edict2.gz，用于测试首次启动时的下载导入"""
+    levels = [level for level, size in SYNTHETIC_LEVEL_SIZES.items() for _ in range(size)]
+    levels += [None] * (total_rows - len(levels))
+    random.Random(42).shuffle(levels)
+    with gzip.open(path, 'wt', encoding='euc-jp') as f:
+        f.write('　？？？ /EDICT, EDRDG/\n')  # 首行是文件说明，导入时跳过
+        for i, level in enumerate(levels):
+            tag = f'/{level}' if level else ''
+            f.write(f'語{i} [ご{i}] /(n) word {i}{tag}/EntL{1000000 + i}X/\n')
+
+def measure(fn, rounds):
+    """执行 fn 若干次，返回每次耗时（秒）"""
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def print_report(name, samples):
+    """打印均值、p50 和 p99（微秒）"""
+    ordered = sorted(samples)
+    p50 = ordered[len(ordered) // 2]
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{name:<28} mean {statistics.mean(samples) * 1e6:>10.1f}us"
+          f"  p50 {p50 * 1e6:>10.1f}us  p99 {p99 * 1e6:>10.1f}us")
+
+def bench_sampling(args):
+    """比较 ORDER BY RANDOM() 与按行号抽样的耗时"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db
+        if not db_path:
+            db_path = str(Path(tmp) / 'edict.db')
+            print(f"生成合成词典 ({args.rows} 行)...")
+            build_synthetic_edict(db_path, args.rows)
+
+        conn = sqlite3.connect(db_path)
+        app.level_word_counts.clear()
+        for level in ('N5', 'N1'):
+            # 旧查询不使用新建的索引，以还原原来的执行计划
+            def legacy():
+                conn.execute('''SELECT kanji, kana, meanings FROM edict NOT INDEXED
+                                WHERE tags = ? AND kanji != ""
+                                ORDER BY RANDOM() LIMIT ?''', (level, args.limit)).fetchall()
+
+            def sampled():
+                app.sample_edict_rows(conn, level, args.limit)
+
+            print(f"\n{level} (每次 {args.limit} 个词, {args.rounds} 轮)")
+            print_report('ORDER BY RANDOM()', measure(legacy, args.rounds))
+            print_report('vocab_snapshot sampling', measure(sampled, args.rounds))
+        conn.close()
+
+def check_word_cache_invariants(level):
+    """检查一个级别的缓冲区内部结构是否一致，返回发现的问题"""
+    buffer = app.word_cache[level]
+    problems = []
+    with buffer._lock:
+        words = list(buffer._words)
+        positions = dict(buffer._positions)
+    ids = [word['id'] for word in words]
+    if len(ids) != len(set(ids)):
+        problems.append(f'{level}: 缓冲区中有重复的 id')
+    if len(words) > buffer.maxlen:
+        problems.append(f'{level}: 缓冲区超出容量 {len(words)} > {buffer.maxlen}')
+    if len(positions) != len(words) or any(ids[pos] != word_id for word_id, pos in positions.items()):
+        problems.append(f'{level}: id 索引与数组不一致')
+    return problems
+
+def bench_stress(args):
+    """多线程并发请求 /get_word 和 /check_answer，检查缓存不变量"""
+    inflight = {level: 0 for level in app.LEVELS}
+    max_inflight = {level: 0 for level in app.LEVELS}
+    upstream_calls = {level: 0 for level in app.LEVELS}
+    inflight_lock = threading.Lock()
+
+    def fake_fetch(level, limit=20):
+        # 模拟较慢的上游，词条 id 有重叠，用来覆盖去重逻辑
+        with inflight_lock:
+            inflight[level] += 1
+            upstream_calls[level] += 1
+            max_inflight[level] = max(max_inflight[level], inflight[level])
+        try:
+            time.sleep(random.uniform(0.001, 0.02))
+            return [{'id': f'e{n}', 'kanji': f'語{n}', 'kana': f'ご{n}', 'chinese': f'词{n}'}
+                    for n in random.sample(range(200), limit)]
+        finally:
+            with inflight_lock:
+                inflight[level] -= 1
+
+    app.fetch_level_words = fake_fetch
+    levels = list(app.LEVELS)
+    failures = []
+    counts = {'get_word': 0, 'check_answer': 0, 'correct': 0}
+    counts_lock = threading.Lock()
+
+    def learner(seed):
+        rng = random.Random(seed)
+        client = app.app.test_client()
+        local = {'get_word': 0, 'check_answer': 0, 'correct': 0}
+        for _ in range(args.requests):
+            level = rng.choice(levels)
+            refresh = 'true' if rng.random() < 0.05 else 'false'
+            response = client.get(f'/get_word?level={level}&refresh={refresh}')
+            local['get_word'] += 1
+            if response.status_code != 200:
+                failures.append(f'/get_word 返回 {response.status_code}')
+                continue
+            data = response.get_json()
+            word, mode = data['word'], data['mode']
+            right = rng.random() < 0.7
+            answer = word[mode] if right else word[mode] + 'x'
+            response = client.post('/check_answer', json={
+                'level': level, 'word_id': word['id'], 'mode': mode, 'answer': answer})
+            local['check_answer'] += 1
+            if response.status_code != 200:
+                failures.append(f'/check_answer 返回 {response.status_code}')
+                continue
+            result = response.get_json()
+            if result['correct'] != right or result['correct_answer'] != word[mode]:
+                failures.append(f'{word["id"]} 判题结果错误')
+            local['correct'] += result['correct']
+        with counts_lock:
+            for key, value in local.items():
+                counts[key] += value
+
+    print(f"{args.threads} 个线程，每个线程 {args.requests} 轮 get_word -> check_answer ...")
+    # 答题记录写到临时目录，不在当前目录留下 progress.db
+    with tempfile.TemporaryDirectory() as tmp:
+        app.progress_store = app.ProgressStore(str(Path(tmp) / 'progress.db'))
+        try:
+            started = time.perf_counter()
+            threads = [threading.Thread(target=learner, args=(i,)) for i in range(args.threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+        finally:
+            app.progress_store.close()
+
+    # 等待后台补充结束后再检查结构
+    for level in levels:
+        app.refill_worker.refill(level, wait=True)
+    for level in levels:
+        failures.extend(check_word_cache_invariants(level))
+        if max_inflight[level] > 1:
+            failures.append(f'{level}: 同时有 {max_inflight[level]} 个上游请求')
+
+    total = counts['get_word'] + counts['check_answer']
+    print(f"完成 {total} 个请求，耗时 {elapsed:.2f}s ({total / elapsed:.0f} 请求/秒)")
+    print(f"上游请求次数: {upstream_calls}，最大并发: {max_inflight}")
+    if failures:
+        print(f"发现 {len(failures)} 个问题，例如:")
+        for failure in failures[:10]:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("所有不变量均成立")
+
+def fake_jisho_page(keyword, page, pages):
+    """替身 Jisho 的一页搜索结果，每个级别 pages 页、每页 20 个词，之后为空页"""
+    match = re.search(r'jlpt-n(\d)', keyword)
+    level = f'N{match.group(1)}' if match else 'N5'
+    if not 1 <= page <= pages:
+        return []
+    meanings = list(app.en_to_zh)
+    return [{
+        'slug': f'{level}-{page}-{i}',
+        'japanese': [{'word': f'{level}語{page}-{i}', 'reading': f'ご{page}-{i}'}],
+        'senses': [{'english_definitions': [meanings[(page * 20 + i) % len(meanings)]]}],
+        'tags': [],
+    } for i in range(20)]
+
+class FakeUpstreamHandler(BaseHTTPRequestHandler):
+    """本地替身服务：/translate_tts 返回假的 MP3 数据，/api/v1/search/words 模拟 Jisho 搜索"""
+
+    protocol_version = 'HTTP/1.1'  # 支持长连接
+    disable_nagle_algorithm = True
+    latency = 0.0
+    chunk_delay = 0.0
+    jisho_pages = 30
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        if self.latency:
+            time.sleep(self.latency)
+        if url.path == '/translate_tts':
+            text = params.get('q', [''])[0]
+            body = b'ID3' + hashlib.sha256(text.encode('utf-8')).digest() * 1024
+            self.send_response(200)
+            self.send_header('Content-Type', 'audio/mpeg')
+        elif url.path == '/api/v1/search/words':
+            page = int(params.get('page', ['1'])[0])
+            data = fake_jisho_page(params.get('keyword', [''])[0], page, self.jisho_pages)
+            body = json.dumps({'data': data}, ensure_ascii=False).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+        else:
+            body = b'not found'
+            self.send_response(404)
+            self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        # 模拟上游边合成边返回
+        chunk_size = 8 * 1024
+        for start in range(0, len(body), chunk_size):
+            if start and self.chunk_delay:
+                time.sleep(self.chunk_delay)
+            self.wfile.write(body[start:start + chunk_size])
+            self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+def start_fake_upstream(port=0, latency=0.0, chunk_delay=0.0, jisho_pages=30):
+    """在后台线程中启动替身服务，返回 (server, 基础 URL)"""
+    handler = type('Handler', (FakeUpstreamHandler,),
+                   {'latency': latency, 'chunk_delay': chunk_delay, 'jisho_pages': jisho_pages})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+def run_fake_upstream(args):
+    """以前台方式运行替身服务"""
+    server, base_url = start_fake_upstream(args.port, args.latency, args.chunk_delay)
+    print(f"替身服务已启动: {base_url}")
+    print(f"TTS 地址模板: {base_url}/translate_tts?tl={{lang}}&q={{text}}")
+    print(f"Jisho 地址: {base_url}/api/v1/search/words")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+def bench_speak(args):
+    """在替身 TTS 上比较两种 /speak 实现，每次请求都使用未缓存的文本"""
+    server, base_url = start_fake_upstream(latency=args.latency, chunk_delay=args.chunk_delay)
+    app.TTS_URL = base_url + '/translate_tts?tl={lang}&q={text}'
+    client = app.app.test_client()
+    with tempfile.TemporaryDirectory() as tmp:
+        app.audio_cache = app.AudioCache(tmp)
+        for streaming in (False, True):
+            app.TTS_STREAMING = streaming
+            ttfb, total = [], []
+            for i in range(args.rounds):
+                started = time.perf_counter()
+                response = client.get(f'/speak?text=bench-{streaming}-{i}-{random.random()}', buffered=False)
+                chunks = iter(response.response)
+                next(chunks)
+                ttfb.append(time.perf_counter() - started)
+                for _ in chunks:
+                    pass
+                response.close()
+                total.append(time.perf_counter() - started)
+            name = 'stream' if streaming else 'buffered'
+            print(f"\n{name} ({args.rounds} 次)")
+            print_report('time to first byte', ttfb)
+            print_report('total', total)
+    server.shutdown()
+
+# 在子进程中运行某个源码目录下的 app，便于测量 RSS 和比较不同提交
+LOAD_SERVER_SCRIPT = '''
+import logging, sys
+sys.path.insert(0, sys.argv[1])
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+import app
+app.app.run(host='127.0.0.1', port=int(sys.argv[2]), threaded=True)
+'''
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def read_rss(pid):
+    """读取进程当前的常驻内存（字节），不支持时返回 None"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+def start_app_server(source_dir, workdir, env):
+    """在 workdir 中启动 source_dir 下的 app，等待可以访问后返回 (进程, 基础 URL)"""
+    port = free_port()
+    log = open(Path(workdir) / 'server.log', 'ab')
+    process = subprocess.Popen([sys.executable, '-c', LOAD_SERVER_SCRIPT, str(source_dir), str(port)],
+                               cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'服务进程退出，日志见 {workdir}/server.log')
+        try:
+            if requests.get(base_url + '/', timeout=1).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('服务启动超时')
+
+def run_learners(base_url, concurrency, duration, speak_ratio, seed=0, batch=0):
+    """并发模拟学习者: get_word -> check_answer -> (按比例) speak，返回各路由的耗时、错误数和答题数
+
+    batch 大于 0 时改为每次 /get_words 取一批、本地判题后用 /check_answers 一次同步。
+    """
+    levels = ['N5', 'N4', 'N3', 'N2', 'N1']
+    routes = ('/get_words', '/check_answers', '/speak') if batch else ('/get_word', '/check_answer', '/speak')
+    samples = {route: [] for route in routes}
+    errors = {route: 0 for route in samples}
+    answered = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def timed(local, local_errors, route, call):
+        started = time.perf_counter()
+        try:
+            response = call()
+            ok = response.status_code == 200
+            response.content  # 读完响应体
+        except requests.RequestException:
+            response, ok = None, False
+        local[route].append(time.perf_counter() - started)
+        if not ok:
+            local_errors[route] += 1
+        return response if ok else None
+
+    def learner(index):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()  # 保存会话 cookie，相当于一个学习者
+        level = rng.choice(levels)
+        local = {route: [] for route in samples}
+        local_errors = {route: 0 for route in samples}
+        local_answered = 0
+        while batch and time.perf_counter() < deadline:
+            response = timed(local, local_errors, '/get_words', lambda: session.get(
+                f'{base_url}/get_words', params={'level': level, 'n': batch}, timeout=30))
+            if response is None:
+                continue
+            answers = []
+            for word in response.json()['words']:
+                mode = word['mode']
+                answers.append({'word_id': word['id'], 'mode': mode,
+                                'answer': word[mode] if rng.random() < 0.7 else word[mode] + 'x'})
+                if rng.random() < speak_ratio:
+                    timed(local, local_errors, '/speak',
+                          lambda: session.get(f'{base_url}/speak', params={'text': word['kanji']}, timeout=30))
+            timed(local, local_errors, '/check_answers', lambda: session.post(
+                f'{base_url}/check_answers', json={'level': level, 'answers': answers}, timeout=30))
+            local_answered += len(answers)
+        while not batch and time.perf_counter() < deadline:
+            response = timed(local, local_errors, '/get_word',
+                             lambda: session.get(f'{base_url}/get_word', params={'level': level}, timeout=30))
+            if response is None:
+                continue
+            data = response.json()
+            word, mode = data['word'], data['mode']
+            answer = word[mode] if rng.random() < 0.7 else word[mode] + 'x'
+            timed(local, local_errors, '/check_answer', lambda: session.post(
+                f'{base_url}/check_answer', timeout=30,
+                json={'level': level, 'word_id': word['id'], 'mode': mode, 'answer': answer}))
+            if rng.random() < speak_ratio:
+                timed(local, local_errors, '/speak',
+                      lambda: session.get(f'{base_url}/speak', params={'text': word['kanji']}, timeout=30))
+            local_answered += 1
+        session.close()
+        with lock:
+            answered[0] += local_answered
+            for route in samples:
+                samples[route].extend(local[route])
+                errors[route] += local_errors[route]
+
+    threads = [threading.Thread(target=learner, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors, answered[0]
+
+def summarize_route(samples, errors, elapsed):
+    ordered = sorted(samples)
+    if not ordered:
+        return {'requests': 0, 'errors': errors, 'rps': 0.0, 'p50_ms': None, 'p99_ms': None}
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'rps': round(len(ordered) / elapsed, 1),
+        'p50_ms': round(ordered[len(ordered) // 2] * 1000, 2),
+        'p99_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 2),
+    }
+
+def run_load(source_dir, args):
+    """对一份源码跑一轮压测，返回结果报告"""
+    with tempfile.TemporaryDirectory() as workdir:
+        print(f"生成合成词典 ({args.rows} 行)...")
+        build_synthetic_edict(str(Path(workdir) / app.EDICT_DB), args.rows)
+        upstream, upstream_url = start_fake_upstream(latency=args.upstream_latency)
+        env = dict(os.environ,
+                   TTS_URL=upstream_url + '/translate_tts?tl={lang}&q={text}',
+                   JISHO_API_URL=upstream_url + '/api/v1/search/words',
+                   JISHO_MIRROR=str(Path(workdir) / 'jisho.db'),
+                   TTS_CACHE_DIR=str(Path(workdir) / 'tts_cache'),
+                   LOG_LEVEL='WARNING')
+        env.pop('VOCAB_STORE', None)
+        process, base_url = start_app_server(source_dir, workdir, env)
+        try:
+            # 预热：打开词典连接池、建立各级别词池
+            run_learners(base_url, min(args.concurrency, 5), args.warmup, args.speak_ratio, seed=1, batch=args.batch)
+
+            peak_rss = [read_rss(process.pid)]
+            sampling = threading.Event()
+
+            def sample_rss():
+                while not sampling.wait(0.2):
+                    rss = read_rss(process.pid)
+                    if rss is not None:
+                        peak_rss.append(rss)
+
+            sampler = threading.Thread(target=sample_rss, daemon=True)
+            sampler.start()
+            print(f"{args.concurrency} 个学习者并发 {args.duration}s ...")
+            started = time.perf_counter()
+            samples, errors, answered = run_learners(base_url, args.concurrency, args.duration, args.speak_ratio,
+                                                     batch=args.batch)
+            elapsed = time.perf_counter() - started
+            sampling.set()
+            sampler.join()
+        finally:
+            process.terminate()
+            process.wait(10)
+            upstream.shutdown()
+
+    all_samples = [s for route_samples in samples.values() for s in route_samples]
+    rss_values = [rss for rss in peak_rss if rss is not None]
+    return {
+        'source': str(source_dir),
+        'concurrency': args.concurrency,
+        'seconds': round(elapsed, 2),
+        'total': summarize_route(all_samples, sum(errors.values()), elapsed),
+        'routes': {route: summarize_route(samples[route], errors[route], elapsed) for route in samples},
+        'answers_per_sec': round(answered / elapsed, 1),
+        'peak_rss_mb': round(max(rss_values) / 2 ** 20, 1) if rss_values else None,
+    }
+
+def print_load_report(report):
+    print(f"\n{report['source']}  并发 {report['concurrency']}，{report['seconds']}s，"
+          f"答题 {report['answers_per_sec']} 个/秒，峰值 RSS {report['peak_rss_mb']} MB")
+    for name, stats in [('total', report['total'])] + list(report['routes'].items()):
+        if not stats['requests']:
+            continue
+        print(f"{name:<14} {stats['requests']:>8} 请求 {stats['errors']:>5} 错误 {stats['rps']:>9} 请求/秒"
+              f"  p50 {stats['p50_ms']}ms  p99 {stats['p99_ms']}ms")
+
+@contextmanager
+def checkout(rev):
+    """把某个提交检出到临时工作区"""
+    repo = Path(__file__).resolve().parent
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'src'
+        subprocess.run(['git', '-C', str(repo), 'worktree', 'add', '--detach', str(path), rev],
+                       check=True, capture_output=True)
+        try:
+            yield path
+        finally:
+            subprocess.run(['git', '-C', str(repo), 'worktree', 'remove', '--force', str(path)],
+                           check=False, capture_output=True)
+
+def bench_load(args):
+    """启动真实的 HTTP 服务并模拟学习者压测，可比较两个提交"""
+    if not args.compare:
+        report = run_load(Path(__file__).resolve().parent, args)
+        print_load_report(report)
+        reports = [report]
+    else:
+        reports = []
+        for rev in args.compare:
+            with checkout(rev) as source_dir:
+                report = run_load(source_dir, args)
+            report['source'] = rev
+            print_load_report(report)
+            reports.append(report)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        base, head = reports
+        regressions = []
+        print(f"\n{base['source']} -> {head['source']}")
+        for name in ['total'] + list(base['routes']):
+            before = base['total'] if name == 'total' else base['routes'][name]
+            after = head['total'] if name == 'total' else head['routes'][name]
+            if not before['requests'] or not after['requests']:
+                continue
+            rps_change = (after['rps'] - before['rps']) / before['rps'] * 100
+            p99_change = (after['p99_ms'] - before['p99_ms']) / before['p99_ms'] * 100
+            print(f"{name:<14} 吞吐量 {rps_change:+.1f}%  p99 {p99_change:+.1f}%")
+            if rps_change < -args.threshold or p99_change > args.threshold:
+                regressions.append(name)
+        if regressions:
+            print(f"性能回退超过 {args.threshold}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+def bench_cold_start(args):
+    """在没有 edict.db 的目录中启动服务，测量首次下载导入后开始出 EDICT 词和词包可用的时间
+
+    --vocab-store 时先用命令行导入词典并 build-store，再以 VOCAB_STORE 启动，检查词汇库部署下的词包。
+    词包中的词都要带有干扰项，否则选择题只能随机出选项。
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        source = Path(workdir) / 'edict2.gz'
+        print(f"生成合成 edict2.gz ({args.rows} 行)...")
+        write_synthetic_edict_gz(source, args.rows)
+        env = dict(os.environ,
+                   EDICT_URL=str(source),
+                   JISHO_MIRROR=str(Path(workdir) / 'jisho.db'),
+                   PROGRESS_DB=str(Path(workdir) / 'progress.db'),
+                   TTS_CACHE_DIR=str(Path(workdir) / 'tts_cache'),
+                   LOG_LEVEL='WARNING')
+        env.pop('VOCAB_STORE', None)
+        source_dir = Path(__file__).resolve().parent
+        if args.vocab_store:
+            for command in (['import-edict', '--source', str(source)], ['build-store', '--output', 'vocab.bin']):
+                subprocess.run([sys.executable, str(source_dir / 'app.py'), *command],
+                               cwd=workdir, env=env, check=True, capture_output=True)
+            env['VOCAB_STORE'] = 'vocab.bin'
+        started = time.perf_counter()
+        process, base_url = start_app_server(source_dir, workdir, env)
+        timings = {'server': time.perf_counter() - started}
+        try:
+            # 每次请求都是新会话，避免复习队列里留着导入前的基本词汇
+            deadline = started + args.timeout
+            while time.perf_counter() < deadline:
+                response = requests.get(base_url + '/get_word?level=N5', timeout=args.timeout)
+                if response.status_code == 200 and response.json()['word']['kanji'].startswith('語'):
+                    timings['edict_word'] = time.perf_counter() - started
+                    break
+                time.sleep(0.1)
+            try:
+                response = requests.get(base_url + '/pack/N5', timeout=max(1.0, deadline - time.perf_counter()))
+                if response.status_code == 200:
+                    timings['pack'] = time.perf_counter() - started
+                    words = response.json()['words']
+                    with_distractors = sum(1 for word in words if word[4])
+            except requests.RequestException:
+                pass
+        finally:
+            process.terminate()
+            process.wait(10)
+
+    for name, label in (('server', '服务可访问'), ('edict_word', '出 EDICT 词'), ('pack', '/pack/N5 可用')):
+        value = timings.get(name)
+        print(f"{label:<14} {f'{value:.2f}s' if value is not None else f'超过 {args.timeout}s'}")
+    if len(timings) < 3:
+        print("首次启动未能在限定时间内完成导入")
+        sys.exit(1)
+    print(f"{'带干扰项的词':<14} {with_distractors}/{len(words)}")
+    if with_distractors < len(words):
+        print("词包中有词缺少干扰项")
+        sys.exit(1)
+
+def build_review_queue(pool, cards, now, rng):
+    """生成一个已复习过 cards 个词的复习队列，到期时间分布在过去一小时到未来两个月之间"""
+    review_queue = app.ReviewQueue(pool)
+    for index in rng.sample(range(len(pool)), cards):
+        card = app.Card(pool[index], now)
+        card.reps = rng.randint(1, 8)
+        card.interval = rng.uniform(1, 60)
+        card.ease = rng.uniform(app.SRS_MIN_EASE, app.SRS_INITIAL_EASE)
+        card.due = now + rng.uniform(-3600, 60 * app.SRS_DAY)
+        review_queue.cards[card.word['id']] = card
+        review_queue._seq += 1
+        card.seq = review_queue._seq
+        review_queue.heap.append((card.due, card.seq, card))
+    heapq.heapify(review_queue.heap)
+    return review_queue
+
+def bench_srs(args):
+    """测量不同用户数下复习调度（取下一个词并记录回答）的吞吐量"""
+    rng = random.Random(0)
+    pool = app.LevelPool('N1', tuple({'id': f'w{i}', 'kanji': f'語{i}', 'kana': f'ご{i}', 'chinese': f'词{i}'}
+                                     for i in range(args.cards * 2)))
+    for users in args.users:
+        now = time.time()
+        started = time.perf_counter()
+        queues = [build_review_queue(pool, args.cards, now, rng) for _ in range(users)]
+        print(f"\n{users} 个用户，每人 {args.cards} 张卡片 (生成耗时 {time.perf_counter() - started:.1f}s)")
+
+        samples = []
+        for _ in range(args.ops):
+            review_queue = queues[rng.randrange(users)]
+            now += args.step
+            started = time.perf_counter()
+            word = review_queue.draw(now)
+            quality = app.SRS_QUALITY_CORRECT if rng.random() < args.accuracy else app.SRS_QUALITY_WRONG
+            review_queue.review(review_queue.cards[word['id']], quality, now)
+            samples.append(time.perf_counter() - started)
+        print_report('draw + review', samples)
+        heap_size = sum(len(review_queue.heap) for review_queue in queues) / users
+        print(f"{'throughput':<28} {len(samples) / sum(samples):>10.0f} ops/s"
+              f"  平均堆大小 {heap_size:.0f}")
+        del queues
+
+def to_katakana(text):
+    return ''.join(chr(ord(ch) + 0x60) if 'ぁ' <= ch <= 'ゖ' else ch for ch in text)
+
+def to_halfwidth(text):
+    """片假名转半角，浊音拆成基字加半角浊音符号"""
+    halfwidth = {unicodedata.normalize('NFKC', chr(code)): chr(code) for code in range(0xFF61, 0xFFA0)}
+    halfwidth.update({'\u3099': 'ﾞ', '\u309a': 'ﾟ'})
+    return ''.join(halfwidth.get(ch, ch) for ch in unicodedata.normalize('NFD', to_katakana(text)))
+
+def build_answer_corpus(words, rng):
+    """生成 words 个假名词，每个词带有罗马字写法"""
+    syllables = [(consonant + vowel, kana[i])
+                 for consonant, kana in app.ROMAJI_ROWS.items() if consonant not in 'xl'
+                 for i, vowel in enumerate('aiueo')]
+    syllables += [(prefix + vowel, base + small)
+                  for prefix, base in app.ROMAJI_YOUON.items()
+                  for vowel, small in zip('auo', 'ゃゅょ')]
+    corpus = []
+    for _ in range(words):
+        parts = rng.choices(syllables, k=rng.randint(2, 5))
+        corpus.append((''.join(kana for _, kana in parts), ''.join(romaji for romaji, _ in parts)))
+    return corpus
+
+def bench_answers(args):
+    """在大量答案上比较精确比较与归一化判题的吞吐量"""
+    rng = random.Random(0)
+    corpus = build_answer_corpus(args.words, rng)
+    variants = {
+        'exact': lambda kana, romaji: kana,
+        'katakana': lambda kana, romaji: to_katakana(kana),
+        'halfwidth': lambda kana, romaji: to_halfwidth(kana),
+        'romaji': lambda kana, romaji: romaji,
+        'ROMAJI': lambda kana, romaji: romaji.upper(),
+        'wrong': lambda kana, romaji: kana[:-1] + 'ん',
+    }
+    names = list(variants)
+    answers = []
+    for _ in range(args.answers):
+        kana, romaji = corpus[rng.randrange(len(corpus))]
+        name = names[rng.randrange(len(names))]
+        answers.append((name, variants[name](kana, romaji), kana))
+    print(f"{len(answers)} 个答案，{len(corpus)} 个词，写法: {', '.join(names)}")
+
+    app.normalize_expected.cache_clear()
+    for label, match in (('exact ==', lambda answer, expected: answer == expected),
+                         ('grade_answer', lambda answer, expected: app.grade_answer(answer, expected)[0])):
+        accepted = {name: 0 for name in names}
+        started = time.perf_counter()
+        for name, answer, expected in answers:
+            if match(answer, expected):
+                accepted[name] += 1
+        elapsed = time.perf_counter() - started
+        total = {name: sum(1 for item in answers if item[0] == name) for name in names}
+        rates = '  '.join(f'{name} {accepted[name] / total[name]:.0%}' for name in names)
+        print(f"{label:<16} {len(answers) / elapsed:>10.0f} 答案/秒  {elapsed / len(answers) * 1e6:.2f}us/答案  判为正确: {rates}")
+    print(f"标准答案缓存: {app.normalize_expected.cache_info()}")
+
+def full_edit_distance(a, b):
+    """不设上限的 Levenshtein 距离，作为对照"""
+    previous = list(range(len(b) + 1))
+    for i, ch in enumerate(a, 1):
+        current = [i]
+        for j, target in enumerate(b, 1):
+            current.append(min(previous[j - 1] + (ch != target), previous[j] + 1, current[j - 1] + 1))
+        previous = current
+    return previous[-1]
+
+def bench_typos(args):
+    """测量带上限的编辑距离在常见答案长度下的耗时"""
+    cases = [
+        ('相同 (4)', 'たべもの', 'たべもの'),
+        ('替换一个 (4)', 'たべもお', 'たべもの'),
+        ('漏打一个 (4)', 'がっこ', 'がっこう'),
+        ('多打一个 (4)', 'たべえもの', 'たべもの'),
+        ('完全不同 (4)', 'くるまや', 'たべもの'),
+        ('长度差太多 (4)', 'た', 'たべもの'),
+        ('替换两个 (8)', 'とおきょうえぎ', 'とうきょうえき'),
+        ('完全不同 (8)', 'まったくちがうね', 'とうきょうえき'),
+    ]
+    print(f"每种情况 {args.rounds} 次，单位：纳秒/次")
+    print(f"{'情况':<16} {'bounded':>10} {'full':>10}  距离")
+    for name, answer, expected in cases:
+        limit = app.typo_limit(len(expected))
+        timings = []
+        for fn in (lambda: app.bounded_edit_distance(answer, expected, limit),
+                   lambda: full_edit_distance(answer, expected)):
+            started = time.perf_counter()
+            for _ in range(args.rounds):
+                fn()
+            timings.append((time.perf_counter() - started) / args.rounds * 1e9)
+        distance = app.bounded_edit_distance(answer, expected, limit)
+        print(f"{name:<16} {timings[0]:>10.0f} {timings[1]:>10.0f}  "
+              f"{distance if distance <= limit else f'>{limit}'} (上限 {limit})")
+
+def main():
+    parser = argparse.ArgumentParser(description='NiHonnGo 性能基准测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sampling_parser = subparsers.add_parser('sampling', help='比较词汇随机抽样的两种实现')
+    sampling_parser.add_argument('--db', help='使用已有的 edict.db，默认生成合成词典')
+    sampling_parser.add_argument('--rows', type=int, default=200000, help='合成词典的行数')
+    sampling_parser.add_argument('--rounds', type=int, default=200, help='每种实现的执行次数')
+    sampling_parser.add_argument('--limit', type=int, default=20, help='每次抽取的词数')
+    sampling_parser.set_defaults(func=bench_sampling)
+
+    stress_parser = subparsers.add_parser('stress', help='并发压测 /get_word 和 /check_answer 并检查缓存不变量')
+    stress_parser.add_argument('--threads', type=int, default=32, help='并发线程数')
+    stress_parser.add_argument('--requests', type=int, default=200, help='每个线程的答题轮数')
+    stress_parser.set_defaults(func=bench_stress)
+
+    fake_parser = subparsers.add_parser('fake-upstream', help='运行本地替身上游服务（TTS、Jisho）')
+    fake_parser.add_argument('--port', type=int, default=8900, help='监听端口')
+    fake_parser.add_argument('--latency', type=float, default=0.0, help='每个请求额外延迟的秒数')
+    fake_parser.add_argument('--chunk-delay', type=float, default=0.0, help='每个 8KB 数据块之间的延迟秒数')
+    fake_parser.set_defaults(func=run_fake_upstream)
+
+    speak_parser = subparsers.add_parser('speak', help='比较 /speak 整段缓冲与流式转发的首字节和总耗时')
+    speak_parser.add_argument('--rounds', type=int, default=50, help='每种模式的请求次数')
+    speak_parser.add_argument('--latency', type=float, default=0.05, help='替身 TTS 的首包延迟')
+    speak_parser.add_argument('--chunk-delay', type=float, default=0.01, help='替身 TTS 每个数据块之间的延迟')
+    speak_parser.set_defaults(func=bench_speak)
+
+    load_parser = subparsers.add_parser('load', help='启动服务并模拟学习者压测，报告吞吐量、延迟和 RSS')
+    load_parser.add_argument('--concurrency', type=int, default=20, help='并发学习者数')
+    load_parser.add_argument('--duration', type=float, default=20.0, help='压测秒数')
+    load_parser.add_argument('--warmup', type=float, default=3.0, help='预热秒数')
+    load_parser.add_argument('--rows', type=int, default=200000, help='合成词典的行数')
+    load_parser.add_argument('--speak-ratio', type=float, default=0.3, help='答题后请求发音的比例')
+    load_parser.add_argument('--upstream-latency', type=float, default=0.05, help='替身上游每个请求的延迟')
+    load_parser.add_argument('--batch', type=int, default=0, help='大于 0 时使用 /get_words 和 /check_answers 批量答题')
+    load_parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help='比较两个提交')
+    load_parser.add_argument('--threshold', type=float, default=10.0, help='比较时判定为回退的百分比')
+    load_parser.add_argument('--json', help='把结果写入 JSON 文件')
+    load_parser.set_defaults(func=bench_load)
+
+    cold_parser = subparsers.add_parser('cold-start', help='在空目录中启动服务，检查首次导入 EDICT 后能正常出词')
+    cold_parser.add_argument('--rows', type=int, default=50000, help='合成 edict2.gz 的行数')
+    cold_parser.add_argument('--timeout', type=float, default=60.0, help='等待导入完成的秒数')
+    cold_parser.add_argument('--vocab-store', action='store_true', help='先导入并 build-store，再以 VOCAB_STORE 启动')
+    cold_parser.set_defaults(func=bench_cold_start)
+
+    srs_parser = subparsers.add_parser('srs', help='测量不同用户数下复习调度的吞吐量')
+    srs_parser.add_argument('--users', type=int, nargs='+', default=[1, 10, 100], help='用户数，可以给多个')
+    srs_parser.add_argument('--cards', type=int, default=10000, help='每个用户已复习过的卡片数')
+    srs_parser.add_argument('--ops', type=int, default=200000, help='每种用户数下的调度次数')
+    srs_parser.add_argument('--step', type=float, default=1.0, help='每次调度之间推进的模拟秒数')
+    srs_parser.add_argument('--accuracy', type=float, default=0.85, help='答对的比例')
+    srs_parser.set_defaults(func=bench_srs)
+
+    answers_parser = subparsers.add_parser('answers', help='比较精确比较与归一化判题的吞吐量')
+    answers_parser.add_argument('--answers', type=int, default=1000000, help='答案数')
+    answers_parser.add_argument('--words', type=int, default=5000, help='不同的词数')
+    answers_parser.set_defaults(func=bench_answers)
+
+    typos_parser = subparsers.add_parser('typos', help='测量带上限的编辑距离的耗时')
+    typos_parser.add_argument('--rounds', type=int, default=200000, help='每种情况的执行次数')
+    typos_parser.set_defaults(func=bench_typos)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
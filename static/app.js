@@ -0,0 +1,946 @@
+let currentWord = null;
+let currentMode = null;
+let currentLevel = 'N5';
+let stats = {
+    correct: 0,
+    incorrect: 0
+};
+let currentAudio = null;
+
+// 创建音频元素
+const audioElement = new Audio();
+
+// 播放当前词汇的发音
+async function playCurrentWord() {
+    const soundIcon = document.getElementById('soundIcon');
+    const soundError = document.getElementById('soundError');
+    const loadingSpinner = soundIcon.querySelector('.sound-loading');
+
+    if (!currentWord || (!currentWord.kanji && !currentWord.kana)) {
+        soundError.textContent = '没有可用的发音文本';
+        soundError.style.display = 'block';
+        return;
+    }
+
+    // 如果正在播放或加载中，不执行任何操作
+    if (soundIcon.classList.contains('playing') || loadingSpinner.style.display === 'flex') {
+        return;
+    }
+
+    try {
+        // 优先使用汉字进行发音，如果没有汉字则使用假名
+        const text = currentWord.kanji || currentWord.kana;
+
+        // 显示加载动画
+        loadingSpinner.style.display = 'flex';
+        soundIcon.classList.add('disabled');
+        soundError.style.display = 'none';
+
+        // 如果有正在播放的音频，停止它
+        if (currentAudio) {
+            currentAudio.pause();
+            currentAudio.currentTime = 0;
+        }
+
+        // 发送发音请求，GET 形式可以命中浏览器缓存
+        const response = await fetch(`/speak?text=${encodeURIComponent(text)}`);
+
+        if (!response.ok) {
+            const errorData = await response.json();
+            throw new Error(errorData.details || '发音请求失败');
+        }
+
+        const audioBlob = await response.blob();
+        const audioUrl = URL.createObjectURL(audioBlob);
+
+        // 创建新的音频实例
+        currentAudio = new Audio(audioUrl);
+
+        // 音频加载完成时的处理
+        currentAudio.oncanplaythrough = () => {
+            loadingSpinner.style.display = 'none';
+            soundIcon.classList.remove('disabled');
+            soundIcon.classList.add('playing');
+        };
+
+        // 音频播放结束时的处理
+        currentAudio.onended = () => {
+            URL.revokeObjectURL(audioUrl);
+            soundIcon.classList.remove('playing');
+        };
+
+        // 错误处理
+        currentAudio.onerror = (error) => {
+            console.error('音频加载失败:', error);
+            soundError.textContent = '音频加载失败';
+            soundError.style.display = 'block';
+            loadingSpinner.style.display = 'none';
+            soundIcon.classList.remove('disabled');
+        };
+
+        // 播放音频
+        await currentAudio.play();
+    } catch (error) {
+        console.error('播放失败:', error);
+        soundError.textContent = error.message || '发音失败';
+        soundError.style.display = 'block';
+        loadingSpinner.style.display = 'none';
+        soundIcon.classList.remove('disabled');
+    }
+}
+
+// 检查是否启用自动发音
+function isAutoSoundEnabled() {
+    return document.getElementById('autoSound').checked;
+}
+
+function isChoiceModeEnabled() {
+    return document.getElementById('choiceMode').checked;
+}
+
+// 选择题模式下显示选项，点击选项即作答
+function renderChoices() {
+    const container = document.getElementById('choices');
+    container.innerHTML = '';
+    if (!isChoiceModeEnabled() || !currentWord || !currentWord.choices) return;
+    for (const choice of currentWord.choices) {
+        const button = document.createElement('button');
+        button.className = 'choice-btn';
+        button.textContent = choice;
+        button.addEventListener('click', () => {
+            document.getElementById('answerInput').value = choice;
+            checkAnswer();
+        });
+        container.appendChild(button);
+    }
+}
+let remainingWords = 0;
+let isLoadingWords = false;
+
+// 一次取一批词在本地出题，答案在本地判定后分批同步给服务器
+const WORD_BATCH_SIZE = 10;
+const WORD_QUEUE_LOW = 3;
+const ANSWER_SYNC_BATCH = 10;
+let wordQueue = [];
+let pendingAnswers = [];
+let isSyncingAnswers = false;
+
+function updateStats() {
+    document.getElementById('correctCount').textContent = stats.correct;
+    document.getElementById('incorrectCount').textContent = stats.incorrect;
+    const total = stats.correct + stats.incorrect;
+    const accuracy = total > 0 ? Math.round((stats.correct / total) * 100) : 0;
+    document.getElementById('accuracy').textContent = accuracy;
+    document.getElementById('remainingWords').textContent = remainingWords;
+}
+
+async function fetchNewWords(retryCount = 0) {
+    const maxRetries = 3;
+    const loadingDiv = document.getElementById('loading');
+
+    if (isLoadingWords) return;
+    isLoadingWords = true;
+
+    try {
+        // 队列为空时才显示加载状态，后台预取不打扰用户
+        if (wordQueue.length === 0) {
+            loadingDiv.textContent = '正在获取新词汇...';
+            loadingDiv.style.display = 'block';
+        }
+
+        const level = currentLevel;
+        const response = await fetch(`/get_words?level=${level}&n=${WORD_BATCH_SIZE}&refresh=true&choices=true`);
+        if (!response.ok) {
+            throw new Error('获取词汇失败');
+        }
+
+        const data = await response.json();
+        if (data.error) {
+            throw new Error(data.error);
+        }
+
+        // 等待期间切换了级别，丢弃这批词
+        if (level !== currentLevel) return;
+
+        // 跳过已经在队列中或正在作答的词
+        const queued = new Set(wordQueue.map(word => word.id));
+        if (currentWord) queued.add(currentWord.id);
+        wordQueue.push(...data.words.filter(word => !queued.has(word.id)));
+        remainingWords = data.remaining_words;
+        console.log(`成功获取 ${data.words.length} 个新词汇，剩余数量: ${remainingWords}`);
+
+        // 更新级别按钮状态
+        document.querySelectorAll('.level-btn').forEach(btn => {
+            if (btn.dataset.level === currentLevel) {
+                btn.classList.remove('loading');
+            }
+        });
+
+    } catch (error) {
+        console.error('获取新词失败:', error);
+
+        if (retryCount < maxRetries) {
+            // 重试
+            console.log(`重试获取新词 (${retryCount + 1}/${maxRetries})...`);
+            loadingDiv.textContent = `获取失败，正在重试 (${retryCount + 1}/${maxRetries})...`;
+            isLoadingWords = false;
+            await new Promise(resolve => setTimeout(resolve, 1000));
+            return fetchNewWords(retryCount + 1);
+        } else {
+            // 达到最大重试次数
+            loadingDiv.textContent = '获取新词汇失败，请稍后再试';
+            throw new Error('获取新词汇失败，已达到最大重试次数');
+        }
+    } finally {
+        isLoadingWords = false;
+        // 如果成功获取了词汇，隐藏加载提示
+        if (wordQueue.length > 0) {
+            loadingDiv.style.display = 'none';
+        }
+    }
+}
+
+// 离线词包：下载一次后在本地出题，按与服务器 ReviewQueue 相同的 SM-2 规则调度
+const DECK_SIZE = 20;
+const SRS_INITIAL_EASE = 2.5;
+const SRS_MIN_EASE = 1.3;
+const SRS_QUALITY_CORRECT = 4;  // 答对、差一点、答错对应的 SM-2 回答质量
+const SRS_QUALITY_ALMOST = 2;
+const SRS_QUALITY_WRONG = 1;
+const SRS_RELEARN_DELAY = 30;  // 答错的词30秒后再出现
+const SRS_DAY = 86400;
+const CHOICE_COUNT = 4;
+let levelPack = null;
+let localCards = new Map();  // 词 id -> { ease, interval, reps, due }，due 为秒
+let cardHeap = [];  // [到期时间, 序号, 词 id] 的最小堆，与服务器 ReviewQueue 相同
+let cardSeq = new Map();  // 词 id -> 该卡片最新堆项的序号，序号对不上的堆项已失效
+let nextSeq = 0;
+let learningCards = 0;  // 还在学习中的卡片数
+
+async function loadLevelPack(level) {
+    try {
+        // 离线时由 Service Worker 返回缓存的词包
+        const response = await fetch(`/pack/${level}`);
+        if (!response.ok) {
+            throw new Error('获取词包失败');
+        }
+        const pack = await response.json();
+        if (level !== currentLevel || pack.words.length === 0) return false;
+
+        const words = pack.words.map(([id, kanji, kana, chinese, distractors]) => ({ id, kanji, kana, chinese, distractors: distractors || [] }));
+        const cards = await loadLocalCards(level);
+        if (level !== currentLevel) return false;
+
+        levelPack = {
+            level: level,
+            words: words,
+            index: new Map(words.map((word, i) => [word.id, i]))
+        };
+        // 词包更新后不在其中的词不再出题
+        localCards = new Map();
+        cardHeap = [];
+        cardSeq = new Map();
+        learningCards = 0;
+        for (const [id, card] of cards) {
+            if (levelPack.index.has(id)) addLocalCard(id, card);
+        }
+        remainingWords = learningCards;
+        console.log(`已加载 ${level} 词包，共 ${levelPack.words.length} 个词，已复习 ${localCards.size} 个`);
+        return true;
+    } catch (error) {
+        console.error('获取词包失败，改为在线取词:', error);
+        levelPack = null;
+        return false;
+    }
+}
+
+function heapLess(a, b) {
+    return a[0] < b[0] || (a[0] === b[0] && a[1] < b[1]);
+}
+
+function pushCard(id, card) {
+    const entry = [card.due, ++nextSeq, id];
+    cardSeq.set(id, nextSeq);
+    cardHeap.push(entry);
+    let i = cardHeap.length - 1;
+    while (i > 0) {
+        const parent = (i - 1) >> 1;
+        if (!heapLess(entry, cardHeap[parent])) break;
+        cardHeap[i] = cardHeap[parent];
+        i = parent;
+    }
+    cardHeap[i] = entry;
+}
+
+function popCard() {
+    const last = cardHeap.pop();
+    if (cardHeap.length === 0) return;
+    let i = 0;
+    for (;;) {
+        let child = 2 * i + 1;
+        if (child >= cardHeap.length) break;
+        if (child + 1 < cardHeap.length && heapLess(cardHeap[child + 1], cardHeap[child])) child++;
+        if (!heapLess(cardHeap[child], last)) break;
+        cardHeap[i] = cardHeap[child];
+        i = child;
+    }
+    cardHeap[i] = last;
+}
+
+// 堆顶的有效项，顺便丢弃已失效的项
+function topCard() {
+    while (cardHeap.length) {
+        const entry = cardHeap[0];
+        if (cardSeq.get(entry[2]) === entry[1]) return entry;
+        popCard();
+    }
+    return null;
+}
+
+function addLocalCard(id, card) {
+    localCards.set(id, card);
+    if (card.reps === 0) learningCards++;
+    pushCard(id, card);
+    return id;
+}
+
+// 先出已到期的词；没有到期的词时，在学的词不足 DECK_SIZE 就加入新词，否则提前复习最早到期的
+function drawLocalWord() {
+    const now = Date.now() / 1000;
+    const top = topCard();
+    let nextId = top && top[2];
+    if ((top === null || top[0] > now) && learningCards < DECK_SIZE) {
+        nextId = introduceLocalWord(now) ?? nextId;
+    }
+    if (nextId === null) return null;
+
+    const word = levelPack.words[levelPack.index.get(nextId)];
+    const mode = Math.random() < 0.5 ? 'kana' : 'kanji';
+    return { ...word, mode: mode, choices: pickLocalChoices(word, mode) };
+}
+
+// 从词包中随机挑一个还没学过的词，几次都撞上学过的词时放弃
+function introduceLocalWord(now) {
+    const size = levelPack.words.length;
+    for (let attempt = 0; attempt < 8 && size; attempt++) {
+        const id = levelPack.words[Math.floor(Math.random() * size)].id;
+        if (!localCards.has(id)) {
+            return addLocalCard(id, { ease: SRS_INITIAL_EASE, interval: 0, reps: 0, due: now });
+        }
+    }
+    return null;
+}
+
+// 按回答质量更新卡片，与服务器 Card.review 相同
+function reviewLocalWord(wordId, quality) {
+    const now = Date.now() / 1000;
+    if (!localCards.has(wordId)) {
+        addLocalCard(wordId, { ease: SRS_INITIAL_EASE, interval: 0, reps: 0, due: now });
+    }
+    const card = localCards.get(wordId);
+    const wasLearning = card.reps === 0;
+    if (quality >= 3) {
+        if (card.reps === 0) {
+            card.interval = 1;
+        } else if (card.reps === 1) {
+            card.interval = 6;
+        } else {
+            card.interval = Math.round(card.interval * card.ease * 100) / 100;
+        }
+        card.reps++;
+        card.due = now + card.interval * SRS_DAY;
+    } else {
+        // 答错后重新学习，本次练习中稍后再出现
+        card.reps = 0;
+        card.interval = 0;
+        card.due = now + SRS_RELEARN_DELAY;
+    }
+    card.ease = Math.max(SRS_MIN_EASE, card.ease + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02));
+    learningCards += (card.reps === 0) - wasLearning;
+    remainingWords = learningCards;
+    pushCard(wordId, card);
+    saveLocalCard(levelPack.level, wordId, card);
+}
+
+function shuffle(items) {
+    for (let i = items.length - 1; i > 0; i--) {
+        const j = Math.floor(Math.random() * (i + 1));
+        [items[i], items[j]] = [items[j], items[i]];
+    }
+    return items;
+}
+
+// 与服务器 pick_choices 相同：先从词包中预先计算的干扰项里随机取，不够时随机补充
+function pickLocalChoices(word, mode) {
+    const words = levelPack.words;
+    const options = [word[mode]];
+    const add = index => {
+        const option = words[index] && words[index][mode];
+        if (option && !options.includes(option)) options.push(option);
+    };
+    const candidates = shuffle([...word.distractors]);
+    for (const index of candidates) {
+        if (options.length >= CHOICE_COUNT) break;
+        add(index);
+    }
+    for (let attempt = 0; attempt < 8 && options.length < CHOICE_COUNT; attempt++) {
+        add(Math.floor(Math.random() * words.length));
+    }
+    return shuffle(options);
+}
+
+// 未同步的答案和词包的复习进度保存在 IndexedDB 中，离线或刷新页面都不会丢失
+function openStateStore() {
+    return new Promise((resolve, reject) => {
+        const request = indexedDB.open('nihongo', 2);
+        request.onupgradeneeded = event => {
+            const db = request.result;
+            if (event.oldVersion < 1) db.createObjectStore('state');
+            if (event.oldVersion < 2) {
+                // 复习进度改为每张卡片一条记录，键为 `级别:词 id`，把旧版整个级别一条的记录拆开
+                const cards = db.createObjectStore('cards');
+                if (event.oldVersion < 1) return;
+                const state = request.transaction.objectStore('state');
+                state.openCursor().onsuccess = cursorEvent => {
+                    const cursor = cursorEvent.target.result;
+                    if (!cursor) return;
+                    const match = /^cards-(.+)$/.exec(cursor.key);
+                    if (match) {
+                        for (const [id, card] of Object.entries(cursor.value || {})) {
+                            cards.put(card, `${match[1]}:${id}`);
+                        }
+                        cursor.delete();
+                    }
+                    cursor.continue();
+                };
+            }
+        };
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+async function savePendingAnswers() {
+    try {
+        const db = await openStateStore();
+        db.transaction('state', 'readwrite').objectStore('state').put(pendingAnswers, 'pendingAnswers');
+    } catch (error) {
+        console.error('保存未同步的答案失败:', error);
+    }
+}
+
+async function loadPendingAnswers() {
+    try {
+        const db = await openStateStore();
+        const saved = await new Promise((resolve, reject) => {
+            const request = db.transaction('state').objectStore('state').get('pendingAnswers');
+            request.onsuccess = () => resolve(request.result || []);
+            request.onerror = () => reject(request.error);
+        });
+        pendingAnswers = saved.concat(pendingAnswers);
+    } catch (error) {
+        console.error('读取未同步的答案失败:', error);
+    }
+}
+
+// 每次答题只写回这一张卡片
+async function saveLocalCard(level, id, card) {
+    try {
+        const db = await openStateStore();
+        db.transaction('cards', 'readwrite').objectStore('cards').put(card, `${level}:${id}`);
+    } catch (error) {
+        console.error('保存复习进度失败:', error);
+    }
+}
+
+async function loadLocalCards(level) {
+    try {
+        const db = await openStateStore();
+        return await new Promise((resolve, reject) => {
+            const cards = [];
+            const prefix = `${level}:`;
+            const range = IDBKeyRange.bound(prefix, prefix + '\uffff');
+            const request = db.transaction('cards').objectStore('cards').openCursor(range);
+            request.onsuccess = () => {
+                const cursor = request.result;
+                if (!cursor) return resolve(cards);
+                cards.push([cursor.key.slice(prefix.length), cursor.value]);
+                cursor.continue();
+            };
+            request.onerror = () => reject(request.error);
+        });
+    } catch (error) {
+        console.error('读取复习进度失败:', error);
+        return [];
+    }
+}
+
+// 从服务器读取该级别的累计统计，加上本地还没同步的答案
+async function loadProgress(level) {
+    try {
+        const response = await fetch(`/progress?level=${level}`);
+        if (!response.ok) {
+            throw new Error('获取学习进度失败');
+        }
+        const data = await response.json();
+        if (level !== currentLevel) return;
+        const pending = pendingAnswers.filter(item => item.level === level);
+        stats.correct = data.correct + pending.filter(item => item.correct).length;
+        stats.incorrect = data.incorrect + pending.filter(item => !item.correct).length;
+        updateStats();
+    } catch (error) {
+        console.error('获取学习进度失败:', error);
+    }
+}
+
+// 与服务器的 CHECK_ANSWERS_LIMIT 相同：每个请求最多同步这么多答案
+const CHECK_ANSWERS_LIMIT = 100;
+
+// 从队列中取出队首级别的下一批答案
+function takeAnswerBatch() {
+    const level = pendingAnswers[0].level;
+    const batch = [];
+    pendingAnswers = pendingAnswers.filter(item => {
+        if (item.level !== level || batch.length >= CHECK_ANSWERS_LIMIT) return true;
+        batch.push(item);
+        return false;
+    });
+    const body = JSON.stringify({
+        level: level,
+        answers: batch.map(({ word_id, mode, answer }) => ({ word_id, mode, answer }))
+    });
+    return { level, batch, body };
+}
+
+// 把本地判定过的答案分批同步给服务器，直到队列清空；useBeacon 用于页面关闭前
+async function syncAnswers(useBeacon = false) {
+    if (pendingAnswers.length === 0 || (isSyncingAnswers && !useBeacon) || !navigator.onLine) return;
+
+    if (useBeacon && navigator.sendBeacon) {
+        const failed = [];
+        while (pendingAnswers.length > 0) {
+            const { batch, body } = takeAnswerBatch();
+            if (!navigator.sendBeacon('/check_answers', new Blob([body], { type: 'application/json' }))) {
+                failed.push(...batch);
+            }
+        }
+        pendingAnswers = failed.concat(pendingAnswers);
+        savePendingAnswers();
+        return;
+    }
+
+    isSyncingAnswers = true;
+    try {
+        // 同步期间新答的题会排在后面，同一轮里一起发出
+        while (pendingAnswers.length > 0 && navigator.onLine) {
+            const { level, batch, body } = takeAnswerBatch();
+            let response;
+            try {
+                response = await fetch('/check_answers', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: body
+                });
+            } catch (error) {
+                // 网络失败时放回队列，下次再发
+                pendingAnswers = batch.concat(pendingAnswers);
+                throw error;
+            }
+            if (response.status >= 400 && response.status < 500) {
+                // 服务器拒绝的批次重发也不会成功，丢弃以免堵住后面的答案
+                console.error('服务器拒绝了一批答案:', response.status);
+                continue;
+            }
+            if (!response.ok) {
+                pendingAnswers = batch.concat(pendingAnswers);
+                throw new Error('Network response was not ok');
+            }
+            const result = await response.json();
+            // 使用词包时剩余词数以本地复习队列为准
+            if (level === currentLevel && !levelPack) {
+                remainingWords = result.remaining_words;
+                updateStats();
+            }
+        }
+    } catch (error) {
+        console.error('同步答案失败:', error);
+    } finally {
+        isSyncingAnswers = false;
+        savePendingAnswers();
+    }
+}
+
+// 在获取新词时自动播放
+async function getNewWord(retryCount = 0) {
+    const maxRetries = 3;
+    const resultDiv = document.getElementById('result');
+    const answerInput = document.getElementById('answerInput');
+
+    try {
+        if (levelPack && levelPack.level === currentLevel) {
+            // 有词包时直接在本地按复习队列出题
+            const word = drawLocalWord();
+            wordQueue = word ? [word] : [];
+        } else if (wordQueue.length === 0) {
+            // 队列用完时等待新的一批，快用完时在后台预取
+            resultDiv.textContent = '加载中...';
+            resultDiv.className = 'result';
+            answerInput.disabled = true;
+            await fetchNewWords();
+        } else if (wordQueue.length < WORD_QUEUE_LOW) {
+            fetchNewWords().catch(error => console.error('预取新词失败:', error));
+        }
+
+        if (wordQueue.length === 0) {
+            throw new Error('获取词汇失败');
+        }
+
+        // 更新当前词汇
+        currentWord = wordQueue.shift();
+        currentMode = currentWord.mode;
+
+        // 更新显示
+        document.getElementById('chinese').textContent = currentWord.chinese;
+        answerInput.value = '';
+        answerInput.placeholder = currentMode === 'kana' ? '输入假名' : '输入汉字';
+        resultDiv.textContent = '';
+        renderChoices();
+
+        // 重新启用输入
+        answerInput.disabled = false;
+        answerInput.focus();
+
+        // 更新统计
+        updateStats();
+
+        // 如果启用了自动发音，播放当前词汇
+        if (isAutoSoundEnabled()) {
+            setTimeout(() => {
+                playCurrentWord().catch(error => {
+                    console.error('自动发音失败:', error);
+                });
+            }, 300);
+        }
+
+    } catch (error) {
+        console.error('获取新词失败:', error);
+
+        if (retryCount < maxRetries) {
+            // 重试
+            console.log(`重试获取新词 (${retryCount + 1}/${maxRetries})...`);
+            resultDiv.textContent = `加载失败，正在重试 (${retryCount + 1}/${maxRetries})...`;
+            setTimeout(() => getNewWord(retryCount + 1), 1000);
+        } else {
+            // 达到最大重试次数
+            resultDiv.textContent = '获取词汇失败，请点击任意级别按钮重试';
+            resultDiv.className = 'result incorrect';
+            answerInput.disabled = false;
+            answerInput.placeholder = '暂时无法获取新词';
+        }
+    }
+}
+
+// 答案归一化，与服务器 normalize_answer 的规则一致：全角/半角、片假名/平假名、大小写、空白，罗马字转假名
+const ROMAJI_ROWS = {
+    '': 'あいうえお', k: 'かきくけこ', s: 'さしすせそ', t: 'たちつてと', n: 'なにぬねの',
+    h: 'はひふへほ', m: 'まみむめも', r: 'らりるれろ', g: 'がぎぐげご', z: 'ざじずぜぞ',
+    d: 'だぢづでど', b: 'ばびぶべぼ', p: 'ぱぴぷぺぽ', x: 'ぁぃぅぇぉ', l: 'ぁぃぅぇぉ'
+};
+const ROMAJI_YOUON = {
+    ky: 'き', sh: 'し', sy: 'し', ch: 'ち', ty: 'ち', cy: 'ち', ny: 'に', hy: 'ひ',
+    my: 'み', ry: 'り', gy: 'ぎ', j: 'じ', jy: 'じ', zy: 'じ', dy: 'ぢ', by: 'び', py: 'ぴ'
+};
+const ROMAJI_EXTRA = {
+    shi: 'し', chi: 'ち', tsu: 'つ', fu: 'ふ', ji: 'じ', ya: 'や', yu: 'ゆ', yo: 'よ',
+    wa: 'わ', wo: 'を', n: 'ん', "n'": 'ん', xn: 'ん', fa: 'ふぁ', fi: 'ふぃ', fe: 'ふぇ',
+    fo: 'ふぉ', vu: 'ゔ', she: 'しぇ', che: 'ちぇ', je: 'じぇ',
+    xya: 'ゃ', xyu: 'ゅ', xyo: 'ょ', lya: 'ゃ', lyu: 'ゅ', lyo: 'ょ',
+    xtsu: 'っ', xtu: 'っ', ltu: 'っ', xwa: 'ゎ', '-': 'ー'
+};
+
+function buildRomajiTrie() {
+    const table = {};
+    const setDefault = (key, value) => { if (!(key in table)) table[key] = value; };
+    for (const [consonant, kana] of Object.entries(ROMAJI_ROWS)) {
+        [...'aiueo'].forEach((vowel, i) => setDefault(consonant + vowel, kana[i]));
+    }
+    for (const [prefix, kana] of Object.entries(ROMAJI_YOUON)) {
+        [...'auo'].forEach((vowel, i) => setDefault(prefix + vowel, kana + 'ゃゅょ'[i]));
+    }
+    Object.assign(table, ROMAJI_EXTRA);
+    for (const [key, value] of Object.entries({ ...table })) {
+        if ('bcdfghjkmpqrstvwz'.includes(key[0])) setDefault(key[0] + key, 'っ' + value);
+        if (key.startsWith('ch')) setDefault('t' + key, 'っ' + value);
+    }
+    const root = new Map();
+    for (const [key, value] of Object.entries(table)) {
+        let node = root;
+        for (const ch of key) {
+            if (!node.has(ch)) node.set(ch, new Map());
+            node = node.get(ch);
+        }
+        node.value = value;
+    }
+    return root;
+}
+
+const ROMAJI_TRIE = buildRomajiTrie();
+
+function romajiToKana(text) {
+    let result = '';
+    let i = 0;
+    while (i < text.length) {
+        let node = ROMAJI_TRIE;
+        let match = text[i];
+        let end = i + 1;
+        for (let j = i; j < text.length; j++) {
+            node = node.get(text[j]);
+            if (!node) break;
+            if (node.value !== undefined) {
+                match = node.value;
+                end = j + 1;
+            }
+        }
+        result += match;
+        i = end;
+    }
+    return result;
+}
+
+// 折叠表与服务器 build_answer_fold 按相同的规则生成，只折叠这些字符，其他字符原样保留
+function buildAnswerFold() {
+    const table = new Map();
+    const fold = text => [...text].map(ch => table.has(ch) ? table.get(ch) : ch).join('');
+    for (let code = 0x30A1; code < 0x30F7; code++) {
+        table.set(String.fromCharCode(code), String.fromCharCode(code - 0x60));  // ァ-ヶ -> ぁ-ゖ
+    }
+    table.set('ヽ', 'ゝ');
+    table.set('ヾ', 'ゞ');
+    for (let code = 0x41; code <= 0x5A; code++) {
+        table.set(String.fromCharCode(code), String.fromCharCode(code).toLowerCase());
+    }
+    for (let code = 0xFF01; code < 0xFF5F; code++) {
+        table.set(String.fromCharCode(code), String.fromCharCode(code - 0xFEE0).toLowerCase());  // 全角 ASCII
+    }
+    for (let code = 0xFF61; code < 0xFFA0; code++) {
+        // 半角片假名；浊音符号变成组合字符，之后由 NFC 合成
+        table.set(String.fromCharCode(code), fold(String.fromCharCode(code).normalize('NFKC')));
+    }
+    for (const ch of ' \t　') table.set(ch, '');
+    return table;
+}
+
+const ANSWER_FOLD = buildAnswerFold();
+
+function normalizeAnswer(text) {
+    text = [...text].map(ch => ANSWER_FOLD.has(ch) ? ANSWER_FOLD.get(ch) : ch).join('');
+    if (/[゙゚]/.test(text)) text = text.normalize('NFC');
+    return /[a-z]/.test(text) ? romajiToKana(text) : text;
+}
+
+// 拼写容错，与服务器 grade_answer 的规则一致：编辑距离在上限内时判为“差一点”并标出位置
+function typoLimit(length) {
+    return length <= 2 ? 0 : length <= 6 ? 1 : 2;
+}
+
+function editAlignment(fullA, fullB) {
+    // 先去掉公共前缀和后缀，与服务器的对齐方式一致
+    let start = 0;
+    let endA = fullA.length;
+    let endB = fullB.length;
+    while (start < endA && start < endB && fullA[start] === fullB[start]) start++;
+    while (endA > start && endB > start && fullA[endA - 1] === fullB[endB - 1]) {
+        endA--;
+        endB--;
+    }
+    const a = fullA.slice(start, endA);
+    const b = fullB.slice(start, endB);
+    const last = fullB.length - 1;
+    const rows = [Array.from({ length: b.length + 1 }, (_, j) => j)];
+    for (let i = 1; i <= a.length; i++) {
+        const row = [i];
+        for (let j = 1; j <= b.length; j++) {
+            row.push(Math.min(rows[i - 1][j - 1] + (a[i - 1] !== b[j - 1] ? 1 : 0), rows[i - 1][j] + 1, row[j - 1] + 1));
+        }
+        rows.push(row);
+    }
+    const positions = new Set();
+    let i = a.length;
+    let j = b.length;
+    while (i || j) {
+        if (i && j && rows[i][j] === rows[i - 1][j - 1] + (a[i - 1] !== b[j - 1] ? 1 : 0)) {
+            if (a[i - 1] !== b[j - 1]) positions.add(start + j - 1);
+            i--;
+            j--;
+        } else if (j && rows[i][j] === rows[i][j - 1] + 1) {
+            positions.add(start + j - 1);
+            j--;
+        } else {
+            positions.add(Math.min(start + j, last));
+            i--;
+        }
+    }
+    return { distance: rows[a.length][b.length], positions: [...positions].sort((x, y) => x - y) };
+}
+
+// 返回 { correct, highlight }，highlight 只在差一点时是数组
+function gradeAnswer(answer, expected) {
+    if (answer === expected) return { correct: true, highlight: null };
+    const normalized = [...normalizeAnswer(answer)];
+    const target = [...normalizeAnswer(expected)];
+    if (normalized.join('') === target.join('')) return { correct: true, highlight: null };
+    const limit = typoLimit(target.length);
+    if (!limit || Math.abs(normalized.length - target.length) > limit) return { correct: false, highlight: null };
+    const { distance, positions } = editAlignment(normalized, target);
+    if (distance > limit) return { correct: false, highlight: null };
+    return { correct: false, highlight: target.length === [...expected].length ? positions : [] };
+}
+
+function highlightAnswer(answer, positions) {
+    return [...answer].map((ch, i) => positions.includes(i) ? `<mark>${ch}</mark>` : ch).join('');
+}
+
+function checkAnswer() {
+    const userInput = document.getElementById('answerInput').value;
+    const resultDiv = document.getElementById('result');
+
+    if (!userInput || !currentWord) return;
+
+    // 本地判题，结果攒够一批再同步
+    const correctAnswer = currentWord[currentMode];
+    const grade = gradeAnswer(userInput, correctAnswer);
+    pendingAnswers.push({
+        level: currentLevel,
+        word_id: currentWord.id,
+        mode: currentMode,
+        answer: userInput,
+        correct: grade.correct
+    });
+
+    if (levelPack && levelPack.level === currentLevel) {
+        reviewLocalWord(currentWord.id, grade.correct ? SRS_QUALITY_CORRECT :
+            grade.highlight ? SRS_QUALITY_ALMOST : SRS_QUALITY_WRONG);
+    }
+
+    if (grade.correct) {
+        resultDiv.textContent = '正确！';
+        resultDiv.className = 'result correct';
+        stats.correct++;
+        if (!levelPack || levelPack.level !== currentLevel) {
+            remainingWords = Math.max(0, remainingWords - 1);
+        }
+        setTimeout(getNewWord, 300);
+    } else if (grade.highlight) {
+        resultDiv.innerHTML = `差一点！<br>正确答案：${highlightAnswer(correctAnswer, grade.highlight)}`;
+        resultDiv.className = 'result almost';
+        stats.incorrect++;
+    } else {
+        resultDiv.innerHTML = `错误！<br>正确答案：${correctAnswer}`;
+        resultDiv.className = 'result incorrect';
+        stats.incorrect++;
+    }
+    updateStats();
+
+    if (pendingAnswers.length >= ANSWER_SYNC_BATCH) {
+        syncAnswers();
+    } else {
+        savePendingAnswers();
+    }
+}
+
+// 初始化事件监听器
+document.addEventListener('DOMContentLoaded', () => {
+    // 级别选择事件处理
+    document.querySelectorAll('.level-btn').forEach(button => {
+        button.addEventListener('click', async function() {
+            const newLevel = this.dataset.level;
+            if (newLevel === currentLevel) return;
+
+            // 更新按钮状态
+            document.querySelector('.level-btn.active').classList.remove('active');
+            this.classList.add('active');
+            this.classList.add('loading');
+
+            // 先同步上一个级别的答案，再更新当前级别并读取该级别的累计统计
+            syncAnswers();
+            currentLevel = newLevel;
+            stats.correct = 0;
+            stats.incorrect = 0;
+            loadProgress(newLevel);
+            remainingWords = 0;
+            wordQueue = [];
+            currentWord = null;
+            levelPack = null;
+
+            try {
+                // 获取新词
+                if (!await loadLevelPack(newLevel)) {
+                    await fetchNewWords();
+                }
+                await getNewWord();
+            } catch (error) {
+                console.error('切换级别失败:', error);
+            } finally {
+                // 移除加载状态
+                this.classList.remove('loading');
+            }
+
+            updateStats();
+        });
+    });
+
+    // 输入框回车事件
+    document.getElementById('answerInput').addEventListener('keypress', function(e) {
+        if (e.key === 'Enter' && !this.disabled) {
+            checkAnswer();
+        }
+    });
+
+    // 切换选择题模式时立即显示或隐藏当前词的选项
+    document.getElementById('choiceMode').addEventListener('change', renderChoices);
+
+    // 自动发音开关事件
+    document.getElementById('autoSound').addEventListener('change', function() {
+        if (this.checked && currentWord) {
+            playCurrentWord().catch(error => {
+                console.error('自动发音失败:', error);
+            });
+        }
+    });
+
+    // 页面隐藏或关闭前同步剩余的答案
+    document.addEventListener('visibilitychange', () => {
+        if (document.visibilityState === 'hidden') {
+            syncAnswers(true);
+        }
+    });
+
+    // 恢复网络后同步离线期间的答案
+    window.addEventListener('online', () => syncAnswers());
+
+    // 缓存页面和词包，断网后仍可使用
+    if ('serviceWorker' in navigator) {
+        // 首次访问时页面还不受 Service Worker 控制，词包请求没有进缓存；接管后重新请求当前级别的词包
+        if (!navigator.serviceWorker.controller) {
+            navigator.serviceWorker.addEventListener('controllerchange', () => {
+                if (levelPack) {
+                    fetch(`/pack/${levelPack.level}`).catch(error => console.error('缓存词包失败:', error));
+                }
+            }, { once: true });
+        }
+        navigator.serviceWorker.register('/sw.js').catch(error => {
+            console.error('Service Worker 注册失败:', error);
+        });
+    }
+
+    // 初始加载：优先使用词包，拿不到时改为在线取词
+    loadPendingAnswers().then(() => {
+        loadProgress(currentLevel);
+        syncAnswers();
+    });
+    loadLevelPack(currentLevel).then(loaded => loaded || fetchNewWords()).then(() => getNewWord()).catch(error => {
+        console.error('初始化失败:', error);
+    });
+});
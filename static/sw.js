@@ -0,0 +1,50 @@
+// 离线缓存：页面和词包优先走网络、断网时用缓存；带哈希的资源缓存优先
+const CACHE_NAME = 'nihongo-v1';
+// 安装时预缓存页面和资源，首次访问后即可离线使用；服务器提供 sw.js 时把资源换成带哈希的文件名
+const PRECACHE_URLS = ['/', '/static/style.css', '/static/app.js'];
+const DEFAULT_PACK_URL = '/pack/N5';
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE_NAME)
+            .then(cache => cache.addAll(PRECACHE_URLS)
+                // 默认级别的词包；词典不可用时没有词包，不影响安装
+                .then(() => cache.add(DEFAULT_PACK_URL).catch(() => {})))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(names.filter(name => name !== CACHE_NAME).map(name => caches.delete(name))))
+            .then(() => self.clients.claim())
+    );
+});
+
+function cacheResponse(request, response) {
+    if (response.ok) {
+        const copy = response.clone();
+        caches.open(CACHE_NAME).then(cache => cache.put(request, copy));
+    }
+    return response;
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== 'GET' || url.origin !== self.location.origin) return;
+
+    if (url.pathname.startsWith('/static/')) {
+        // 文件名带内容哈希，内容永远不变
+        event.respondWith(
+            caches.match(request).then(cached => cached || fetch(request).then(response => cacheResponse(request, response)))
+        );
+    } else if (url.pathname === '/' || url.pathname.startsWith('/pack/')) {
+        event.respondWith(
+            fetch(request)
+                .then(response => cacheResponse(request, response))
+                .catch(() => caches.match(request))
+        );
+    }
+});